@@ -1,5 +1,5 @@
 import React, { useState, useEffect, ChangeEvent } from 'react';
-import { fetchPlayers, fetchPlayerDescription, PlayerStats, updatePlayer } from './api';
+import { fetchPlayers, streamPlayerDescription, subscribeToPage, PlayerStats, updatePlayer } from './api';
 
 const PlayerCard: React.FC<{ player: PlayerStats, playerId: number, setPlayers: React.Dispatch<React.SetStateAction<PlayerStats[]>> }> = ({ player, playerId, setPlayers }) => {
   const [description, setDescription] = useState<string | null>(null);
@@ -11,7 +11,10 @@ const PlayerCard: React.FC<{ player: PlayerStats, playerId: number, setPlayers:
   const loadDescription = async () => {
     setIsLoading(true);
     try {
-      const desc = await fetchPlayerDescription(playerId);
+      const desc = await streamPlayerDescription(playerId, (text) => {
+        setIsLoading(false);
+        setDescription(text);
+      });
       setDescription(desc);
     } catch {
       setDescription(null);
@@ -330,9 +333,9 @@ const App: React.FC = () => {
   const [error, setError] = useState<string | null>(null);
 
   useEffect(() => {
-    const loadPlayers = async () => {
+    const loadPlayers = async (showLoading = true) => {
       try {
-        setIsLoading(true);
+        setIsLoading(showLoading);
         const data = await fetchPlayers(currentPage);
         setPlayers(data.players);
         setTotalPages(data.total_pages);
@@ -345,6 +348,30 @@ const App: React.FC = () => {
     };
 
     loadPlayers();
+
+    let pageIds: number[] | null = null;
+    // Edits and new descriptions arrive as they are written, instead of polling
+    return subscribeToPage(currentPage, 10, {
+      onSnapshot: (snapshot) => {
+        const byId = new Map(snapshot.map(player => [player.id, player]));
+        setPlayers(prevPlayers => prevPlayers.map(player => byId.get(player.id) ?? player));
+      },
+      onChanges: (changes, deleted) => {
+        const byId = new Map(changes.map(change => [change.id, change.set]));
+        setPlayers(prevPlayers => prevPlayers
+          .filter(player => !deleted.includes(player.id))
+          .map(player => (byId.has(player.id) ? { ...player, ...byId.get(player.id) } : player)));
+      },
+      // Players moved on or off the page; reload it for the new order and totals
+      onPageChange: (playerIds) => {
+        if (!pageIds) {
+          pageIds = playerIds;
+        } else if (playerIds.join() !== pageIds.join()) {
+          pageIds = playerIds;
+          loadPlayers(false);
+        }
+      },
+    });
   }, [currentPage]);
 
   const handlePageChange = (newPage: number) => {
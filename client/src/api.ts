@@ -32,8 +32,9 @@ export interface PlayersResponse {
   players: PlayerStats[];
   total_players: number;
   total_pages: number;
-  current_page: number;
+  current_page: number | null;
   page_size: number;
+  next: string | null;
 }
 
 export const fetchPlayers = async (page = 1, pageSize = 10): Promise<PlayersResponse> => {
@@ -65,6 +66,29 @@ export const fetchPlayerDescription = async (playerId: number): Promise<string>
   }
 };
 
+export const streamPlayerDescription = (
+  playerId: number,
+  onText: (text: string) => void,
+): Promise<string> => {
+  return new Promise((resolve) => {
+    const source = new EventSource(`${BASE_URL}/player/${playerId}/description/stream`);
+    let text = '';
+    source.addEventListener('token', (event) => {
+      text += JSON.parse((event as MessageEvent).data).text;
+      onText(text);
+    });
+    source.addEventListener('done', (event) => {
+      source.close();
+      resolve(JSON.parse((event as MessageEvent).data).description);
+    });
+    source.onerror = () => {
+      console.error('Failed to stream player description');
+      source.close();
+      resolve(text || 'Description unavailable');
+    };
+  });
+};
+
 export const updatePlayer = async (player_id: number, player: PlayerStats): Promise<any> => {
   try {
     const response = await axios.put(`${BASE_URL}/players/${player_id}`, player);
@@ -73,4 +97,36 @@ export const updatePlayer = async (player_id: number, player: PlayerStats): Prom
     console.error(`Failed to update player with id ${player_id}`, error);
     throw error;
   }
-};
\ No newline at end of file
+};
+export interface PlayerChange {
+  id: number;
+  set: Partial<PlayerStats> & Record<string, unknown>;
+  unset?: string[];
+}
+
+export interface LiveHandlers {
+  onSnapshot: (players: PlayerStats[]) => void;
+  onChanges: (changes: PlayerChange[], deleted: number[]) => void;
+  onPageChange: (playerIds: number[]) => void;
+}
+
+export const subscribeToPage = (page: number, pageSize: number, handlers: LiveHandlers): (() => void) => {
+  const socket = new WebSocket(`${BASE_URL.replace(/^http/, 'ws')}/players/live`);
+  socket.onopen = () => {
+    socket.send(JSON.stringify({ page: { page, page_size: pageSize } }));
+  };
+  socket.onmessage = (event) => {
+    const message = JSON.parse(event.data);
+    if (message.type === 'snapshot') {
+      handlers.onSnapshot(message.players);
+    } else if (message.type === 'changes') {
+      handlers.onChanges(message.players, message.deleted);
+    } else if (message.type === 'page') {
+      handlers.onPageChange(message.player_ids);
+    } else if (message.type === 'error') {
+      console.error('Live updates error', message.detail);
+    }
+  };
+  socket.onerror = () => console.error('Live updates connection failed');
+  return () => socket.close();
+};
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+FAKE_OLLAMA_TOKENS_PER_SEC = float(os.getenv("FAKE_OLLAMA_TOKENS_PER_SEC", "60"))
+FAKE_OLLAMA_ERROR_RATE = float(os.getenv("FAKE_OLLAMA_ERROR_RATE", "0"))
+# Requests the fake model works on at once; like OLLAMA_NUM_PARALLEL, the
+# rest wait in line, which is what queue time measures
+FAKE_OLLAMA_PARALLEL = int(os.getenv("FAKE_OLLAMA_PARALLEL", "4"))
+FAKE_OLLAMA_TOKENS = int(os.getenv("FAKE_OLLAMA_TOKENS", "60"))
+# Time to process the prompt before the first token
+FAKE_OLLAMA_PROMPT_SECONDS = float(os.getenv("FAKE_OLLAMA_PROMPT_SECONDS", "0.05"))
+# Share of chat requests that hang, like a stuck model server
+FAKE_OLLAMA_STALL_RATE = float(os.getenv("FAKE_OLLAMA_STALL_RATE", "0"))
+STALL_SECONDS = 3600
+EMBEDDING_DIMENSIONS = 64
+
+WORDS = (
+    "A durable slugger with a quick bat, patient eye and steady glove who "
+    "grinds out at-bats, runs hard on every ball in play and leads quietly "
+    "in the clubhouse after years of climbing through the minor leagues"
+).split()
+
+
+def create_app(
+    tokens_per_sec: float = FAKE_OLLAMA_TOKENS_PER_SEC,
+    error_rate: float = FAKE_OLLAMA_ERROR_RATE,
+    parallel: int = FAKE_OLLAMA_PARALLEL,
+    tokens: int = FAKE_OLLAMA_TOKENS,
+    prompt_seconds: float = FAKE_OLLAMA_PROMPT_SECONDS,
+    stall_rate: float = FAKE_OLLAMA_STALL_RATE,
+    seed: Optional[int] = None,
+) -> FastAPI:
+    """
+    Build a stand-in for the parts of the Ollama HTTP API the server uses.
+
+    Generation takes `tokens / tokens_per_sec` seconds after a fixed prompt
+    processing time, at most `parallel` requests are served at once, and a
+    share `error_rate` of chat requests fail with a 500 and a share
+    `stall_rate` never answer. Requests with a `format` are answered as
+    description batches, one description per numbered player line. Responses
+    carry the same timing fields as Ollama's (durations in nanoseconds).
+    """
+    app = FastAPI()
+    rng = random.Random(seed)
+    slots = asyncio.Semaphore(parallel)
+    app.state.requests = 0
+    app.state.errors = 0
+
+    def text(count: int) -> list:
+        return [WORDS[i % len(WORDS)] + " " for i in range(count)]
+
+    def timings(started: float, count: int, eval_seconds: float) -> Dict[str, Any]:
+        return {
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((time.monotonic() - started) * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": 40,
+            "prompt_eval_duration": int(prompt_seconds * 1e9),
+            "eval_count": count,
+            "eval_duration": int(eval_seconds * 1e9),
+        }
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        if rng.random() < error_rate:
+            app.state.errors += 1
+            return JSONResponse({"error": "simulated failure"}, status_code=500)
+        if rng.random() < stall_rate:
+            await asyncio.sleep(STALL_SECONDS)
+        model = body.get("model")
+        pieces = text(tokens)
+        delay = 1 / tokens_per_sec if tokens_per_sec > 0 else 0
+
+        if body.get("stream"):
+            async def stream():
+                async with slots:
+                    started = time.monotonic()
+                    await asyncio.sleep(prompt_seconds)
+                    eval_started = time.monotonic()
+                    for piece in pieces:
+                        await asyncio.sleep(delay)
+                        yield json.dumps({
+                            "model": model,
+                            "message": {"role": "assistant", "content": piece},
+                            "done": False,
+                        }) + "\n"
+                    yield json.dumps({
+                        "model": model,
+                        "message": {"role": "assistant", "content": ""},
+                        **timings(started, len(pieces), time.monotonic() - eval_started),
+                    }) + "\n"
+            return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+        content = "".join(pieces).strip()
+        if body.get("format"):
+            # A batch request: one description per numbered player line
+            players = [
+                line.split(".", 1)[0] for line in body["messages"][-1]["content"].splitlines()
+                if line.split(".", 1)[0].isdigit()
+            ]
+            pieces = pieces * len(players)
+            content = json.dumps({"descriptions": [
+                {"player": int(number), "description": content} for number in players
+            ]})
+
+        async with slots:
+            started = time.monotonic()
+            await asyncio.sleep(prompt_seconds + delay * len(pieces))
+            return {
+                "model": model,
+                "message": {"role": "assistant", "content": content},
+                **timings(started, len(pieces), delay * len(pieces)),
+            }
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        return {"model": body.get("model"), "response": "", "done": True}
+
+    @app.post("/api/embed")
+    async def embed(request: Request):
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        # Deterministic per text, so similar-player results are stable
+        return {
+            "model": body.get("model"),
+            "embeddings": [
+                [random.Random(f"{text}:{i}").uniform(-1, 1) for i in range(EMBEDDING_DIMENSIONS)]
+                for text in texts
+            ],
+        }
+
+    @app.post("/api/pull")
+    async def pull():
+        return {"status": "success"}
+
+    return app
+
+
+app = create_app()
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import random
+from typing import Any, Dict, Iterator, List
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+
+STUB_FEED_PLAYERS = int(os.getenv("STUB_FEED_PLAYERS", "100000"))
+STUB_FEED_SEED = int(os.getenv("STUB_FEED_SEED", "1"))
+
+POSITIONS = ("C", "1B", "2B", "3B", "SS", "LF", "CF", "RF", "DH")
+TEAMS = ("Aces", "Bears", "Comets", "Dukes", "Eagles", "Foxes", "Giants", "Hawks")
+
+
+def make_player(index: int, seed: int = STUB_FEED_SEED) -> Dict[str, Any]:
+    """
+    Synthesize one feed record, keyed the way the external feed spells it.
+    The same index and seed always give the same player.
+    """
+    rng = random.Random(seed * 1_000_003 + index)
+    at_bat = rng.randint(50, 650)
+    hits = rng.randint(at_bat // 8, at_bat // 3)
+    doubles = rng.randint(0, hits // 4)
+    home_runs = rng.randint(0, hits // 4)
+    walks = rng.randint(0, 110)
+    on_base = (hits + walks) / (at_bat + walks)
+    slugging = (hits + doubles + 3 * home_runs) / at_bat
+    return {
+        "Player name": f"Player {index:06d}",
+        "position": POSITIONS[index % len(POSITIONS)],
+        "team": TEAMS[rng.randrange(len(TEAMS))],
+        "Games": rng.randint(10, 162),
+        "At-bat": at_bat,
+        "Runs": rng.randint(0, 130),
+        "Hits": hits,
+        "Double (2B)": doubles,
+        "third baseman": rng.randint(0, 10),
+        "home run": home_runs,
+        "run batted in": rng.randint(0, 140),
+        "a walk": walks,
+        "Strikeouts": rng.randint(10, 220),
+        "stolen base": rng.randint(0, 50),
+        "Caught stealing": rng.randint(0, 15),
+        "AVG": round(hits / at_bat, 3),
+        "On-base Percentage": round(on_base, 3),
+        "Slugging Percentage": round(slugging, 3),
+        "On-base Plus Slugging": round(on_base + slugging, 3),
+    }
+
+
+def make_players(count: int, seed: int = STUB_FEED_SEED, start: int = 0) -> List[Dict[str, Any]]:
+    return [make_player(index, seed) for index in range(start, start + count)]
+
+
+def feed_chunks(count: int, seed: int, chunk_size: int = 1000) -> Iterator[bytes]:
+    """
+    Encode the feed as a JSON array in chunks, so 100k+ players are never
+    held in memory at once.
+    """
+    yield b"["
+    for start in range(0, count, chunk_size):
+        players = make_players(min(chunk_size, count - start), seed, start)
+        body = ",".join(json.dumps(player) for player in players)
+        yield (("," if start else "") + body).encode()
+    yield b"]"
+
+
+def create_app(players: int = STUB_FEED_PLAYERS, seed: int = STUB_FEED_SEED) -> FastAPI:
+    """
+    Build a stub of the external baseball feed at GET /baseball.
+
+    The body is streamed and carries an ETag derived from the player count
+    and seed, so conditional requests get a 304 until either is changed
+    (`app.state.players` / `app.state.seed`).
+    """
+    app = FastAPI()
+    app.state.players = players
+    app.state.seed = seed
+
+    @app.get("/baseball")
+    async def feed(request: Request):
+        count, feed_seed = app.state.players, app.state.seed
+        etag = '"' + hashlib.sha1(f"{count}:{feed_seed}".encode()).hexdigest() + '"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return StreamingResponse(
+            feed_chunks(count, feed_seed),
+            media_type="application/json",
+            headers={"ETag": etag},
+        )
+
+    return app
+
+
+app = create_app()
@@ -0,0 +1,111 @@
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from urllib.parse import urlparse, urlunparse
+
+import psycopg2
+import psycopg2.errors
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def local_server() -> Iterator[str]:
+    """
+    Run a throwaway Postgres cluster in a temporary directory and yield its
+    admin URL.
+
+    Uses the `pgserver` package if it is installed, otherwise `initdb` and
+    `pg_ctl` from PATH.
+
+    Raises:
+        RuntimeError: If neither is available
+    """
+    data_dir = tempfile.mkdtemp(prefix="bench-pg-")
+    try:
+        try:
+            import pgserver
+        except ImportError:
+            pgserver = None
+        if pgserver is not None:
+            server = pgserver.get_server(data_dir, cleanup_mode="stop")
+            try:
+                yield server.get_uri()
+            finally:
+                server.cleanup()
+            return
+
+        if not (shutil.which("initdb") and shutil.which("pg_ctl")):
+            raise RuntimeError(
+                "No Postgres available: pass --db-url, install pgserver, "
+                "or put initdb and pg_ctl on PATH"
+            )
+        port = free_port()
+        subprocess.run(
+            ["initdb", "-D", data_dir, "-U", "postgres", "--auth=trust"],
+            check=True, capture_output=True,
+        )
+        subprocess.run(
+            ["pg_ctl", "-D", data_dir, "-w", "-l", os.path.join(data_dir, "server.log"),
+             "-o", f"-p {port} -k {data_dir} -c listen_addresses=127.0.0.1", "start"],
+            check=True, capture_output=True,
+        )
+        try:
+            yield f"postgresql://postgres@127.0.0.1:{port}/postgres"
+        finally:
+            subprocess.run(["pg_ctl", "-D", data_dir, "-m", "fast", "stop"], capture_output=True)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def _with_database(url: str, name: str) -> str:
+    return urlunparse(urlparse(url)._replace(path="/" + name))
+
+
+@contextmanager
+def postgres_fixture(admin_url: Optional[str] = None) -> Iterator[str]:
+    """
+    Yield a DB_URL for a freshly created, empty database, dropped afterwards.
+
+    Args:
+        admin_url: Server to create the database on; a temporary local
+            cluster is started when omitted
+    """
+    if admin_url is None:
+        with local_server() as url:
+            with postgres_fixture(url) as db_url:
+                yield db_url
+        return
+
+    name = f"bench_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(admin_url)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cursor:
+            cursor.execute(f'CREATE DATABASE "{name}"')
+        yield _with_database(admin_url, name)
+    finally:
+        with admin.cursor() as cursor:
+            # Connections the server pool left open would block the drop
+            for _ in range(20):
+                cursor.execute(
+                    "SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                    "WHERE datname = %s AND pid <> pg_backend_pid()",
+                    (name,),
+                )
+                try:
+                    cursor.execute(f'DROP DATABASE IF EXISTS "{name}"')
+                    break
+                except psycopg2.errors.ObjectInUse:
+                    time.sleep(0.1)
+        admin.close()
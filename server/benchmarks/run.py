@@ -0,0 +1,483 @@
+"""
+Benchmark and load-test the API against local stand-ins.
+
+Starts a fake Ollama, a stub player feed and a throwaway Postgres database,
+runs the server in-process with uvicorn and drives it over HTTP. Each
+scenario reports p50/p95/p99 latency, throughput and resident memory, and
+results can be compared against a stored baseline:
+
+    cd server
+    python -m benchmarks.run --save-baseline          # record a baseline
+    python -m benchmarks.run --baseline               # compare against it
+
+Exits with status 1 when a metric regressed by more than --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import threading
+import time
+from contextlib import ExitStack
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import uvicorn
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+from benchmarks import fake_ollama, feed  # noqa: E402
+from benchmarks.postgres import free_port, postgres_fixture  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SCENARIOS = ("paging", "ingest", "descriptions", "churn")
+PAGE_SIZE = 50
+# Direction in which each reported metric improves, for baseline comparison
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "duration_ms", "rss_mb")
+HIGHER_IS_BETTER = ("throughput_rps", "rows_per_sec", "players_per_sec")
+
+
+class BackgroundServer:
+    """
+    Serve an ASGI app with uvicorn on a background thread.
+    """
+
+    def __init__(self, app, port: Optional[int] = None):
+        self.port = port or free_port()
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "BackgroundServer":
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError(f"Server on port {self.port} failed to start")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=30)
+
+
+def rss_mb() -> float:
+    """
+    Current resident set size of this process (server and load generator).
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "rss_mb": rss_mb(),
+    }
+
+
+async def load(
+    request: Callable[[int], Awaitable[httpx.Response]], total: int, concurrency: int
+) -> Dict[str, Any]:
+    """
+    Issue `total` requests from `concurrency` workers and summarize them.
+    Responses with a 4xx/5xx status count as errors.
+    """
+    latencies: List[float] = []
+    errors = 0
+    indexes = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for index in indexes:
+            started = time.perf_counter()
+            try:
+                response = await request(index)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+async def scenario_paging(client: httpx.AsyncClient, args, player_ids: List[int]) -> Dict[str, Any]:
+    results = {}
+    last_page = max(1, (len(player_ids) + PAGE_SIZE - 1) // PAGE_SIZE)
+    for page in sorted({1, max(1, last_page // 2), last_page}):
+        results[f"paging_offset_page_{page}"] = await load(
+            lambda _: client.get("/players", params={"page": page, "page_size": PAGE_SIZE}),
+            args.requests,
+            args.concurrency,
+        )
+
+    # Keyset pagination: follow `next` cursors through the table
+    latencies = []
+    errors = 0
+    params: Dict[str, Any] = {"page_size": PAGE_SIZE}
+    started = time.perf_counter()
+    for _ in range(min(args.requests, last_page)):
+        request_started = time.perf_counter()
+        response = await client.get("/players", params=params)
+        latencies.append(time.perf_counter() - request_started)
+        if response.status_code != 200:
+            errors += 1
+            break
+        cursor = response.json().get("next")
+        if not cursor:
+            break
+        params = {"page_size": PAGE_SIZE, "cursor": cursor}
+    results["paging_cursor_walk"] = summarize(latencies, time.perf_counter() - started, errors)
+    return results
+
+
+async def scenario_ingest(client: httpx.AsyncClient, args, player_ids: List[int]) -> Dict[str, Any]:
+    import database
+    from database_operations import store_players
+    from player_utils import standardize_player_keys
+
+    results = {}
+    for size in args.ingest_sizes:
+        players = standardize_player_keys(feed.make_players(size, seed=args.seed + 1))
+        for index, player in enumerate(players):
+            player["player_name"] = f"Ingest {size} {index:06d}"
+        for phase in ("insert", "unchanged", "update"):
+            if phase == "update":
+                for player in players:
+                    player["hits"] = (player.get("hits") or 0) + 1
+            started_rss = rss_mb()
+            started = time.perf_counter()
+            counts = await store_players(players)
+            elapsed = time.perf_counter() - started
+            results[f"ingest_{size}_{phase}"] = {
+                "rows": size,
+                "errors": 0 if counts else 1,
+                "duration_ms": round(elapsed * 1000, 1),
+                "rows_per_sec": round(size / elapsed, 1) if elapsed else 0.0,
+                "rss_mb": rss_mb(),
+                "rss_delta_mb": round(rss_mb() - started_rss, 1),
+            }
+        with database.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("DELETE FROM players WHERE player_name LIKE %s", (f"Ingest {size} %",))
+            conn.commit()
+    return results
+
+
+def clear_description_cache() -> None:
+    import database
+    from description_cache import _memory_cache
+
+    _memory_cache.clear()
+    with database.pool.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("DELETE FROM description_cache")
+        conn.commit()
+
+
+def model_descriptions() -> float:
+    from metrics import llm_descriptions
+
+    return llm_descriptions.value(source="model")
+
+
+async def scenario_descriptions(client: httpx.AsyncClient, args, player_ids: List[int]) -> Dict[str, Any]:
+    # Both runs describe the same distinct players from an empty description
+    # cache, and players/sec counts only descriptions the model generated, so
+    # cache hits and shared generations do not inflate either figure
+    rng = random.Random(args.seed)
+    ids = rng.sample(player_ids, min(args.description_requests, len(player_ids)))
+
+    clear_description_cache()
+    generated = model_descriptions()
+    started = time.perf_counter()
+    one_at_a_time = await load(
+        lambda index: client.get(
+            f"/player/{ids[index]}/description", params={"regenerate": "true"}
+        ),
+        len(ids),
+        args.concurrency,
+    )
+    one_at_a_time["players_per_sec"] = round(
+        (model_descriptions() - generated) / (time.perf_counter() - started), 1
+    )
+
+    # The same players through the batch API, one request per worker so the
+    # model sees the same concurrency
+    clear_description_cache()
+    chunk = -(-len(ids) // args.concurrency)
+    chunks = [ids[start:start + chunk] for start in range(0, len(ids), chunk)]
+    generated = model_descriptions()
+    started = time.perf_counter()
+    batched = await load(
+        lambda index: client.post(
+            "/players/descriptions", json={"player_ids": chunks[index], "regenerate": True}
+        ),
+        len(chunks),
+        len(chunks),
+    )
+    batched["players_per_sec"] = round(
+        (model_descriptions() - generated) / (time.perf_counter() - started), 1
+    )
+    return {"descriptions_concurrent": one_at_a_time, "descriptions_batched": batched}
+
+
+async def scenario_churn(client: httpx.AsyncClient, args, player_ids: List[int]) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    response = await client.get("/players", params={"page_size": 100})
+    players = response.json()["players"]
+    writes = [
+        (player, rng.randint(0, 250))
+        for player in (rng.choice(players) for _ in range(args.requests))
+    ]
+
+    def put(index: int) -> Awaitable[httpx.Response]:
+        player, hits = writes[index]
+        body = {k: v for k, v in player.items() if k not in ("id", "version")}
+        return client.put(f"/players/{player['id']}", json={**body, "hits": hits})
+
+    def patch(index: int) -> Awaitable[httpx.Response]:
+        player, hits = writes[index]
+        return client.patch(f"/players/{player['id']}", json={"hits": hits})
+
+    return {
+        "put_churn": await load(put, len(writes), args.concurrency),
+        "patch_churn": await load(patch, len(writes), args.concurrency),
+    }
+
+
+SCENARIO_RUNNERS = {
+    "paging": scenario_paging,
+    "ingest": scenario_ingest,
+    "descriptions": scenario_descriptions,
+    "churn": scenario_churn,
+}
+
+
+async def wait_for_ingest(client: httpx.AsyncClient, timeout: float) -> Dict[str, Any]:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            status = (await client.get("/health/ready")).json()
+            state = status["tasks"]["feed_ingest"]["state"]
+            if state == "ready":
+                return (await client.get("/feed/sync")).json()["last_report"]
+            if state == "failed" or status["tasks"]["database"]["state"] == "failed":
+                raise RuntimeError(f"Server failed to start: {status['tasks']}")
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("Timed out waiting for the initial feed ingest")
+
+
+async def run_scenarios(base_url: str, args) -> Dict[str, Any]:
+    import database
+
+    results: Dict[str, Any] = {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        report = await wait_for_ingest(client, args.startup_timeout)
+        results["feed_sync_initial"] = {
+            "rows": report["rows_seen"],
+            "duration_ms": report["duration_ms"],
+            "rows_per_sec": round(report["rows_seen"] / (report["duration_ms"] / 1000), 1)
+            if report["duration_ms"] else 0.0,
+            "rss_mb": rss_mb(),
+        }
+        with database.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT id FROM players ORDER BY id")
+            player_ids = [row[0] for row in cursor.fetchall()]
+        for name in args.scenarios:
+            print(f"Running {name}...", file=sys.stderr)
+            results.update(await SCENARIO_RUNNERS[name](client, args, player_ids))
+    return results
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    List every metric that got worse than the baseline by more than
+    `tolerance` (a fraction).
+    """
+    regressions = []
+    for scenario, metrics in results.items():
+        base = baseline.get(scenario)
+        if not base:
+            continue
+        for metric, value in metrics.items():
+            previous = base.get(metric)
+            if not previous or metric not in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+                continue
+            change = (value - previous) / previous
+            worse = change > tolerance if metric in LOWER_IS_BETTER else change < -tolerance
+            if worse:
+                regressions.append(f"{scenario}.{metric}: {previous} -> {value} ({change:+.0%})")
+    return regressions
+
+
+def print_table(results: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    columns = (
+        "p50_ms", "p95_ms", "p99_ms", "throughput_rps", "rows_per_sec", "players_per_sec", "errors", "rss_mb"
+    )
+    print(f"{'scenario':32}" + "".join(f"{column:>16}" for column in columns))
+    for scenario, metrics in results.items():
+        cells = []
+        for column in columns:
+            value = metrics.get(column)
+            if value is None:
+                cells.append(f"{'-':>16}")
+                continue
+            previous = baseline.get(scenario, {}).get(column)
+            delta = f" ({(value - previous) / previous:+.0%})" if previous else ""
+            cells.append(f"{str(value) + delta:>16}")
+        print(f"{scenario:32}" + "".join(cells))
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", help="Postgres server to create the benchmark database on "
+                        "(default: a temporary local cluster)")
+    parser.add_argument("--players", type=int, default=100_000, help="Players in the stub feed")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per latency scenario")
+    parser.add_argument("--description-requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--ingest-sizes", default="1000,10000,100000",
+                        help="Comma-separated store_players batch sizes")
+    parser.add_argument("--tokens-per-sec", type=float, default=fake_ollama.FAKE_OLLAMA_TOKENS_PER_SEC)
+    parser.add_argument("--error-rate", type=float, default=fake_ollama.FAKE_OLLAMA_ERROR_RATE)
+    parser.add_argument("--ollama-parallel", type=int, default=fake_ollama.FAKE_OLLAMA_PARALLEL)
+    parser.add_argument("--stall-rate", type=float, default=fake_ollama.FAKE_OLLAMA_STALL_RATE,
+                        help="Share of chat requests the fake Ollama never answers")
+    parser.add_argument("--ollama-hosts", type=int, default=1,
+                        help="Fake Ollama servers to spread requests over")
+    parser.add_argument("--failing-hosts", type=int, default=0,
+                        help="How many of those fail every request, to exercise failover")
+    parser.add_argument("--response-cache", action="store_true",
+                        help="Keep the response cache on (it is disabled to measure the database path)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", nargs="?", const=BASELINE_PATH,
+                        help=f"Compare against a baseline file (default {BASELINE_PATH})")
+    parser.add_argument("--save-baseline", nargs="?", const=BASELINE_PATH,
+                        help="Store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="Allowed regression against the baseline, as a fraction")
+    args = parser.parse_args(argv)
+    args.scenarios = [name for name in args.scenarios.split(",") if name]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    args.ingest_sizes = [int(size) for size in args.ingest_sizes.split(",") if size]
+    return args
+
+
+def configure_server(db_url: str, ollama_urls: List[str], feed_url: str, args) -> None:
+    """
+    Point the server at the stand-ins. Must run before the server modules are
+    imported, since they read their settings at import time. Settings
+    already present in the environment win.
+    """
+    settings = {
+        "DB_URL": db_url,
+        # The fixture database is already up; fail fast instead of waiting
+        "DB_CONNECT_RETRIES": "0",
+        "OLLAMA_HOSTS": ",".join(ollama_urls),
+        "PLAYER_FEED_URL": feed_url,
+        "FEED_SYNC_INTERVAL": "0",
+        "DESCRIPTION_WORKER_ENABLED": "false",
+        "LOG_LEVEL": "WARNING",
+    }
+    if not args.response_cache:
+        settings["RESPONSE_CACHE_TTL"] = "0"
+    for name, value in settings.items():
+        os.environ.setdefault(name, value)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    ollama_apps = [
+        fake_ollama.create_app(
+            tokens_per_sec=args.tokens_per_sec,
+            error_rate=1.0 if index < args.failing_hosts else args.error_rate,
+            parallel=args.ollama_parallel,
+            stall_rate=args.stall_rate,
+            seed=args.seed + index,
+        )
+        for index in range(max(args.ollama_hosts, 1))
+    ]
+    feed_app = feed.create_app(players=args.players, seed=args.seed)
+
+    with postgres_fixture(args.db_url) as db_url, ExitStack() as servers:
+        ollama_urls = [servers.enter_context(BackgroundServer(app)).url for app in ollama_apps]
+        feed_server = servers.enter_context(BackgroundServer(feed_app))
+        configure_server(db_url, ollama_urls, f"{feed_server.url}/baseball", args)
+        import main as server_main
+
+        with BackgroundServer(server_main.app) as api_server:
+            results = asyncio.run(run_scenarios(api_server.url, args))
+
+    meta = {
+        "players": args.players,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "tokens_per_sec": args.tokens_per_sec,
+        "ollama_hosts": args.ollama_hosts,
+        "failing_hosts": args.failing_hosts,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    baseline: Dict[str, Any] = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+
+    print_table(results, baseline)
+    document = {"meta": meta, "results": results}
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as output:
+            json.dump(document, output, indent=2)
+        print(f"Wrote {path}", file=sys.stderr)
+
+    if args.baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
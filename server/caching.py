@@ -1,30 +1,216 @@
+import hashlib
+import json
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Set
+from urllib.parse import parse_qsl, urlencode
+
 from fastapi import Request, Response
 from starlette.middleware.base import BaseHTTPMiddleware
 from cachetools import TTLCache
 
+from cluster import cluster
+from metrics import Gauge, cache_requests
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+# Matches /players/{id}... and /player/{id}/...
+PLAYER_PATH = re.compile(r"^/players?/(\d+)(?:/|$)")
+# GET routes that modify the player they address
+SIDE_EFFECT_SUFFIXES = ("/description",)
+# Streamed responses that must not be buffered into the cache
+STREAMING_PATHS = ("/players/export",)
+
+
+class CachedResponse:
+    def __init__(self, body: bytes, status_code: int, headers: Dict[str, str]):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+class ResponseCache:
+    """
+    TTL cache of GET responses with per-player invalidation.
+
+    Every entry is tagged with the player ids it contains, so a write to one
+    player only drops the pages that actually show that player. Entries that
+    depend on every player, such as list pages filtered or sorted by a stat,
+    are dropped by a write to any player.
+    """
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: int = RESPONSE_CACHE_TTL):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.keys_by_player: Dict[int, Set[str]] = {}
+        self.keys_of_all_players: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        cache_requests.inc(cache="response", result="miss" if entry is None else "hit")
+        return entry
+
+    def set(
+        self,
+        key: str,
+        entry: CachedResponse,
+        player_ids: Iterable[int],
+        all_players: bool = False,
+    ) -> None:
+        self.entries[key] = entry
+        for player_id in player_ids:
+            self.keys_by_player.setdefault(player_id, set()).add(key)
+        if all_players:
+            self.keys_of_all_players.add(key)
+
+    def _drop_players(self, player_ids: Iterable[int]) -> None:
+        for player_id in player_ids:
+            for key in self.keys_by_player.pop(player_id, ()):
+                self.entries.pop(key, None)
+        for key in self.keys_of_all_players:
+            self.entries.pop(key, None)
+        self.keys_of_all_players.clear()
+
+    def _clear(self) -> None:
+        self.entries.clear()
+        self.keys_by_player.clear()
+        self.keys_of_all_players.clear()
+
+    def invalidate_player(self, player_id: int) -> None:
+        self._drop_players([player_id])
+        cluster.publish("response_cache", [player_id])
+
+    def invalidate_all(self) -> None:
+        self._clear()
+        cluster.publish("response_cache")
+
+    def apply_remote(self, player_ids: Optional[List[int]]) -> None:
+        """
+        Apply an invalidation published by another worker.
+        """
+        if player_ids is None:
+            self._clear()
+        else:
+            self._drop_players(player_ids)
+
+
+response_cache = ResponseCache()
+cluster.subscribe("response_cache", response_cache.apply_remote)
+Gauge(
+    "response_cache_hit_ratio",
+    "Share of response cache lookups served from the cache.",
+    function=lambda: response_cache.hits / max(response_cache.hits + response_cache.misses, 1),
+)
+
+
+def cache_key(request: Request) -> str:
+    """
+    Build a cache key from the path and the query string with parameters
+    sorted, so ?page=2&page_size=10 and ?page_size=10&page=2 share an entry.
+    """
+    query = urlencode(sorted(parse_qsl(request.url.query, keep_blank_values=True)))
+    return f"{request.url.path}?{query}"
+
+
+def player_ids_in(path: str, body: bytes) -> Set[int]:
+    """
+    Collect the ids of every player a cached response depends on.
+    """
+    ids = set()
+    match = PLAYER_PATH.match(path)
+    if match:
+        ids.add(int(match.group(1)))
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return ids
+    if isinstance(payload, dict):
+        for player in payload.get("players") or ():
+            if isinstance(player, dict) and isinstance(player.get("id"), int):
+                ids.add(player["id"])
+    return ids
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates or "*" in candidates
+
+
+def is_cacheable(request: Request) -> bool:
+    path = request.url.path
+    return (
+        request.method == "GET"
+        and path.startswith("/players")
+        and not path.endswith(SIDE_EFFECT_SUFFIXES)
+        and path not in STREAMING_PATHS
+    )
+
+
 class CacheMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app):
+    def __init__(self, app, cache: ResponseCache = response_cache):
         super().__init__(app)
-        self.cache = TTLCache(maxsize=1000, ttl=300)
+        self.cache = cache
+
+    def _respond(self, request: Request, entry: CachedResponse, status: str) -> Response:
+        if etag_matches(request, entry.etag):
+            return Response(status_code=304, headers={"ETag": entry.etag, "X-Cache": status})
+        headers = dict(entry.headers)
+        headers["ETag"] = entry.etag
+        headers["X-Cache"] = status
+        return Response(content=entry.body, status_code=entry.status_code, headers=headers)
 
     async def dispatch(self, request: Request, call_next):
-        if request.method == "GET" and "/players" in request.url.path:
-            cache_key = request.url.path
-            if cache_key in self.cache:
-                cached_response_body = self.cache[cache_key]
-                return Response(content=cached_response_body, media_type="application/json")
-        
-        response = await call_next(request)
-        
-        if request.method == "GET" and response.status_code == 200 and "/players" in request.url.path:
-            if hasattr(response, "body"):
-                response_body = await response.body()
-                self.cache[cache_key] = response_body
-                return Response(content=response_body, media_type="application/json", status_code=response.status_code, headers=response.headers)
-            else:
-                # Handle StreamingResponse
-                response_body = response.body_iterator
-                self.cache[cache_key] = response_body
+        path = request.url.path
+
+        if is_cacheable(request):
+            key = cache_key(request)
+            entry = self.cache.get(key)
+            if entry is not None:
+                return self._respond(request, entry, "HIT")
+
+            response = await call_next(request)
+            if response.status_code != 200:
                 return response
-        
-        return response
\ No newline at end of file
+
+            # call_next always hands back a streaming response; drain it once
+            # and keep the bytes, since the iterator cannot be replayed
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            headers = {
+                name: value
+                for name, value in response.headers.items()
+                if name.lower() not in ("content-length", "etag")
+            }
+            entry = CachedResponse(body, response.status_code, headers)
+            # Routes that know which players they returned say so, sparing a parse
+            player_ids = getattr(request.state, "player_ids", None)
+            if player_ids is None:
+                player_ids = player_ids_in(path, body)
+            else:
+                player_ids = set(player_ids) | player_ids_in(path, b"")
+            all_players = getattr(request.state, "depends_on_all_players", False)
+            self.cache.set(key, entry, player_ids, all_players)
+            return self._respond(request, entry, "MISS")
+
+        response = await call_next(request)
+
+        if 200 <= response.status_code < 300 and (
+            request.method in WRITE_METHODS or path.endswith(SIDE_EFFECT_SUFFIXES)
+        ):
+            match = PLAYER_PATH.match(path)
+            if match:
+                self.cache.invalidate_player(int(match.group(1)))
+            elif request.method in WRITE_METHODS and path.startswith("/player"):
+                self.cache.invalidate_all()
+
+        return response
@@ -0,0 +1,279 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set
+
+import psycopg2
+
+import database
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+CLUSTER_CHANNEL = "baseball_cluster"
+# Seconds to collect invalidations before publishing, so bursts of writes
+# (e.g. a feed ingest) go out as a few notifications instead of thousands
+CLUSTER_PUBLISH_DELAY = float(os.getenv("CLUSTER_PUBLISH_DELAY", "0.05"))
+CLUSTER_RECONNECT_DELAY = float(os.getenv("CLUSTER_RECONNECT_DELAY", "2"))
+ADVISORY_LOCK_POLL_SECONDS = 0.5
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD_BYTES = 7000
+# libpq keepalives, so a listener whose server vanished is noticed
+LISTEN_KEEPALIVES = {
+    "keepalives": 1,
+    "keepalives_idle": 30,
+    "keepalives_interval": 10,
+    "keepalives_count": 3,
+}
+
+Handler = Callable[[Optional[List[Any]]], None]
+
+
+def _connect_listener(channel: str):
+    conn = database.connect(**LISTEN_KEEPALIVES)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f"LISTEN {channel}")
+    return conn
+
+
+async def listen(
+    channel: str, receive: Callable[[str], None], reconnected: Callable[[], None]
+) -> None:
+    """
+    LISTEN on a channel from a dedicated connection for as long as the task
+    runs, passing each notification payload to `receive` on the event loop.
+
+    A lost connection is reopened, after which `reconnected` is called,
+    since notifications sent in between were missed.
+    """
+    loop = asyncio.get_running_loop()
+    connected_before = False
+    while True:
+        try:
+            conn = await asyncio.to_thread(_connect_listener, channel)
+        except psycopg2.Error as e:
+            logger.warning("Listener on '%s' could not connect: %s", channel, e)
+            await asyncio.sleep(CLUSTER_RECONNECT_DELAY)
+            continue
+        if connected_before:
+            reconnected()
+        connected_before = True
+        lost = loop.create_future()
+
+        def on_readable():
+            try:
+                conn.poll()
+            except psycopg2.Error as e:
+                if not lost.done():
+                    lost.set_result(e)
+                return
+            while conn.notifies:
+                receive(conn.notifies.pop(0).payload)
+
+        # The descriptor is gone once libpq notices the server hung up
+        fileno = conn.fileno()
+        loop.add_reader(fileno, on_readable)
+        try:
+            error = await lost
+            logger.warning("Listener on '%s' lost its connection: %s", channel, error)
+        finally:
+            loop.remove_reader(fileno)
+            conn.close()
+        await asyncio.sleep(CLUSTER_RECONNECT_DELAY)
+
+
+@database.pooled
+def send_notifications(conn, channel: str, payloads: List[str]) -> bool:
+    """
+    Send NOTIFY payloads on a channel in one transaction.
+    """
+    if not conn:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload",
+                (channel, payloads),
+            )
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        logger.error("Error sending notifications: %s", e)
+        conn.rollback()
+        return False
+
+
+class ClusterBus:
+    """
+    Keeps per-process state coherent across workers sharing one database.
+
+    Each worker publishes what it invalidated (players changed, cache
+    entries dropped) under a kind, and every other worker runs the handlers
+    subscribed to that kind. Messages travel over Postgres LISTEN/NOTIFY, so
+    running several workers needs nothing beyond the database.
+
+    Handlers are called with the affected values, or None when everything
+    of that kind must be treated as changed: when a publisher said so, or
+    after the listening connection was lost and messages may have been
+    missed. They run on the event loop.
+    """
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex[:12]
+        self._handlers: Dict[str, List[Handler]] = {}
+        # Values waiting to be published per kind; None means everything
+        self._pending: Dict[str, Optional[Set[Any]]] = {}
+        self._pending_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.received = 0
+        self.published = 0
+
+    def subscribe(self, kind: str, handler: Handler) -> Handler:
+        self._handlers.setdefault(kind, []).append(handler)
+        return handler
+
+    def publish(self, kind: str, values: Optional[List[Any]] = None) -> None:
+        """
+        Tell other workers about an invalidation. Safe to call from any
+        thread; does nothing until the bus is started.
+        """
+        if self._loop is None:
+            return
+        with self._pending_lock:
+            if values is None:
+                self._pending[kind] = None
+            elif kind not in self._pending:
+                self._pending[kind] = set(values)
+            elif self._pending[kind] is not None:
+                self._pending[kind].update(values)
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _payloads(self, kind: str, values: Optional[Set[Any]]) -> List[str]:
+        def encode(chunk):
+            return json.dumps(
+                {"origin": self.worker_id, "kind": kind, "values": chunk}, separators=(",", ":")
+            )
+
+        if values is None:
+            return [encode(None)]
+        payloads = []
+        chunk: List[Any] = []
+        size = len(encode([]))
+        for value in sorted(values):
+            value_size = len(json.dumps(value)) + 1
+            if chunk and size + value_size > MAX_PAYLOAD_BYTES:
+                payloads.append(encode(chunk))
+                chunk, size = [], len(encode([]))
+            chunk.append(value)
+            size += value_size
+        if chunk:
+            payloads.append(encode(chunk))
+        return payloads
+
+    def _dispatch(self, kind: str, values: Optional[List[Any]]) -> None:
+        for handler in self._handlers.get(kind, ()):
+            try:
+                handler(values)
+            except Exception as e:
+                logger.error("Cluster handler for '%s' failed: %s", kind, e)
+
+    def _receive(self, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logger.warning("Ignoring malformed cluster notification")
+            return
+        if message.get("origin") == self.worker_id:
+            return
+        self.received += 1
+        self._dispatch(message.get("kind"), message.get("values"))
+
+    async def _publish_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            await asyncio.sleep(CLUSTER_PUBLISH_DELAY)
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            payloads = [
+                payload for kind, values in pending.items() for payload in self._payloads(kind, values)
+            ]
+            if not payloads:
+                continue
+            if await send_notifications(CLUSTER_CHANNEL, payloads):
+                self.published += len(payloads)
+            else:
+                logger.warning("Other workers may serve stale data until their caches expire")
+
+    def _reconnected(self) -> None:
+        # Anything published while disconnected was missed
+        logger.warning("Cluster listener reconnected; invalidating all shared state")
+        for kind in list(self._handlers):
+            self._dispatch(kind, None)
+
+    def start(self) -> List[asyncio.Task]:
+        """
+        Start listening and publishing on the running event loop.
+
+        Returns:
+            The background tasks, to be cancelled on shutdown
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        logger.info("Cluster worker %s listening on '%s'", self.worker_id, CLUSTER_CHANNEL)
+        return [
+            asyncio.create_task(listen(CLUSTER_CHANNEL, self._receive, self._reconnected)),
+            asyncio.create_task(self._publish_loop()),
+        ]
+
+
+def _lock_key(name: str) -> int:
+    return int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], "big", signed=True)
+
+
+def _try_lock(conn, key: int) -> bool:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (key,))
+        return cursor.fetchone()[0]
+
+
+@asynccontextmanager
+async def advisory_lock(name: str, wait: bool = True) -> AsyncIterator[bool]:
+    """
+    Hold a Postgres advisory lock named `name` for the duration of the
+    block, so work like the feed ingest runs in one worker at a time.
+
+    The lock lives on its own connection and is released when the block
+    exits, or by the server if the process dies.
+
+    Args:
+        name: Lock name, shared by every worker on the database
+        wait: Wait for the lock; otherwise yield False at once if another
+            worker holds it
+
+    Yields:
+        Whether the lock is held
+    """
+    key = _lock_key(name)
+    conn = await asyncio.to_thread(database.connect)
+    conn.autocommit = True
+    try:
+        acquired = await asyncio.to_thread(_try_lock, conn, key)
+        if not acquired and wait:
+            logger.info("Waiting for another worker to release '%s'", name)
+            while not acquired:
+                await asyncio.sleep(ADVISORY_LOCK_POLL_SECONDS)
+                acquired = await asyncio.to_thread(_try_lock, conn, key)
+        yield acquired
+    finally:
+        # Closing the session releases the lock
+        await asyncio.to_thread(conn.close)
+
+
+cluster = ClusterBus()
@@ -1,87 +1,581 @@
 import os
 import time
+import asyncio
+import functools
+import threading
+from contextlib import contextmanager
 import psycopg2
 from psycopg2 import OperationalError
-import logging
+from psycopg2.pool import ThreadedConnectionPool
+from logging_config import get_logger
+from pagination import SORTABLE_COLUMNS, STAT_COLUMNS
+from metrics import Gauge, db_pool_wait, db_query_duration, db_query_errors, span
 
-logger = logging.getLogger(__name__)
+logger = get_logger(__name__)
 
 DB_URL = os.environ.get("DB_URL")
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "20"))
+# Connections idle for longer than this are pinged before being handed out
+DB_POOL_PING_AFTER = float(os.environ.get("DB_POOL_PING_AFTER", "30"))
+# Connection attempts after the first failed one, two seconds apart; 0
+# gives up after a single attempt
+DB_CONNECT_RETRIES = int(os.environ.get("DB_CONNECT_RETRIES", "30"))
+# Channel the player change triggers notify, and the most ids per payload
+# (Postgres rejects payloads of 8000 bytes or more)
+PLAYER_CHANGES_CHANNEL = "player_changes"
+PLAYER_CHANGES_CHUNK = 500
 
-def create_connection():
-    conn = None
-    retries = 5
-    delay = 2
-    for attempt in range(retries):
+
+def _connection_params():
+    from urllib.parse import parse_qsl, urlparse
+    parsed_url = urlparse(DB_URL)
+    params = {
+        "host": parsed_url.hostname,
+        "port": parsed_url.port or 5432,
+        "database": parsed_url.path.lstrip('/'),
+        "user": parsed_url.username,
+        "password": parsed_url.password,
+    }
+    # libpq parameters given in the query string win, e.g. ?host=/tmp/pg
+    # for a Unix socket directory or ?sslmode=require
+    params.update(parse_qsl(parsed_url.query))
+    return params
+
+
+def connect(**options):
+    """
+    Open a standalone connection outside the pool, for sessions that must
+    outlive a single query (LISTEN, advisory locks). The caller closes it.
+    """
+    return psycopg2.connect(**_connection_params(), **options)
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool with health-checked checkout.
+
+    Blocking queries run on worker threads (see `run_in_pool`), so each
+    thread checks out its own connection instead of sharing one socket.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, **params):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._pool = ThreadedConnectionPool(minconn, maxconn, **params)
+        # Bounds checkouts so callers wait for a free connection rather than
+        # getting PoolError when all maxconn connections are in use
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self.in_use = 0
+        self._in_use_lock = threading.Lock()
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        # Freshly opened connections have never been returned and need no ping
+        if last_used is None or time.monotonic() - last_used < DB_POOL_PING_AFTER:
+            return True
         try:
-            # Explicitly parse and log connection parameters
-            from urllib.parse import urlparse, parse_qs
-            parsed_url = urlparse(DB_URL)
-            query_params = parse_qs(parsed_url.query)
-            
-            # Detailed logging of connection parameters
-            logger.info(f"Attempting database connection (attempt {attempt + 1}/{retries}):")
-            logger.info(f"Raw DB_URL: {DB_URL}")
-            logger.info(f"Scheme: {parsed_url.scheme}")
-            logger.info(f"Hostname: {parsed_url.hostname}")
-            logger.info(f"Port: {parsed_url.port or 5432}")
-            logger.info(f"Username: {parsed_url.username}")
-            logger.info(f"Database: {parsed_url.path.lstrip('/')}")
-            
-            # Attempt connection with explicit parameters
-            conn = psycopg2.connect(
-                host=parsed_url.hostname,
-                port=parsed_url.port or 5432,
-                database=parsed_url.path.lstrip('/'),
-                user=parsed_url.username,
-                password=parsed_url.password
-            )
-            logger.info("Database connection successful")
-            return conn
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        started = time.perf_counter()
+        self._slots.acquire()
+        try:
+            for _ in range(self.maxconn + 1):
+                conn = self._pool.getconn()
+                if self._is_healthy(conn):
+                    db_pool_wait.observe(time.perf_counter() - started)
+                    with self._in_use_lock:
+                        self.in_use += 1
+                    return conn
+                logger.warning("Discarding unhealthy pooled connection")
+                self._last_used.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+            raise OperationalError("Could not obtain a healthy database connection")
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        with self._in_use_lock:
+            self.in_use -= 1
+        try:
+            if conn.closed:
+                self._last_used.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+                return
+            # Never hand out a connection that is mid-transaction
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+def create_pool():
+    params = _connection_params()
+    # Never log the password (or the raw DB_URL, which contains it)
+    logger.info(
+        "Attempting database connection to %s:%s/%s as %s, pool size %s-%s",
+        params["host"], params["port"], params["database"], params["user"],
+        DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE,
+    )
+    db_pool = ConnectionPool(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, **params)
+    logger.info("Database connection pool created")
+    return db_pool
+
+
+def _create_schema(db_pool):
+    with db_pool.connection() as conn:
+        create_table(conn)
+
+
+async def init_pool(retries: int = DB_CONNECT_RETRIES, delay: float = 2):
+    """
+    Open the connection pool and create the schema without blocking the
+    event loop, retrying until the database accepts connections.
+
+    Args:
+        retries: Further attempts after the first fails; 0 tries once
+        delay: Seconds to wait between attempts
+
+    Returns:
+        The pool, or None if every attempt failed
+    """
+    global pool
+    for attempt in range(1, max(retries, 0) + 2):
+        try:
+            db_pool = await asyncio.to_thread(create_pool)
+            try:
+                await asyncio.to_thread(_create_schema, db_pool)
+            except LegacySchema as e:
+                # Retrying cannot help until the table is migrated
+                logger.error(str(e))
+                db_pool.closeall()
+                return None
+            pool = db_pool
+            return pool
         except Exception as e:
-            logger.error(f"Database connection error: {type(e).__name__} - {str(e)}")
-            if attempt < retries - 1:
-                time.sleep(delay)
+            logger.error(
+                "Database connection error (attempt %d): %s - %s", attempt, type(e).__name__, e
+            )
+            if attempt <= retries:
+                await asyncio.sleep(delay)
     logger.error("Max retries reached. Database connection failed.")
     return None
 
+
+# Indexes of the compact players schema, as (name, target); migrate_compact
+# builds them concurrently on existing databases
+TEAM_INDEX = ("players_team_id_idx", "players (team, id)")
+# Lets the default id-ordered page be read by an index-only scan
+LIST_INDEX = (
+    "players_list_idx",
+    f"players (id) INCLUDE (player_name, position, team, {', '.join(STAT_COLUMNS)}, version)",
+)
+
+
+def create_search_indexes(cursor):
+    """
+    Create the indexes behind GET /players filtering and name search.
+    Trigram search needs the pg_trgm extension; without it name search falls
+    back to a plain ILIKE scan.
+    """
+    global trigram_enabled
+    cursor.execute("CREATE INDEX IF NOT EXISTS players_position_id_idx ON players (position, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS {} ON {}".format(*TEAM_INDEX))
+    cursor.execute("SAVEPOINT trigram")
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS players_name_trgm_idx "
+            "ON players USING gin (player_name gin_trgm_ops)"
+        )
+        cursor.execute("RELEASE SAVEPOINT trigram")
+        trigram_enabled = True
+    except psycopg2.Error as e:
+        logger.warning("pg_trgm unavailable, name search will not use an index: %s", e)
+        cursor.execute("ROLLBACK TO SAVEPOINT trigram")
+        trigram_enabled = False
+
+
+# Ranks kept per stat in player_leaderboards, league-wide and per position
+LEADERBOARD_DEPTH = 100
+DISTRIBUTION_PERCENTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+
+def create_stats_views(cursor):
+    """
+    Create the materialized views behind /leaderboards and /aggregates.
+    Both have unique indexes so they can be refreshed concurrently.
+
+    Stats go through NUMERIC so REAL values keep their short decimal form
+    (0.3 rather than 0.30000001192092896) when widened to float8.
+    """
+    stat_values = ", ".join(
+        f"('{column}', p.{column}::numeric::float8)" for column in STAT_COLUMNS
+    )
+    cursor.execute(f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS player_leaderboards AS
+        SELECT * FROM (
+            SELECT
+                s.stat,
+                p.id,
+                p.player_name,
+                p.position,
+                p.team,
+                s.value,
+                rank() OVER (PARTITION BY s.stat ORDER BY s.value DESC) AS league_rank,
+                rank() OVER (PARTITION BY s.stat, p.position ORDER BY s.value DESC) AS position_rank
+            FROM players p
+            CROSS JOIN LATERAL (VALUES {stat_values}) AS s (stat, value)
+            WHERE s.value IS NOT NULL
+        ) ranked
+        WHERE league_rank <= {LEADERBOARD_DEPTH} OR position_rank <= {LEADERBOARD_DEPTH}
+    """)
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS player_leaderboards_stat_id_idx "
+        "ON player_leaderboards (stat, id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS player_leaderboards_league_idx "
+        "ON player_leaderboards (stat, league_rank)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS player_leaderboards_position_idx "
+        "ON player_leaderboards (stat, position, position_rank)"
+    )
+
+    percentiles = ", ".join(str(p) for p in DISTRIBUTION_PERCENTILES)
+    stat_aggregates = ",\n".join(
+        f"AVG({column}::numeric)::float8 AS {column}_mean, "
+        f"percentile_cont(ARRAY[{percentiles}]) WITHIN GROUP (ORDER BY {column}::numeric) "
+        f"AS {column}_percentiles"
+        for column in STAT_COLUMNS
+    )
+    cursor.execute(f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS player_aggregates AS
+        SELECT
+            CASE
+                WHEN GROUPING(position) = 0 THEN 'position'
+                WHEN GROUPING(team) = 0 THEN 'team'
+                ELSE 'league'
+            END AS group_type,
+            COALESCE(position, team, '') AS group_value,
+            COUNT(*) AS players,
+            {stat_aggregates}
+        FROM players
+        GROUP BY GROUPING SETS ((position), (team), ())
+    """)
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS player_aggregates_group_idx "
+        "ON player_aggregates (group_type, group_value)"
+    )
+
+
+def create_count_tracking(cursor):
+    """
+    Maintain the players row count in a one-row table via statement-level
+    triggers, so paginated reads never need a COUNT(*) table scan.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS players_count (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            total BIGINT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO players_count (total)
+        SELECT COUNT(*) FROM players
+        ON CONFLICT (id) DO NOTHING
+    """)
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION players_count_trigger() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE players_count SET total = total + (SELECT COUNT(*) FROM new_rows);
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE players_count SET total = total - (SELECT COUNT(*) FROM old_rows);
+            ELSE
+                UPDATE players_count SET total = 0;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    cursor.execute("""
+        CREATE OR REPLACE TRIGGER players_count_insert
+        AFTER INSERT ON players REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION players_count_trigger()
+    """)
+    cursor.execute("""
+        CREATE OR REPLACE TRIGGER players_count_delete
+        AFTER DELETE ON players REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION players_count_trigger()
+    """)
+    cursor.execute("""
+        CREATE OR REPLACE TRIGGER players_count_truncate
+        AFTER TRUNCATE ON players
+        FOR EACH STATEMENT EXECUTE FUNCTION players_count_trigger()
+    """)
+
+
+def create_change_notifications(cursor):
+    """
+    NOTIFY PLAYER_CHANGES_CHANNEL with the ids of players each statement
+    inserted, updated or deleted, including description and extras changes
+    in player_details. Statement-level, so a bulk write sends one payload
+    per PLAYER_CHANGES_CHUNK ids rather than one per row.
+    """
+    cursor.execute(f"""
+        CREATE OR REPLACE FUNCTION players_notify_changes() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                PERFORM pg_notify('{PLAYER_CHANGES_CHANNEL}', '{{"op": "TRUNCATE", "ids": null}}');
+            ELSIF TG_TABLE_NAME = 'players' THEN
+                PERFORM pg_notify('{PLAYER_CHANGES_CHANNEL}', json_build_object('op', TG_OP, 'ids', array_agg(id))::text)
+                FROM (SELECT id, (row_number() OVER () - 1) / {PLAYER_CHANGES_CHUNK} AS chunk FROM changed_rows) AS rows
+                GROUP BY chunk;
+            ELSE
+                PERFORM pg_notify('{PLAYER_CHANGES_CHANNEL}', json_build_object('op', TG_OP, 'ids', array_agg(player_id))::text)
+                FROM (SELECT player_id, (row_number() OVER () - 1) / {PLAYER_CHANGES_CHUNK} AS chunk FROM changed_rows) AS rows
+                GROUP BY chunk;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    for table, event, transition in (
+        ("players", "INSERT", "NEW"),
+        ("players", "UPDATE", "NEW"),
+        ("players", "DELETE", "OLD"),
+        # Details rows are inserted along with their player
+        ("player_details", "UPDATE", "NEW"),
+    ):
+        cursor.execute(f"""
+            CREATE OR REPLACE TRIGGER {table}_notify_{event.lower()}
+            AFTER {event} ON {table} REFERENCING {transition} TABLE AS changed_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION players_notify_changes()
+        """)
+    cursor.execute("""
+        CREATE OR REPLACE TRIGGER players_notify_truncate
+        AFTER TRUNCATE ON players
+        FOR EACH STATEMENT EXECUTE FUNCTION players_notify_changes()
+    """)
+
+
+def create_player_details(cursor):
+    """
+    Create the side table holding each player's description and the feed
+    keys without a typed column, so the rows the list query reads stay
+    narrow. Every player has a row, created when the player is inserted.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS player_details (
+            player_id INTEGER PRIMARY KEY REFERENCES players (id) ON DELETE CASCADE,
+            description TEXT,
+            extras JSONB NOT NULL DEFAULT '{}'::jsonb
+        )
+    """)
+
+
+class LegacySchema(RuntimeError):
+    pass
+
+
+def has_column(cursor, table: str, column: str) -> bool:
+    cursor.execute(
+        "SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+        (table, column),
+    )
+    return cursor.fetchone() is not None
+
+
 def create_table(conn):
     if not conn:
         logger.error("No database connection to create table.")
         return
     cursor = conn.cursor()
+    # Raised rather than logged, so startup fails instead of serving
+    # queries against columns that do not exist yet
+    legacy = has_column(cursor, "players", "data") and not has_column(cursor, "players", "team")
+    conn.rollback()
+    if legacy:
+        raise LegacySchema(
+            "players has the legacy schema; run `python -m migrate_compact expand backfill` first"
+        )
     try:
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS players (
                 id SERIAL PRIMARY KEY,
                 player_name VARCHAR(255),
                 position VARCHAR(255),
-                games INTEGER,
-                at_bat INTEGER,
-                runs INTEGER,
-                hits INTEGER,
-                double_2b INTEGER,
-                third_baseman INTEGER,
-                home_run INTEGER,
-                run_batted_in INTEGER,
-                a_walk INTEGER,
-                strikeouts INTEGER,
-                stolen_base INTEGER,
-                caught_stealing INTEGER,
-                avg NUMERIC,
-                on_base_percentage NUMERIC,
-                slugging_percentage NUMERIC,
-                on_base_plus_slugging NUMERIC,
-                data JSONB,  -- Store the rest of the player data as JSON
+                team VARCHAR(255),
+                -- Season counts fit SMALLINT and ratios REAL, keeping rows
+                -- narrow; values that do not fit are stored as NULL
+                games SMALLINT,
+                at_bat SMALLINT,
+                runs SMALLINT,
+                hits SMALLINT,
+                double_2b SMALLINT,
+                third_baseman SMALLINT,
+                home_run SMALLINT,
+                run_batted_in SMALLINT,
+                a_walk SMALLINT,
+                strikeouts SMALLINT,
+                stolen_base SMALLINT,
+                caught_stealing SMALLINT,
+                avg REAL,
+                on_base_percentage REAL,
+                slugging_percentage REAL,
+                on_base_plus_slugging REAL,
+                source_hash CHAR(64),
+                version INTEGER NOT NULL DEFAULT 1,  -- Bumped on every write, for PATCH
                 UNIQUE (player_name, position)
             )
         """)
+        # Tables created before these columns existed
+        cursor.execute("ALTER TABLE players ADD COLUMN IF NOT EXISTS source_hash CHAR(64)")
+        # Bumped on every write, for optimistic concurrency on PATCH
+        cursor.execute(
+            "ALTER TABLE players ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1"
+        )
+        create_player_details(cursor)
+        if has_column(cursor, "players", "data"):
+            logger.warning(
+                "players still has the legacy data column; finish the migration "
+                "with `python -m migrate_compact contract`"
+            )
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS feed_sync_state (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                synced_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+        for column in STAT_COLUMNS:
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS players_{column}_id_idx ON players ({column}, id)"
+            )
+        cursor.execute("CREATE INDEX IF NOT EXISTS {} ON {}".format(*LIST_INDEX))
+        create_search_indexes(cursor)
+        create_count_tracking(cursor)
+        create_change_notifications(cursor)
+        create_stats_views(cursor)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS description_cache (
+                prompt_hash CHAR(64) PRIMARY KEY,  -- sha256 of model + prompt
+                model VARCHAR(255) NOT NULL,
+                description TEXT NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS description_jobs (
+                player_id INTEGER PRIMARY KEY REFERENCES players (id) ON DELETE CASCADE,
+                status VARCHAR(16) NOT NULL DEFAULT 'pending',  -- pending, running, done, failed
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS description_jobs_pending_idx "
+            "ON description_jobs (player_id) WHERE status = 'pending'"
+        )
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS player_embeddings (
+                player_id INTEGER NOT NULL REFERENCES players (id) ON DELETE CASCADE,
+                model VARCHAR(255) NOT NULL,
+                player_version INTEGER NOT NULL,  -- players.version it was computed from
+                embedding BYTEA NOT NULL,  -- float32 values
+                PRIMARY KEY (model, player_id)
+            )
+        """)
+        # Deleting a player looks up its embeddings by player_id alone
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS player_embeddings_player_idx "
+            "ON player_embeddings (player_id)"
+        )
         conn.commit()
         logger.info("Table 'players' created successfully with unique constraint")
     except Exception as e:
-        logger.error(f"The error '{e}' occurred")
+        logger.error("The error '%s' occurred", e)
         conn.rollback()
 
-conn = create_connection()
-if conn:
-    create_table(conn)
\ No newline at end of file
+
+def _run_with_connection(func, *args, **kwargs):
+    if not pool:
+        return func(None, *args, **kwargs)
+    with pool.connection() as conn:
+        return func(conn, *args, **kwargs)
+
+
+async def run_in_pool(func, *args, **kwargs):
+    """
+    Run a blocking `func(conn, *args, **kwargs)` on a worker thread with a
+    pooled connection, keeping psycopg2 I/O off the event loop.
+    """
+    return await asyncio.to_thread(_run_with_connection, func, *args, **kwargs)
+
+
+def pooled(func):
+    """
+    Turn a blocking `func(conn, ...)` into an awaitable `func(...)` that
+    checks out its own pooled connection. The original is kept as `.sync`
+    for callers that already hold a connection.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            with span(f"db.{name}"):
+                return await run_in_pool(func, *args, **kwargs)
+        except Exception:
+            db_query_errors.inc(function=name)
+            raise
+        finally:
+            db_query_duration.observe(time.perf_counter() - started, function=name)
+
+    wrapper.sync = func
+    return wrapper
+
+
+# Opened in the background at startup by init_pool
+pool = None
+# Set by create_search_indexes once pg_trgm is known to be installed
+trigram_enabled = False
+
+Gauge(
+    "db_pool_connections_in_use",
+    "Pooled connections currently checked out.",
+    function=lambda: pool.in_use if pool else 0,
+)
+Gauge(
+    "db_pool_connections_max",
+    "Upper bound on pooled connections.",
+    function=lambda: pool.maxconn if pool else 0,
+)
@@ -1,8 +1,61 @@
 import psycopg2
+import psycopg2.errors
 from psycopg2 import sql
+from psycopg2.extras import execute_values
 import json
-from logging_config import logger
-from typing import Dict, Any, Optional, Tuple, List
+import hashlib
+import threading
+import uuid
+from logging_config import get_logger
+from cluster import cluster
+from database import pooled, DISTRIBUTION_PERCENTILES
+from pagination import (
+    FLOAT_COLUMNS,
+    SORTABLE_COLUMNS,
+    STAT_COLUMNS,
+    InvalidCursor,
+    decode_cursor,
+    next_cursor,
+)
+from filters import filter_clause
+from cachetools import TTLCache
+from typing import Callable, Dict, Any, Iterable, Iterator, Optional, Tuple, List
+
+logger = get_logger(__name__)
+
+# Callbacks run after players are written, with the ids of changed players,
+# and whether they also want changes made by other workers
+_player_change_listeners: List[Tuple[Callable[[Optional[List[int]]], None], bool]] = []
+
+def on_players_changed(
+    listener: Callable[[Optional[List[int]]], None], local_only: bool = False
+) -> Callable[[Optional[List[int]]], None]:
+    """
+    Register a callback to run whenever players are inserted or updated.
+    Callbacks may run on a database worker thread and must be quick.
+
+    Listeners holding per-process state also hear about changes made by
+    other workers, and are passed None when any player may have changed.
+    `local_only` listeners, e.g. for state kept in the database itself,
+    only hear about this process's writes.
+    """
+    _player_change_listeners.append((listener, local_only))
+    return listener
+
+def _run_player_change_listeners(player_ids: Optional[List[int]], remote: bool) -> None:
+    for listener, local_only in _player_change_listeners:
+        if remote and local_only:
+            continue
+        try:
+            listener(player_ids)
+        except Exception as e:
+            logger.error("Player change listener failed: %s", e)
+
+def notify_players_changed(player_ids: List[int]) -> None:
+    _run_player_change_listeners(player_ids, remote=False)
+    cluster.publish("players", player_ids)
+
+cluster.subscribe("players", lambda player_ids: _run_player_change_listeners(player_ids, remote=True))
 
 def safe_int(value: Any) -> Optional[int]:
     try:
@@ -16,144 +69,1252 @@ def safe_float(value: Any) -> Optional[float]:
     except (ValueError, TypeError):
         return None
 
+@pooled
 def get_player_by_id(conn, player_id) -> Optional[Tuple]:
     """
     Fetch a player by their ID from the database.
+
+    Returns:
+        (player_name, position, document), the document as JSON text
     """
     if not conn:
         return None
+    document, _ = player_document_sql()
     with conn.cursor() as cursor:
         try:
             cursor.execute(
-                sql.SQL("SELECT player_name, position, data FROM players WHERE id = %s"),
+                sql.SQL("SELECT player_name, position, {} FROM {} WHERE id = %s").format(
+                    document, sql.SQL(PLAYER_SOURCE)
+                ),
                 (player_id,)
             )
             return cursor.fetchone()
         except psycopg2.Error as e:
-            logger.error(f"Error fetching player: {e}")
+            logger.error("Error fetching player: %s", e)
             return None
 
-def store_players(conn, players: List[Dict[str, Any]]) -> bool:
+def _total_players(cursor) -> int:
+    cursor.execute("SELECT total FROM players_count")
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute("SELECT COUNT(*) FROM players")
+        row = cursor.fetchone()
+    return row[0]
+
+# Totals of filtered listings, keyed by the normalized filters
+_filtered_totals = TTLCache(maxsize=1024, ttl=30)
+# Queries run on pool threads, and cachetools caches are not thread-safe
+_filtered_totals_lock = threading.Lock()
+
+def _filtered_total(cursor, filters: Dict[str, Any], condition, params: List[Any]) -> int:
+    key = json.dumps(filters, sort_keys=True)
+    with _filtered_totals_lock:
+        total = _filtered_totals.get(key)
+    if total is None:
+        cursor.execute(sql.SQL("SELECT COUNT(*) FROM players WHERE ") + condition, params)
+        total = cursor.fetchone()[0]
+        with _filtered_totals_lock:
+            _filtered_totals[key] = total
+    return total
+
+@on_players_changed
+def _clear_filtered_totals(player_ids: Optional[List[int]]) -> None:
+    with _filtered_totals_lock:
+        _filtered_totals.clear()
+
+@pooled
+def count_players(conn) -> Optional[int]:
     """
-    Store players in the database with minimal processing.
+    Return the number of players stored in the database.
     """
     if not conn:
         logger.error("No database connection")
-        return False
+        return None
+    try:
+        with conn.cursor() as cursor:
+            return _total_players(cursor)
+    except psycopg2.Error as e:
+        logger.error("Error counting players: %s", e)
+        return None
+
+PLAYER_COLUMNS = (
+    "player_name", "position", "team",
+    "games", "hits", "at_bat", "runs",
+    "double_2b", "third_baseman", "home_run",
+    "run_batted_in", "a_walk", "strikeouts",
+    "stolen_base", "caught_stealing",
+    "avg", "on_base_percentage",
+    "slugging_percentage", "on_base_plus_slugging",
+    "source_hash",
+)
+
+def player_hash(player: Dict[str, Any]) -> str:
+    """
+    Hash a standardized feed record so unchanged players can be skipped.
+    """
+    canonical = json.dumps(player, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+# Feed keys each typed stat column is read from, in order of preference
+STAT_KEYS = {
+    "games": ("games",),
+    "hits": ("hits",),
+    "at_bat": ("at-bat", "at_bat"),
+    "runs": ("runs",),
+    "double_2b": ("double_(2b)", "double_2b"),
+    "third_baseman": ("third_baseman",),
+    "home_run": ("home_run",),
+    "run_batted_in": ("run_batted_in",),
+    "a_walk": ("a_walk",),
+    "strikeouts": ("strikeouts",),
+    "stolen_base": ("stolen_base",),
+    "caught_stealing": ("caught_stealing",),
+    "avg": ("avg",),
+    "on_base_percentage": ("on-base_percentage", "on_base_percentage"),
+    "slugging_percentage": ("slugging_percentage",),
+    "on_base_plus_slugging": ("on-base_plus_slugging", "on_base_plus_slugging"),
+}
+# Range of the SMALLINT count columns
+SMALLINT_MIN, SMALLINT_MAX = -32768, 32767
+
+# Document keys with a column of their own; everything else is kept in
+# player_details.extras
+COLUMN_KEYS = frozenset(
+    ("id", "version", "player_name", "position", "team", "description",
+     *(key for keys in STAT_KEYS.values() for key in keys))
+)
+
+def stat_value(player: Dict[str, Any], column: str) -> Any:
+    """
+    Read and convert a typed stat column's value from a player document.
+    Counts that do not fit the SMALLINT column are read as None.
+    """
+    value = next(
+        (player[key] for key in STAT_KEYS[column] if player.get(key) is not None), None
+    )
+    if column in FLOAT_COLUMNS:
+        return safe_float(value)
+    value = safe_int(value)
+    if value is not None and not SMALLINT_MIN <= value <= SMALLINT_MAX:
+        return None
+    return value
+
+def player_extras(player: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The keys of a player document that have no typed column.
+    """
+    return {key: value for key, value in player.items() if key not in COLUMN_KEYS}
+
+def player_row(player: Dict[str, Any]) -> Tuple:
+    """
+    Map a standardized feed record onto the PLAYER_COLUMNS tuple.
+    """
+    return (
+        player.get("player_name"),
+        player.get("position"),
+        player.get("team"),
+        *(stat_value(player, column) for column in PLAYER_COLUMNS[3:-1]),
+        player_hash(player),
+    )
+
+@pooled
+def store_players(conn, players: List[Dict[str, Any]], page_size: int = 1000) -> Optional[Dict[str, int]]:
+    """
+    Upsert a whole feed of players in a single transaction.
+
+    Rows are sent with multi-row VALUES and merged on (player_name, position).
+    Existing rows whose columns and source hash would not change are left
+    untouched. Feed keys without a typed column are merged into the
+    player's extras, and the generated description is preserved.
+
+    Returns:
+        Counts of inserted, updated and unchanged players, or None on failure
+    """
+    if not conn:
+        logger.error("No database connection")
+        return None
+
+    # ON CONFLICT cannot touch the same row twice in one statement, so keep
+    # only the last record for each (player_name, position)
+    unique_players = {}
+    for player in players:
+        unique_players[(player.get("player_name"), player.get("position"))] = player
+    rows = [player_row(player) for player in unique_players.values()]
 
-    logger.info(f"Storing {len(players)} players")
+    logger.debug("Storing %d players", len(rows))
+    column_list = ", ".join(PLAYER_COLUMNS)
+    typed_columns = PLAYER_COLUMNS[2:-1]
+    update_list = ", ".join(f"{column} = EXCLUDED.{column}" for column in typed_columns)
+    current = ", ".join(f"players.{column}" for column in typed_columns)
+    incoming = ", ".join(f"EXCLUDED.{column}" for column in typed_columns)
     try:
-        for player in players:
-            # Use 'player_name' key; fallback to 'name'
-            player_name = player.get("player_name")
-            position = player.get("position")
-            with conn.cursor() as cursor:
-                cursor.execute(
+        with conn.cursor() as cursor:
+            results = execute_values(
+                cursor,
+                f"""
+                INSERT INTO players ({column_list})
+                VALUES %s
+                ON CONFLICT (player_name, position) DO UPDATE SET
+                    {update_list},
+                    version = players.version + 1
+                WHERE ({current}) IS DISTINCT FROM ({incoming})
+                    OR players.source_hash IS DISTINCT FROM EXCLUDED.source_hash
+                RETURNING id, (xmax = 0) AS inserted, player_name, position
+                """,
+                rows,
+                page_size=page_size,
+                fetch=True,
+            )
+            # Every player gets a details row when inserted, so patches can
+            # update it in place
+            details = []
+            for player_id, was_inserted, player_name, position in results:
+                extras = player_extras(unique_players[(player_name, position)])
+                if was_inserted or extras:
+                    details.append((player_id, json.dumps(extras)))
+            if details:
+                execute_values(
+                    cursor,
                     """
-                    INSERT INTO players (
-                        player_name, position,
-                        games, hits, at_bat, runs,
-                        double_2b, third_baseman, home_run,
-                        run_batted_in, a_walk, strikeouts,
-                        stolen_base, caught_stealing,
-                        avg, on_base_percentage,
-                        slugging_percentage, on_base_plus_slugging,
-                        data
-                    ) VALUES (
-                        %s, %s, %s, %s, %s, %s, %s, %s, %s, 
-                        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                    )
-                    RETURNING id
+                    INSERT INTO player_details (player_id, extras)
+                    VALUES %s
+                    ON CONFLICT (player_id) DO UPDATE SET
+                        extras = player_details.extras || EXCLUDED.extras
                     """,
-                    (
-                        player_name,
-                        position,
-                        safe_int(player.get("games")),
-                        safe_int(player.get("hits")),
-                        safe_int(player.get("at-bat") or player.get("at_bat")),
-                        safe_int(player.get("runs")),
-                        safe_int(player.get("double_(2b)")),
-                        safe_int(player.get("third_baseman")),
-                        safe_int(player.get("home_run")),
-                        safe_int(player.get("run_batted_in")),
-                        safe_int(player.get("a_walk")),
-                        safe_int(player.get("strikeouts")),
-                        safe_int(player.get("stolen_base")),
-                        safe_int(player.get("caught_stealing")),
-                        safe_float(player.get("avg")),
-                        safe_float(player.get("on-base_percentage") or player.get("on_base_percentage")),
-                        safe_float(player.get("slugging_percentage")),
-                        safe_float(player.get("on-base_plus_slugging") or player.get("on_base_plus_slugging")),
-                        json.dumps(player)
-                    )
+                    details,
+                    template="(%s, %s::jsonb)",
+                    page_size=page_size,
                 )
-                inserted_id = cursor.fetchone()[0]
-                conn.commit()
-                logger.info(f"Stored player with id: {inserted_id}")
-        logger.info(f"Successfully stored {len(players)} players")
-        return True
+        conn.commit()
+        inserted = sum(1 for _, was_inserted, *_ in results if was_inserted)
+        updated = len(results) - inserted
+        counts = {
+            "inserted": inserted,
+            "updated": updated,
+            "unchanged": len(rows) - inserted - updated,
+        }
+        logger.info("Successfully stored %d players: %s", len(rows), counts)
+        if results:
+            notify_players_changed([player_id for player_id, *_ in results])
+        return counts
     except Exception as e:
-        logger.error(f"Database error: {e}")
+        logger.error("Database error: %s", e)
         conn.rollback()
-        return False
+        return None
 
-def fetch_paginated_players(conn, page: int, page_size: int) -> Dict[str, Any]:
+def _keyset_condition(sort: str, order: str, value: Any, last_id: int):
     """
-    Fetch paginated players from the database.
+    WHERE clause selecting rows after (value, last_id) in the page ordering.
+    NULL sort values are treated as the largest, matching the (column, id)
+    B-tree index in both scan directions.
+    """
+    column = sql.Identifier(sort)
+    if sort == "id":
+        op = ">" if order == "asc" else "<"
+        return sql.SQL("id {} %s").format(sql.SQL(op)), [last_id]
+    if order == "asc":
+        if value is None:
+            return sql.SQL("({0} IS NULL AND id > %s)").format(column), [last_id]
+        return (
+            sql.SQL("({0} > %s OR ({0} = %s AND id > %s) OR {0} IS NULL)").format(column),
+            [value, value, last_id],
+        )
+    if value is None:
+        return sql.SQL("({0} IS NOT NULL OR id < %s)").format(column), [last_id]
+    return (
+        sql.SQL("({0} < %s OR ({0} = %s AND id < %s))").format(column),
+        [value, value, last_id],
+    )
+
+# Players with their side-stored description and extras
+PLAYER_SOURCE = "players LEFT JOIN player_details ON player_details.player_id = players.id"
+
+# Typed columns by the key they have in player documents (the feed's spelling)
+DOCUMENT_COLUMNS = {
+    "id": "id",
+    "player_name": "player_name",
+    "position": "position",
+    "team": "team",
+    **{keys[0]: column for column, keys in STAT_KEYS.items()},
+    "version": "version",
+}
+
+def player_document_sql(fields: Optional[List[str]] = None) -> Tuple[sql.Composable, List[Any]]:
+    """
+    SQL for each player's API document as JSON text, to be selected from
+    PLAYER_SOURCE: the extras, overlaid with the description and the typed
+    columns. With `fields`, only those top-level fields are built (the id
+    is always kept).
+
+    Returns:
+        (expression, params)
+    """
+    wanted = set(fields) | {"id"} if fields else None
+    parts = []
+    params: List[Any] = []
+    if wanted is None:
+        parts.append("COALESCE(extras, '{}'::jsonb)")
+    elif wanted - COLUMN_KEYS:
+        parts.append(
+            "(SELECT COALESCE(jsonb_object_agg(key, value), '{}'::jsonb) "
+            "FROM jsonb_each(extras) WHERE key = ANY(%s))"
+        )
+        params.append(sorted(wanted - COLUMN_KEYS))
+    if wanted is None or "description" in wanted:
+        parts.append("jsonb_strip_nulls(jsonb_build_object('description', description))")
+    typed = ", ".join(
+        f"'{key}', {column}" for key, column in DOCUMENT_COLUMNS.items()
+        if wanted is None or key in wanted
+    )
+    parts.append(f"jsonb_build_object({typed})")
+    return sql.SQL("(" + " || ".join(parts) + ")::text"), params
+
+def _ordering_sql(sort: str, order: str) -> sql.Composable:
+    direction = sql.SQL("ASC" if order == "asc" else "DESC")
+    return sql.SQL(" ORDER BY {sort} {direction}, id {direction}").format(
+        sort=sql.Identifier(sort), direction=direction
+    )
+
+def _page_sql(
+    columns: Iterable[str],
+    sort: str,
+    order: str,
+    filters: Optional[Dict[str, Any]],
+    limit: int,
+    offset: int = 0,
+    seek: Optional[Tuple[Any, int]] = None,
+) -> Tuple[sql.Composable, List[Any]]:
+    """
+    Query for `columns` of the players on one page of the list, in page
+    order: after (value, id) when `seek` is given, otherwise at `offset`.
+
+    Returns:
+        (query, params)
+    """
+    query = sql.SQL("SELECT {} FROM players").format(
+        sql.SQL(", ").join(sql.Identifier(column) for column in columns)
+    )
+    filter_condition, filter_params = filter_clause(filters)
+    conditions = [filter_condition] if filter_condition else []
+    params: List[Any] = list(filter_params)
+    if seek:
+        seek_condition, seek_params = _keyset_condition(sort, order, *seek)
+        conditions.append(seek_condition)
+        params.extend(seek_params)
+    if conditions:
+        query += sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions)
+    query += _ordering_sql(sort, order) + sql.SQL(" LIMIT %s")
+    params.append(limit)
+    if not seek:
+        query += sql.SQL(" OFFSET %s")
+        params.append(offset)
+    return query, params
+
+@pooled
+def fetch_paginated_players(
+    conn,
+    page: int,
+    page_size: int,
+    sort: str = "id",
+    order: str = "asc",
+    cursor_token: Optional[str] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    fields: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Fetch a page of players in a stable (sort, id) order.
+
+    When `cursor_token` is given the page is located by keyset seek, which
+    costs the same at any depth; otherwise `page` is used with OFFSET.
+    Every response carries a `next` cursor for continuing with keyset seeks;
+    the same `filters` must be passed along with it.
+
+    Player documents are built by Postgres and returned as JSON text under
+    `players`, ready to be spliced into the response without decoding;
+    `player_ids` and `undescribed` (ids without a description) are returned
+    alongside them.
+
+    Raises:
+        InvalidCursor: If the cursor is malformed or the sort is unsupported
     """
     if not conn:
         logger.error("No database connection")
         return {}
+
+    if cursor_token:
+        seek = decode_cursor(cursor_token)
+        sort, order = seek["sort"], seek["order"]
+    elif sort not in SORTABLE_COLUMNS or order not in ("asc", "desc"):
+        raise InvalidCursor(f"Unsupported ordering: {sort} {order}")
+
+    # The page's rows are found first, from the covering index alone, so
+    # documents are only built for the rows returned and not for those an
+    # OFFSET skips. One extra row tells us whether a next page exists.
+    page_query, page_params = _page_sql(
+        DOCUMENT_COLUMNS.values(), sort, order, filters, page_size + 1,
+        offset=(page - 1) * page_size,
+        seek=(seek["value"], seek["id"]) if cursor_token else None,
+    )
+    ordering = _ordering_sql(sort, order)
+    document, document_params = player_document_sql(fields)
+    query = sql.SQL(
+        "SELECT id, {sort}, {document}, description IS NOT NULL FROM ({page}) AS players "
+        "LEFT JOIN player_details ON player_details.player_id = players.id"
+    ).format(sort=sql.Identifier(sort), document=document, page=page_query) + ordering
+    params = document_params + page_params
+
     try:
         with conn.cursor() as cursor:
-            offset = (page - 1) * page_size
-            cursor.execute(
-                "SELECT id, player_name, position, data FROM players LIMIT %s OFFSET %s",
-                (page_size, offset)
-            )
+            cursor.execute(query, params)
             records = cursor.fetchall()
-            players_list = []
-            for record in records:
-                data_field = record[3]
-                player_data = json.loads(data_field) if isinstance(data_field, str) else data_field
-                players_list.append({
-                    "id": record[0],
-                    "player_name": record[1],
-                    "position": record[2],
-                    **player_data,
-                })
-            cursor.execute("SELECT COUNT(*) FROM players")
-            total_players = cursor.fetchone()[0]
+            page_records = records[:page_size]
+            if filters:
+                filter_condition, filter_params = filter_clause(filters)
+                total_players = _filtered_total(cursor, filters, filter_condition, filter_params)
+            else:
+                total_players = _total_players(cursor)
             total_pages = (total_players + page_size - 1) // page_size
-            logger.info(f"Pagination: Total Players: {total_players}, Total Pages: {total_pages}")
+            logger.debug("Pagination: Total Players: %s, Total Pages: %s", total_players, total_pages)
             return {
-                "players": players_list,
+                "players": [record[2] for record in page_records],
+                "player_ids": [record[0] for record in page_records],
+                "undescribed": [record[0] for record in page_records if not record[3]],
                 "total_players": total_players,
                 "total_pages": total_pages,
-                "current_page": page,
+                "current_page": None if cursor_token else page,
                 "page_size": page_size,
+                "next": next_cursor(records, sort, order, page_size),
             }
     except Exception as e:
-        logger.error(f"Database error: {e}")
+        logger.error("Database error: %s", e)
         return {}
 
+@pooled
+def fetch_page_player_ids(
+    conn,
+    page: int,
+    page_size: int,
+    sort: str = "id",
+    order: str = "asc",
+    filters: Optional[Dict[str, Any]] = None,
+) -> Optional[List[int]]:
+    """
+    Fetch the ids on one page of the list, in page order, without building
+    documents or counting the table.
+    """
+    if not conn:
+        return None
+    query, params = _page_sql(["id"], sort, order, filters, page_size, offset=(page - 1) * page_size)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, params)
+            return [row[0] for row in cursor.fetchall()]
+    except psycopg2.Error as e:
+        logger.error("Error fetching page: %s", e)
+        return None
+
+@pooled
+def fetch_player_documents(conn, player_ids: List[int]) -> Optional[Dict[int, str]]:
+    """
+    Fetch the API documents of the given players as JSON text, by id.
+    Players that do not exist are left out.
+    """
+    if not conn:
+        return None
+    document, params = player_document_sql()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                sql.SQL("SELECT id, {} FROM {} WHERE id = ANY(%s)").format(
+                    document, sql.SQL(PLAYER_SOURCE)
+                ),
+                params + [list(player_ids)],
+            )
+            return dict(cursor.fetchall())
+    except psycopg2.Error as e:
+        logger.error("Error fetching players: %s", e)
+        return None
+
+# Flat columns for tabular exports
+EXPORT_COLUMNS = ("id", "player_name", "position", "team", *STAT_COLUMNS, "description", "version")
+EXPORT_BATCH_SIZE = 5000
+
+def export_column_sql(column: str) -> sql.Composable:
+    if column in FLOAT_COLUMNS:
+        # Through NUMERIC, so a REAL 0.3 exports as 0.3 rather than 0.30000001192092896
+        return sql.SQL("{}::numeric::float8").format(sql.Identifier(column))
+    return sql.Identifier(column)
+
+def iter_player_rows(
+    conn,
+    filters: Optional[Dict[str, Any]] = None,
+    columns: Optional[List[str]] = None,
+    fields: Optional[List[str]] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> Iterator[List[Tuple]]:
+    """
+    Stream players in id order from a server-side cursor, one batch at a
+    time, so memory stays flat however large the table is.
+
+    Args:
+        conn: Connection to hold for the whole export
+        filters: Filters from player_filters
+        columns: EXPORT_COLUMNS to select; when omitted each row is the
+            player's API document as a single JSON text value
+        fields: Projection for the JSON documents, as for the list API
+        batch_size: Rows fetched per round trip
+
+    Yields:
+        Lists of up to batch_size row tuples
+    """
+    if columns:
+        selected = sql.SQL(", ").join(export_column_sql(column) for column in columns)
+        params: List[Any] = []
+    else:
+        selected, params = player_document_sql(fields)
+    query = sql.SQL("SELECT {} FROM {}").format(selected, sql.SQL(PLAYER_SOURCE))
+    condition, filter_params = filter_clause(filters)
+    if condition:
+        query += sql.SQL(" WHERE ") + condition
+        params.extend(filter_params)
+    query += sql.SQL(" ORDER BY id")
+
+    # A named cursor keeps the result set on the server; rows only cross
+    # the wire as each batch is fetched
+    with conn.cursor(name=f"player_export_{uuid.uuid4().hex}") as cursor:
+        cursor.itersize = batch_size
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    conn.rollback()
+
+class InvalidPatch(ValueError):
+    pass
+
+
+class PatchConflict(InvalidPatch):
+    pass
+
+
+# Keys managed by the database that patches cannot set
+RESERVED_PATCH_KEYS = {"id", "version"}
+# Typed column template for the VALUES list of patch_players
+PATCH_COLUMN_TYPES = {
+    "player_name": "varchar",
+    "position": "varchar",
+    "team": "varchar",
+    **{column: "real" if column in FLOAT_COLUMNS else "smallint" for column in STAT_KEYS},
+}
+TEXT_PATCH_KEYS = ("player_name", "position", "team", "description")
+
+
+def _patch_row(player_id: int, expected_version: Optional[int], changes: Dict[str, Any]) -> Tuple:
+    for key in TEXT_PATCH_KEYS:
+        if not isinstance(changes.get(key), (str, type(None))):
+            raise InvalidPatch(f"{key} for player {player_id} must be a string")
+    stats = [stat_value(changes, column) for column in STAT_KEYS]
+    for value, keys in zip(stats, STAT_KEYS.values()):
+        if value is None and any(changes.get(key) is not None for key in keys):
+            raise InvalidPatch(f"{keys[0]} for player {player_id} is not a valid value")
+    return (
+        player_id,
+        expected_version,
+        json.dumps(changes),
+        json.dumps(player_extras(changes)),
+        changes.get("description"),
+        changes.get("player_name"),
+        changes.get("position"),
+        changes.get("team"),
+        *stats,
+    )
+
+
+def _patch_assignment(column: str) -> str:
+    keys = STAT_KEYS.get(column, (column,))
+    key_array = ", ".join(f"'{key}'" for key in keys)
+    return f"{column} = CASE WHEN v.patch ?| ARRAY[{key_array}] THEN v.{column} ELSE p.{column} END"
+
+
+PATCH_ASSIGNMENTS = ",\n".join(_patch_assignment(column) for column in PATCH_COLUMN_TYPES)
+
+
+@pooled
+def patch_players(conn, patches: List[Dict[str, Any]], page_size: int = 1000) -> Optional[Dict[str, List]]:
+    """
+    Merge partial documents into many players in one statement.
+
+    Each patch is {"id", "changes", "version"?}. Typed columns whose keys
+    appear in a patch are set, the description is replaced if given, and
+    any other keys are merged into the player's extras with jsonb ||. A
+    patch carrying a version is only applied if it matches the row's
+    current version; every applied patch bumps the version.
+
+    Returns:
+        The new versions of updated players, the current versions of players
+        whose version did not match, and the ids not found; None on failure
+
+    Raises:
+        InvalidPatch: If a patch is malformed, a player appears twice or a
+            typed value does not fit its column
+        PatchConflict: If a patch would duplicate another player's name and position
+    """
+    if not conn:
+        logger.error("No database connection")
+        return None
+
+    rows = []
+    seen = set()
+    for patch in patches:
+        player_id = patch.get("id")
+        changes = patch.get("changes")
+        expected_version = patch.get("version")
+        if not isinstance(player_id, int) or not isinstance(changes, dict):
+            raise InvalidPatch("Each patch needs an integer id and a changes object")
+        if expected_version is not None and not isinstance(expected_version, int):
+            raise InvalidPatch(f"Version for player {player_id} must be an integer")
+        if player_id in seen:
+            raise InvalidPatch(f"Player {player_id} is patched more than once")
+        seen.add(player_id)
+        changes = {k: v for k, v in changes.items() if k not in RESERVED_PATCH_KEYS}
+        rows.append(_patch_row(player_id, expected_version, changes))
+
+    result: Dict[str, List] = {"updated": [], "conflicts": [], "not_found": []}
+    if not rows:
+        return result
+
+    value_columns = ", ".join(PATCH_COLUMN_TYPES)
+    template = "(%s::integer, %s::integer, %s::jsonb, %s::jsonb, %s::text, " + ", ".join(
+        f"%s::{column_type}" for column_type in PATCH_COLUMN_TYPES.values()
+    ) + ")"
+    try:
+        with conn.cursor() as cursor:
+            updated = execute_values(
+                cursor,
+                f"""
+                WITH v (id, expected_version, patch, extras, description, {value_columns}) AS (
+                    VALUES %s
+                ),
+                updated AS (
+                    UPDATE players AS p SET
+                        {PATCH_ASSIGNMENTS},
+                        version = p.version + 1
+                    FROM v
+                    WHERE p.id = v.id
+                        AND (v.expected_version IS NULL OR p.version = v.expected_version)
+                    RETURNING p.id, p.version
+                ),
+                details AS (
+                    UPDATE player_details AS d SET
+                        description = CASE WHEN v.patch ? 'description'
+                            THEN v.description ELSE d.description END,
+                        extras = d.extras || v.extras
+                    FROM v JOIN updated USING (id)
+                    WHERE d.player_id = v.id
+                )
+                SELECT id, version FROM updated
+                """,
+                rows,
+                template=template,
+                page_size=page_size,
+                fetch=True,
+            )
+            updated_ids = {player_id for player_id, _ in updated}
+            missed = [row[0] for row in rows if row[0] not in updated_ids]
+            current = {}
+            if missed:
+                cursor.execute(
+                    "SELECT id, version FROM players WHERE id = ANY(%s)", (missed,)
+                )
+                current = dict(cursor.fetchall())
+        conn.commit()
+    except psycopg2.errors.UniqueViolation as e:
+        conn.rollback()
+        raise PatchConflict("Another player already has that name and position") from e
+    except Exception as e:
+        logger.error("Database error: %s", e)
+        conn.rollback()
+        return None
+
+    result["updated"] = [{"id": player_id, "version": version} for player_id, version in updated]
+    for player_id in missed:
+        if player_id in current:
+            result["conflicts"].append({"id": player_id, "version": current[player_id]})
+        else:
+            result["not_found"].append(player_id)
+    if updated_ids:
+        notify_players_changed(sorted(updated_ids))
+    return result
+
+@pooled
+def patch_player(conn, player_id: int, changes: Dict[str, Any]) -> bool:
+    """
+    Merge keys into one player regardless of version, e.g. to store a
+    generated description without rewriting the whole document.
+    """
+    result = patch_players.sync(conn, [{"id": player_id, "changes": changes}])
+    return bool(result and result["updated"])
+
+@pooled
 def update_player(conn, player_id: int, player_data: Dict[str, Any]) -> bool:
     """
-    Update a player's data in the database.
+    Replace a player's document in the database: its name, position, team
+    and typed stat columns are re-derived from the new document, and its
+    description and extras are replaced. A document without a name or
+    position keeps the current one.
     """
     if not conn:
         logger.error("No database connection")
         return False
 
+    player_data = {k: v for k, v in player_data.items() if k not in RESERVED_PATCH_KEYS}
+    assignments = ", ".join(f"{column} = %s" for column in STAT_KEYS)
     try:
         with conn.cursor() as cursor:
             cursor.execute(
-                "UPDATE players SET data = %s WHERE id = %s",
-                (json.dumps(player_data), player_id)
+                f"""
+                UPDATE players SET
+                    player_name = COALESCE(%s, player_name),
+                    position = COALESCE(%s, position),
+                    team = %s, {assignments}, version = version + 1
+                WHERE id = %s
+                """,
+                (
+                    player_data.get("player_name"),
+                    player_data.get("position"),
+                    player_data.get("team"),
+                    *(stat_value(player_data, column) for column in STAT_KEYS),
+                    player_id,
+                )
             )
+            updated = cursor.rowcount > 0
+            if updated:
+                cursor.execute(
+                    """
+                    INSERT INTO player_details (player_id, description, extras)
+                    VALUES (%s, %s, %s::jsonb)
+                    ON CONFLICT (player_id) DO UPDATE SET
+                        description = EXCLUDED.description, extras = EXCLUDED.extras
+                    """,
+                    (player_id, player_data.get("description"), json.dumps(player_extras(player_data))),
+                )
             conn.commit()
-            return cursor.rowcount > 0
+        if updated:
+            notify_players_changed([player_id])
+        return updated
+    except Exception as e:
+        logger.error("Database error: %s", e)
+        conn.rollback()
+        return False
+
+@pooled
+def get_cached_description(conn, prompt_hash: str) -> Optional[str]:
+    """
+    Look up a previously generated description by prompt hash.
+    """
+    if not conn:
+        return None
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute(
+                "SELECT description FROM description_cache WHERE prompt_hash = %s",
+                (prompt_hash,)
+            )
+            row = cursor.fetchone()
+            return row[0] if row else None
+        except psycopg2.Error as e:
+            logger.error("Error fetching cached description: %s", e)
+            return None
+
+@pooled
+def get_cached_descriptions(conn, prompt_hashes: List[str]) -> Dict[str, str]:
+    """
+    Look up previously generated descriptions for many prompt hashes at once.
+
+    Returns:
+        Descriptions by prompt hash, for the hashes that have one
+    """
+    if not conn or not prompt_hashes:
+        return {}
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute(
+                "SELECT prompt_hash, description FROM description_cache WHERE prompt_hash = ANY(%s)",
+                (prompt_hashes,)
+            )
+            return dict(cursor.fetchall())
+        except psycopg2.Error as e:
+            logger.error("Error fetching cached descriptions: %s", e)
+            return {}
+
+@pooled
+def store_cached_description(conn, prompt_hash: str, model: str, description: str) -> bool:
+    """
+    Persist a generated description, replacing any earlier one for the prompt.
+    """
+    if not conn:
+        logger.error("No database connection")
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO description_cache (prompt_hash, model, description)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (prompt_hash) DO UPDATE SET
+                    description = EXCLUDED.description,
+                    created_at = now()
+                """,
+                (prompt_hash, model, description)
+            )
+        conn.commit()
+        return True
+    except Exception as e:
+        logger.error("Database error: %s", e)
+        conn.rollback()
+        return False
+
+@pooled
+def enqueue_description_jobs(
+    conn, player_ids: Optional[List[int]] = None, retry: bool = True
+) -> Optional[int]:
+    """
+    Queue description generation for players that have no description.
+
+    Args:
+        player_ids: Restrict to these players; all players when omitted
+        retry: Also re-queue failed and finished jobs; otherwise only
+            players without a job are queued
+
+    Returns:
+        Number of jobs newly queued or re-queued, or None on failure
+    """
+    if not conn:
+        logger.error("No database connection")
+        return None
+    query = f"""
+        INSERT INTO description_jobs (player_id)
+        SELECT id FROM {PLAYER_SOURCE}
+        WHERE description IS NULL
+    """
+    params: List[Any] = []
+    if player_ids is not None:
+        query += " AND id = ANY(%s)"
+        params.append(player_ids)
+    # Failed and finished jobs are retried when explicitly re-queued
+    query += """
+        ON CONFLICT (player_id) DO UPDATE SET
+            status = 'pending', error = NULL, updated_at = now()
+        WHERE description_jobs.status IN ('failed', 'done')
+    """ if retry else " ON CONFLICT (player_id) DO NOTHING"
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, params)
+            queued = cursor.rowcount
+        conn.commit()
+        return queued
+    except Exception as e:
+        logger.error("Database error: %s", e)
+        conn.rollback()
+        return None
+
+@pooled
+def claim_description_job(conn, preferred_ids: Optional[List[int]] = None) -> Optional[int]:
+    """
+    Atomically mark the next pending job as running and return its player id.
+    Pending jobs among `preferred_ids` are claimed first.
+    """
+    if not conn:
+        return None
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE description_jobs SET
+                    status = 'running', attempts = attempts + 1, updated_at = now()
+                WHERE player_id = (
+                    SELECT player_id FROM description_jobs
+                    WHERE status = 'pending'
+                    ORDER BY player_id = ANY(%s) DESC, player_id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING player_id
+                """,
+                (preferred_ids or [],)
+            )
+            row = cursor.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    except Exception as e:
+        logger.error("Database error: %s", e)
+        conn.rollback()
+        return None
+
+@pooled
+def finish_description_job(conn, player_id: int, status: str, error: Optional[str] = None) -> bool:
+    """
+    Record the outcome ('done' or 'failed') of a description job.
+    """
+    if not conn:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE description_jobs SET status = %s, error = %s, updated_at = now()
+                WHERE player_id = %s
+                """,
+                (status, error, player_id)
+            )
+        conn.commit()
+        return True
+    except Exception as e:
+        logger.error("Database error: %s", e)
+        conn.rollback()
+        return False
+
+@pooled
+def requeue_running_description_jobs(conn, older_than: float = 0.0) -> int:
+    """
+    Return jobs left 'running' by a stopped process to the pending queue.
+
+    Args:
+        older_than: Only requeue jobs claimed at least this many seconds ago,
+            so jobs other workers are still running are left alone
+    """
+    if not conn:
+        return 0
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "UPDATE description_jobs SET status = 'pending' "
+                "WHERE status = 'running' AND updated_at <= now() - make_interval(secs => %s)",
+                (older_than,)
+            )
+            requeued = cursor.rowcount
+        conn.commit()
+        return requeued
+    except Exception as e:
+        logger.error("Database error: %s", e)
+        conn.rollback()
+        return 0
+
+@pooled
+def description_job_counts(conn) -> Dict[str, int]:
+    """
+    Count description jobs by status.
+    """
+    counts = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+    if not conn:
+        return counts
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute("SELECT status, COUNT(*) FROM description_jobs GROUP BY status")
+            counts.update(dict(cursor.fetchall()))
+        except psycopg2.Error as e:
+            logger.error("Error counting description jobs: %s", e)
+    return counts
+
+@pooled
+def fetch_player_hashes(conn) -> Optional[Dict[Tuple[str, str], str]]:
+    """
+    Map (player_name, position) to the source hash of every stored player.
+    """
+    if not conn:
+        return None
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute("SELECT player_name, position, source_hash FROM players")
+            return {(name, position): source_hash for name, position, source_hash in cursor}
+        except psycopg2.Error as e:
+            logger.error("Error fetching player hashes: %s", e)
+            return None
+
+@pooled
+def get_feed_sync_state(conn, url: str) -> Dict[str, Optional[str]]:
+    """
+    Return the validators (ETag / Last-Modified) from the last sync of a feed.
+    """
+    state = {"etag": None, "last_modified": None}
+    if not conn:
+        return state
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute(
+                "SELECT etag, last_modified FROM feed_sync_state WHERE url = %s", (url,)
+            )
+            row = cursor.fetchone()
+            if row:
+                state["etag"], state["last_modified"] = row
+        except psycopg2.Error as e:
+            logger.error("Error fetching feed sync state: %s", e)
+    return state
+
+@pooled
+def save_feed_sync_state(conn, url: str, etag: Optional[str], last_modified: Optional[str]) -> bool:
+    """
+    Remember the validators of a successfully synced feed.
+    """
+    if not conn:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO feed_sync_state (url, etag, last_modified, synced_at)
+                VALUES (%s, %s, %s, now())
+                ON CONFLICT (url) DO UPDATE SET
+                    etag = EXCLUDED.etag,
+                    last_modified = EXCLUDED.last_modified,
+                    synced_at = now()
+                """,
+                (url, etag, last_modified)
+            )
+        conn.commit()
+        return True
+    except Exception as e:
+        logger.error("Database error: %s", e)
+        conn.rollback()
+        return False
+
+@pooled
+def refresh_stats_views(conn) -> bool:
+    """
+    Refresh the leaderboard and aggregate materialized views without
+    blocking readers.
+    """
+    if not conn:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY player_leaderboards")
+            cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY player_aggregates")
+        conn.commit()
+        return True
     except Exception as e:
-        logger.error(f"Database error: {e}")
+        logger.error("Database error: %s", e)
+        conn.rollback()
+        return False
+
+@pooled
+def fetch_leaderboard(
+    conn, stat: str, limit: int, position: Optional[str] = None
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Read the top `limit` players for a stat, league-wide or within a position.
+    """
+    if not conn:
+        logger.error("No database connection")
+        return None
+    rank_column = "position_rank" if position else "league_rank"
+    query = sql.SQL(
+        "SELECT {rank}, id, player_name, position, team, value "
+        "FROM player_leaderboards WHERE stat = %s"
+    ).format(rank=sql.Identifier(rank_column))
+    params: List[Any] = [stat]
+    if position:
+        query += sql.SQL(" AND position = %s")
+        params.append(position)
+    query += sql.SQL(" AND {rank} <= %s ORDER BY {rank}, id").format(rank=sql.Identifier(rank_column))
+    params.append(limit)
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute(query, params)
+            return [
+                {
+                    "rank": rank,
+                    "id": player_id,
+                    "player_name": player_name,
+                    "position": player_position,
+                    "team": team,
+                    "value": value,
+                }
+                for rank, player_id, player_name, player_position, team, value in cursor.fetchall()
+            ]
+        except psycopg2.Error as e:
+            logger.error("Error fetching leaderboard: %s", e)
+            return None
+
+@pooled
+def fetch_aggregates(conn, group_type: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Read per-group player counts, stat means and percentile distributions.
+
+    Args:
+        group_type: "league", "position" or "team"
+    """
+    if not conn:
+        logger.error("No database connection")
+        return None
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute(
+                "SELECT * FROM player_aggregates WHERE group_type = %s ORDER BY group_value",
+                (group_type,)
+            )
+            columns = [column.name for column in cursor.description]
+            groups = []
+            for record in cursor.fetchall():
+                row = dict(zip(columns, record))
+                groups.append({
+                    "group": row["group_value"] or None,
+                    "players": row["players"],
+                    "stats": {
+                        column: {
+                            "mean": row[f"{column}_mean"],
+                            "percentiles": dict(zip(
+                                (f"p{round(p * 100)}" for p in DISTRIBUTION_PERCENTILES),
+                                row[f"{column}_percentiles"] or (),
+                            )),
+                        }
+                        for column in STAT_COLUMNS
+                    },
+                })
+            return groups
+        except psycopg2.Error as e:
+            logger.error("Error fetching aggregates: %s", e)
+            return None
+
+@pooled
+def fetch_stat_rows(conn, player_ids: Optional[List[int]] = None) -> Optional[List[Tuple]]:
+    """
+    Read (id, *STAT_COLUMNS) rows for all players or the given ids.
+    """
+    if not conn:
+        logger.error("No database connection")
+        return None
+    query = sql.SQL("SELECT id, {columns} FROM players").format(
+        columns=sql.SQL(", ").join(sql.Identifier(column) for column in STAT_COLUMNS)
+    )
+    params: List[Any] = []
+    if player_ids is not None:
+        query += sql.SQL(" WHERE id = ANY(%s)")
+        params.append(player_ids)
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        except psycopg2.Error as e:
+            logger.error("Error fetching player stats: %s", e)
+            return None
+
+# Embedding inputs: identity, description, then the typed stat columns
+EMBEDDING_INPUT_COLUMNS = (
+    "p.id, p.version, p.player_name, p.position, p.team, d.description, "
+    + ", ".join(f"p.{column}" for column in STAT_COLUMNS)
+)
+
+@pooled
+def fetch_embedding_inputs(
+    conn, model: str, player_ids: Optional[List[int]] = None, limit: int = 1000
+) -> Optional[List[Tuple]]:
+    """
+    Read what embeddings are computed from, for the given players or else
+    for up to `limit` players whose embedding under `model` is missing or
+    older than the player's current version.
+
+    Returns:
+        (id, version, player_name, position, team, description, *STAT_COLUMNS) rows
+    """
+    if not conn:
+        logger.error("No database connection")
+        return None
+    if player_ids is not None:
+        query = f"""
+            SELECT {EMBEDDING_INPUT_COLUMNS}
+            FROM players p
+            LEFT JOIN player_details d ON d.player_id = p.id
+            WHERE p.id = ANY(%s)
+        """
+        params: Tuple = (player_ids,)
+    else:
+        query = f"""
+            SELECT {EMBEDDING_INPUT_COLUMNS}
+            FROM players p
+            LEFT JOIN player_details d ON d.player_id = p.id
+            LEFT JOIN player_embeddings e ON e.player_id = p.id AND e.model = %s
+            WHERE e.player_id IS NULL OR e.player_version <> p.version
+            ORDER BY p.id
+            LIMIT %s
+        """
+        params = (model, limit)
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        except psycopg2.Error as e:
+            logger.error("Error fetching embedding inputs: %s", e)
+            return None
+
+@pooled
+def store_embeddings(conn, model: str, rows: List[Tuple[int, int, bytes]]) -> bool:
+    """
+    Upsert (player_id, player_version, embedding) rows for a model.
+    """
+    if not conn:
+        logger.error("No database connection")
+        return False
+    try:
+        with conn.cursor() as cursor:
+            execute_values(
+                cursor,
+                """
+                INSERT INTO player_embeddings (model, player_id, player_version, embedding)
+                VALUES %s
+                ON CONFLICT (model, player_id) DO UPDATE SET
+                    player_version = EXCLUDED.player_version,
+                    embedding = EXCLUDED.embedding
+                """,
+                [(model, player_id, version, psycopg2.Binary(embedding))
+                 for player_id, version, embedding in rows],
+            )
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        # A player deleted meanwhile violates the foreign key; skip the batch
+        logger.error("Error storing embeddings: %s", e)
         conn.rollback()
-        return False
\ No newline at end of file
+        return False
+
+@pooled
+def fetch_embeddings(conn, model: str) -> Optional[List[Tuple[int, bytes]]]:
+    """
+    Read every stored (player_id, embedding) for a model.
+    """
+    if not conn:
+        logger.error("No database connection")
+        return None
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute(
+                "SELECT player_id, embedding FROM player_embeddings WHERE model = %s",
+                (model,),
+            )
+            return [(player_id, bytes(embedding)) for player_id, embedding in cursor.fetchall()]
+        except psycopg2.Error as e:
+            logger.error("Error fetching embeddings: %s", e)
+            return None
+
+@pooled
+def fetch_player_summaries(conn, player_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    Names, positions and teams of the given players, keyed by id.
+    """
+    if not conn or not player_ids:
+        return {}
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute(
+                "SELECT id, player_name, position, team FROM players WHERE id = ANY(%s)",
+                (player_ids,),
+            )
+            return {
+                player_id: {"id": player_id, "player_name": name, "position": position, "team": team}
+                for player_id, name, position, team in cursor.fetchall()
+            }
+        except psycopg2.Error as e:
+            logger.error("Error fetching players: %s", e)
+            return {}
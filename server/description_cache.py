@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from cachetools import LRUCache
+
+from logging_config import get_logger
+from cluster import cluster
+from metrics import cache_requests, llm_deadline_exceeded, llm_descriptions, span
+from database_operations import (
+    get_cached_description,
+    get_cached_descriptions,
+    store_cached_description,
+)
+from ollama_service import (
+    DESCRIPTION_BATCH_SIZE,
+    DESCRIPTION_DEADLINE_SECONDS,
+    DESCRIPTION_MODEL,
+    build_description_prompt,
+    chat_description,
+    chat_descriptions,
+    generate_fallback_description,
+)
+
+logger = get_logger(__name__)
+
+# Hot descriptions stay in process; the description_cache table backs them
+_memory_cache = LRUCache(maxsize=2048)
+# Generations currently running, keyed like the cache
+_in_flight: Dict[str, asyncio.Future] = {}
+
+
+def _forget(keys: Optional[List[str]]) -> None:
+    if keys is None:
+        _memory_cache.clear()
+        return
+    for key in keys:
+        _memory_cache.pop(key, None)
+
+
+# Regenerated descriptions replace what other workers hold in memory
+cluster.subscribe("descriptions", _forget)
+
+
+def prompt_key(model: str, prompt: str) -> str:
+    """
+    Hash a model name and prompt into a cache key.
+    """
+    return hashlib.sha256(f"{model}\0{prompt}".encode()).hexdigest()
+
+
+async def cached_description(prompt: str) -> Optional[str]:
+    """
+    Return the cached description for a prompt, from memory or the database.
+    """
+    key = prompt_key(DESCRIPTION_MODEL, prompt)
+    cached = _memory_cache.get(key)
+    if cached is not None:
+        cache_requests.inc(cache="description_memory", result="hit")
+        return cached
+    cache_requests.inc(cache="description_memory", result="miss")
+    with span("description.cache"):
+        cached = await get_cached_description(key)
+    cache_requests.inc(cache="description_db", result="hit" if cached else "miss")
+    if cached:
+        _memory_cache[key] = cached
+    return cached
+
+
+async def cached_descriptions(keys: List[str]) -> Dict[str, str]:
+    """
+    Return cached descriptions by cache key, from memory or, for the keys
+    missing there, a single database query.
+    """
+    found = {key: _memory_cache[key] for key in keys if key in _memory_cache}
+    missed = [key for key in keys if key not in found]
+    cache_requests.inc(len(found), cache="description_memory", result="hit")
+    cache_requests.inc(len(missed), cache="description_memory", result="miss")
+    if not missed:
+        return found
+    with span("description.cache"):
+        stored = await get_cached_descriptions(missed)
+    cache_requests.inc(len(stored), cache="description_db", result="hit")
+    cache_requests.inc(len(missed) - len(stored), cache="description_db", result="miss")
+    for key, description in stored.items():
+        _memory_cache[key] = description
+    return {**found, **stored}
+
+
+async def remember_description(prompt: str, description: str) -> None:
+    """
+    Cache a generated description in memory and in the database.
+    """
+    key = prompt_key(DESCRIPTION_MODEL, prompt)
+    _memory_cache[key] = description
+    await store_cached_description(key, DESCRIPTION_MODEL, description)
+    cluster.publish("descriptions", [key])
+
+
+def _finished(key: str, task: asyncio.Future) -> None:
+    _in_flight.pop(key, None)
+    # Retrieve the error of a generation every caller stopped waiting for,
+    # so it is not reported as never retrieved
+    if not task.cancelled():
+        task.exception()
+
+
+async def _generate(prompt: str) -> str:
+    description = await chat_description(prompt)
+    await remember_description(prompt, description)
+    return description
+
+
+async def describe_player(
+    player_name: str,
+    position: str,
+    team: str,
+    player_data: Dict[str, Any],
+    refresh: bool = False,
+    fallback: bool = True,
+    deadline: Optional[float] = DESCRIPTION_DEADLINE_SECONDS,
+) -> str:
+    """
+    Return a description for a player, generating it at most once.
+
+    Concurrent callers for the same prompt share a single in-flight
+    generation. Results are cached in memory and in the description_cache
+    table under a hash of model and prompt. A generation that misses the
+    deadline keeps running and is cached for the next request.
+
+    Args:
+        player_name: Name of the player
+        position: Player's position
+        team: Player's team
+        player_data: Additional player data
+        refresh: Skip cached results and generate a new description
+        fallback: Return a fallback description if generation fails,
+            instead of raising
+        deadline: Seconds to wait for the model, including time queued for
+            an Ollama host; None waits as long as the request takes
+
+    Returns:
+        Generated (or fallback) description
+    """
+    prompt = build_description_prompt(player_name, position, team)
+    key = prompt_key(DESCRIPTION_MODEL, prompt)
+
+    if not refresh:
+        cached = await cached_description(prompt)
+        if cached:
+            llm_descriptions.inc(source="cache")
+            return cached
+
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_generate(prompt))
+        _in_flight[key] = task
+        task.add_done_callback(lambda done: _finished(key, done))
+    else:
+        logger.debug("Joining in-flight description generation")
+    try:
+        # Shield so one caller disconnecting does not cancel the shared generation
+        return await asyncio.wait_for(asyncio.shield(task), deadline)
+    except asyncio.TimeoutError:
+        llm_deadline_exceeded.inc()
+        if not fallback:
+            raise
+        logger.warning("No description within %gs, using fallback", deadline)
+    except Exception as e:
+        if not fallback:
+            raise
+        logger.error("Ollama generation error: %s", e)
+    # Fallbacks are not cached so the next request retries the model
+    return generate_fallback_description(position, team, player_data)
+
+
+def _player_prompt(player: Dict[str, Any]) -> str:
+    return build_description_prompt(player["player_name"], player["position"], player.get("team"))
+
+
+async def _describe_batch(
+    players: List[Dict[str, Any]], generations: Dict[str, asyncio.Future]
+) -> Dict[int, Tuple[str, str]]:
+    """
+    Describe players whose generations this batch registered in _in_flight,
+    resolving each one as its description is known, so callers that joined
+    it get the same description.
+    """
+    results: Dict[int, Tuple[str, str]] = {}
+    try:
+        try:
+            described = await chat_descriptions(players)
+        except Exception as e:
+            logger.error("Batch description generation failed for %d players: %s", len(players), e)
+            described = {}
+        for index, player in enumerate(players):
+            prompt = _player_prompt(player)
+            generation = generations[prompt_key(DESCRIPTION_MODEL, prompt)]
+            if index in described:
+                await remember_description(prompt, described[index])
+                generation.set_result(described[index])
+                results[player["id"]] = (described[index], "batch")
+                continue
+            # Skipped or unusable in the batch: one request of its own, then the fallback
+            try:
+                description = await _generate(prompt)
+            except Exception as e:
+                logger.error("Ollama generation error for player %s: %s", player["id"], e)
+                generation.set_exception(e)
+                results[player["id"]] = (
+                    generate_fallback_description(player["position"], player.get("team"), player),
+                    "fallback",
+                )
+                continue
+            generation.set_result(description)
+            results[player["id"]] = (description, "single")
+    finally:
+        # Never leave joined callers waiting on a batch that stopped early
+        for player in players:
+            generation = generations[prompt_key(DESCRIPTION_MODEL, _player_prompt(player))]
+            if not generation.done():
+                generation.set_exception(RuntimeError("Batch description generation stopped"))
+    return results
+
+
+async def _join(player: Dict[str, Any], generation: asyncio.Future) -> Tuple[int, Tuple[str, str]]:
+    try:
+        return player["id"], (await asyncio.shield(generation), "joined")
+    except Exception:
+        return player["id"], (
+            generate_fallback_description(player["position"], player.get("team"), player),
+            "fallback",
+        )
+
+
+async def describe_players(
+    players: List[Dict[str, Any]], refresh: bool = False
+) -> Dict[int, Tuple[str, str]]:
+    """
+    Describe many players, packing up to DESCRIPTION_BATCH_SIZE of them into
+    each model call. Batches run concurrently, queued by the Ollama pool.
+
+    Cached descriptions are looked up in one query. Players whose prompt is
+    already being generated, by describe_player or another batch, join that
+    generation; the rest are registered as in flight until their batch
+    answers. Players the model skips in a batch get a request of their own,
+    and a fallback description if that fails too. Generated descriptions are
+    cached under the same keys describe_player uses.
+
+    Args:
+        players: Player documents, each with id, player_name, position and team
+        refresh: Skip cached results and generate new descriptions
+
+    Returns:
+        (description, source) by player id, source being one of "cache",
+        "batch", "single", "joined" or "fallback"
+    """
+    results: Dict[int, Tuple[str, str]] = {}
+    keys = {player["id"]: prompt_key(DESCRIPTION_MODEL, _player_prompt(player)) for player in players}
+    if not refresh:
+        cached = await cached_descriptions(list(set(keys.values())))
+        for player in players:
+            description = cached.get(keys[player["id"]])
+            if description:
+                llm_descriptions.inc(source="cache")
+                results[player["id"]] = (description, "cache")
+
+    pending: List[Dict[str, Any]] = []
+    joined: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+    generations: Dict[str, asyncio.Future] = {}
+    for player in players:
+        if player["id"] in results:
+            continue
+        key = keys[player["id"]]
+        if key in _in_flight:
+            joined.append((player, _in_flight[key]))
+            continue
+        generation = asyncio.get_running_loop().create_future()
+        _in_flight[key] = generations[key] = generation
+        generation.add_done_callback(lambda done, key=key: _finished(key, done))
+        pending.append(player)
+
+    batches = [
+        pending[start:start + DESCRIPTION_BATCH_SIZE]
+        for start in range(0, len(pending), DESCRIPTION_BATCH_SIZE)
+    ]
+    described = await asyncio.gather(
+        *(_describe_batch(batch, generations) for batch in batches),
+        *(_join(player, generation) for player, generation in joined),
+    )
+    for result in described[:len(batches)]:
+        results.update(result)
+    results.update(described[len(batches):])
+    return results
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from logging_config import get_logger
+from caching import response_cache
+from database_operations import (
+    get_player_by_id,
+    patch_player,
+    enqueue_description_jobs,
+    claim_description_job,
+    finish_description_job,
+    requeue_running_description_jobs,
+    description_job_counts,
+)
+from description_cache import describe_player
+from ollama_service import generation_stats
+
+logger = get_logger(__name__)
+
+DESCRIPTION_WORKER_ENABLED = os.getenv("DESCRIPTION_WORKER_ENABLED", "true").lower() == "true"
+DESCRIPTION_WORKER_CONCURRENCY = int(os.getenv("DESCRIPTION_WORKER_CONCURRENCY", "2"))
+# How long idle workers wait before checking the queue again
+DESCRIPTION_WORKER_POLL_SECONDS = float(os.getenv("DESCRIPTION_WORKER_POLL_SECONDS", "10"))
+# Jobs running for longer than this are taken to belong to a stopped process
+# and requeued; it has to exceed the slowest generation, since other workers
+# may be running jobs while this one starts
+DESCRIPTION_JOB_LEASE_SECONDS = float(os.getenv("DESCRIPTION_JOB_LEASE_SECONDS", "600"))
+
+
+class DescriptionWorker:
+    """
+    Pre-generates player descriptions from the description_jobs queue.
+
+    Job state lives in Postgres, so a restart picks up where the previous
+    process stopped and several workers can share the queue. Players on
+    recently viewed pages are generated first.
+    """
+
+    def __init__(self, concurrency: int = DESCRIPTION_WORKER_CONCURRENCY):
+        self.concurrency = concurrency
+        self._tasks: List[asyncio.Task] = []
+        self._running = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        # Recently viewed player ids, most recent last
+        self._priority: "OrderedDict[int, None]" = OrderedDict()
+        # Prioritized players that may not have a job yet
+        self._unqueued: Set[int] = set()
+        self._started_at: Optional[float] = None
+        self._requeued_at = 0.0
+        self._tokens_at_start = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def paused(self) -> bool:
+        return not self._running.is_set()
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        await self._requeue_expired()
+        await enqueue_description_jobs()
+        self._started_at = time.monotonic()
+        self._tokens_at_start = generation_stats["eval_tokens"]
+        self._running.set()
+        self._tasks = [
+            asyncio.create_task(self._work()) for _ in range(self.concurrency)
+        ]
+        logger.info("Description worker started with concurrency %d", self.concurrency)
+
+    async def _requeue_expired(self) -> None:
+        self._requeued_at = time.monotonic()
+        requeued = await requeue_running_description_jobs(DESCRIPTION_JOB_LEASE_SECONDS)
+        if requeued:
+            logger.info("Requeued %d interrupted description jobs", requeued)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def pause(self) -> None:
+        self._running.clear()
+
+    def resume(self) -> None:
+        self._running.set()
+        self._wakeup.set()
+
+    async def enqueue(
+        self, player_ids: Optional[List[int]] = None, retry: bool = True
+    ) -> Optional[int]:
+        queued = await enqueue_description_jobs(player_ids, retry)
+        self._wakeup.set()
+        return queued
+
+    def prioritize(self, player_ids: Iterable[int]) -> None:
+        """
+        Move players (e.g. those on a page just served) to the front of the
+        queue, queueing those that have no job yet.
+        """
+        for player_id in player_ids:
+            if player_id not in self._priority:
+                self._unqueued.add(player_id)
+            self._priority.pop(player_id, None)
+            self._priority[player_id] = None
+        while len(self._priority) > 1000:
+            player_id, _ = self._priority.popitem(last=False)
+            self._unqueued.discard(player_id)
+        self._wakeup.set()
+
+    async def progress(self) -> Dict[str, Any]:
+        counts = await description_job_counts()
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        tokens = generation_stats["eval_tokens"] - self._tokens_at_start
+        return {
+            **counts,
+            "running_workers": len(self._tasks),
+            "paused": self.paused,
+            "concurrency": self.concurrency,
+            "completed_this_run": self.completed,
+            "failed_this_run": self.failed,
+            "tokens_per_second": round(tokens / elapsed, 2) if elapsed else 0.0,
+        }
+
+    async def _work(self) -> None:
+        while True:
+            await self._running.wait()
+            if self._unqueued:
+                player_ids = list(self._unqueued)
+                self._unqueued.clear()
+                await enqueue_description_jobs(player_ids, retry=False)
+            preferred = list(reversed(self._priority))
+            player_id = await claim_description_job(preferred)
+            if player_id is None:
+                if time.monotonic() - self._requeued_at >= DESCRIPTION_JOB_LEASE_SECONDS:
+                    await self._requeue_expired()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), DESCRIPTION_WORKER_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._priority.pop(player_id, None)
+            await self._process(player_id)
+
+    async def _process(self, player_id: int) -> None:
+        try:
+            player_record = await get_player_by_id(player_id)
+            if not player_record:
+                raise LookupError("Player not found")
+            player_name, position, data = player_record
+            player_data = json.loads(data) if isinstance(data, str) else data
+            if not player_data.get("description"):
+                description = await describe_player(
+                    player_name, position, player_data.get("team"), player_data,
+                    fallback=False, deadline=None,
+                )
+                if not await patch_player(player_id, {"description": description}):
+                    raise RuntimeError("Failed to store description")
+                response_cache.invalidate_player(player_id)
+            await finish_description_job(player_id, "done")
+            self.completed += 1
+        except Exception as e:
+            logger.error("Description job for player %s failed: %s", player_id, e)
+            await finish_description_job(player_id, "failed", str(e))
+            self.failed += 1
+
+
+description_worker = DescriptionWorker()
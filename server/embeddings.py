@@ -0,0 +1,404 @@
+import asyncio
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from logging_config import get_logger
+from database_operations import (
+    FLOAT_COLUMNS,
+    fetch_embedding_inputs,
+    fetch_embeddings,
+    on_players_changed,
+    store_embeddings,
+)
+from ollama_service import EMBEDDING_MODEL, embed_texts
+from pagination import STAT_COLUMNS
+
+logger = get_logger(__name__)
+
+# Model name the deterministic stat embeddings are stored under; bump the
+# suffix whenever stat_features changes so stored vectors are recomputed
+STATS_SPACE = "stats-v1"
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+# Seconds between checks for players whose text embedding is missing or stale
+EMBEDDING_POLL_SECONDS = float(os.getenv("EMBEDDING_POLL_SECONDS", "30"))
+# Players whose stat embeddings are computed per round trip
+STATS_EMBEDDING_BATCH_SIZE = 5000
+
+# Counting stats expressed per plate appearance (at-bats plus walks), so
+# players are compared by profile rather than playing time
+RATE_COLUMNS = (
+    "runs", "hits", "double_2b", "third_baseman", "home_run", "run_batted_in",
+    "a_walk", "strikeouts", "stolen_base", "caught_stealing",
+)
+RATIO_COLUMNS = ("avg", "on_base_percentage", "slugging_percentage", "on_base_plus_slugging")
+# Rough league-typical value of each feature, so every dimension has a
+# similar spread. Fixed rather than fitted to the league, so a player's
+# embedding only changes when their own stats do.
+FEATURE_SCALES = np.array(
+    [0.12, 0.22, 0.045, 0.005, 0.03, 0.11, 0.09, 0.2, 0.02, 0.007]
+    + [0.25, 0.32, 0.4, 0.72]
+    + [162.0, 650.0],
+    dtype=np.float64,
+)
+STATS_DIMENSIONS = len(FEATURE_SCALES)
+# Deviations beyond this many typical values are clipped, so one freak
+# stat (e.g. a pitcher's 1-for-2) does not dominate the distance
+FEATURE_CLIP = 3.0
+
+_COLUMN_INDEX = {column: index for index, column in enumerate(STAT_COLUMNS)}
+
+
+def stat_features(stats: np.ndarray) -> np.ndarray:
+    """
+    Deterministic stat embeddings for a (players x STAT_COLUMNS) matrix with
+    NaN for missing values: rate stats, ratio stats and playing time, each
+    as its relative deviation from a typical value. Missing features are 0,
+    i.e. typical.
+    """
+    stats = np.asarray(stats, dtype=np.float64).reshape(-1, len(STAT_COLUMNS))
+    at_bats = stats[:, _COLUMN_INDEX["at_bat"]]
+    plate_appearances = at_bats + np.nan_to_num(stats[:, _COLUMN_INDEX["a_walk"]])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rates = stats[:, [_COLUMN_INDEX[column] for column in RATE_COLUMNS]] / np.where(
+            plate_appearances > 0, plate_appearances, np.nan
+        )[:, None]
+    features = np.hstack([
+        rates,
+        stats[:, [_COLUMN_INDEX[column] for column in RATIO_COLUMNS]],
+        stats[:, [_COLUMN_INDEX["games"], _COLUMN_INDEX["at_bat"]]],
+    ])
+    features = np.clip(features / FEATURE_SCALES - 1.0, -FEATURE_CLIP, FEATURE_CLIP)
+    return np.nan_to_num(features, nan=0.0).astype(np.float32)
+
+
+def _format_stat(column: str, value) -> Optional[str]:
+    if value is None:
+        return None
+    if column in FLOAT_COLUMNS:
+        return f"{value:.3f}"
+    return str(int(value))
+
+
+def embedding_text(row: Sequence) -> str:
+    """
+    Text embedded for a player: identity, stat line and the generated
+    description when there is one.
+    """
+    _, _, player_name, position, team, description, *stats = row
+    stat_line = ", ".join(
+        f"{column} {formatted}"
+        for column, value in zip(STAT_COLUMNS, stats)
+        if (formatted := _format_stat(column, value)) is not None
+    )
+    text = f"{player_name}, {position}" + (f", {team}" if team else "") + f". Stats: {stat_line}."
+    if description:
+        text += f" {description}"
+    return text
+
+
+class VectorIndex:
+    """
+    Exact nearest-neighbour index over float32 vectors held in one NumPy
+    matrix, searched with a single matrix-vector product.
+
+    Rows are added and replaced in place and removed by moving the last row
+    into the gap, so updates never rebuild the matrix; capacity doubles as it
+    fills. With `normalize`, vectors are scaled to unit length and distance
+    is cosine distance; otherwise it is Euclidean.
+    """
+
+    def __init__(self, normalize: bool = False, capacity: int = 1024):
+        self.normalize = normalize
+        self.dimensions: Optional[int] = None
+        self._capacity = capacity
+        self._ids = np.empty(0, dtype=np.int64)
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._norms = np.empty(0, dtype=np.float32)
+        self._row_of: Dict[int, int] = {}
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, player_id: int) -> bool:
+        return player_id in self._row_of
+
+    def clear(self) -> None:
+        self.__init__(self.normalize, self._capacity)
+
+    def _prepare(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.normalize:
+            lengths = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(lengths > 0, lengths, 1.0)
+        return vectors
+
+    def _grow(self, needed: int) -> None:
+        capacity = max(self._capacity, len(self._ids))
+        while capacity < needed:
+            capacity *= 2
+        if capacity == len(self._ids):
+            return
+        ids = np.empty(capacity, dtype=np.int64)
+        vectors = np.empty((capacity, self.dimensions), dtype=np.float32)
+        norms = np.empty(capacity, dtype=np.float32)
+        if self.size:
+            ids[:self.size] = self._ids[:self.size]
+            vectors[:self.size] = self._vectors[:self.size]
+            norms[:self.size] = self._norms[:self.size]
+        self._ids, self._vectors, self._norms = ids, vectors, norms
+
+    def upsert(self, player_ids: Sequence[int], vectors: np.ndarray) -> None:
+        """
+        Add or replace the vectors of the given players.
+
+        Raises:
+            ValueError: If the vectors' width differs from the index's
+        """
+        if not len(player_ids):
+            return
+        vectors = self._prepare(np.asarray(vectors).reshape(len(player_ids), -1))
+        if self.dimensions is None:
+            self.dimensions = vectors.shape[1]
+        elif vectors.shape[1] != self.dimensions:
+            raise ValueError(
+                f"Expected {self.dimensions}-dimensional vectors, got {vectors.shape[1]}"
+            )
+        self._grow(self.size + len(player_ids))
+        norms = np.einsum("ij,ij->i", vectors, vectors)
+        for player_id, vector, norm in zip(player_ids, vectors, norms):
+            row = self._row_of.get(player_id)
+            if row is None:
+                row = self.size
+                self.size += 1
+                self._row_of[player_id] = row
+                self._ids[row] = player_id
+            self._vectors[row] = vector
+            self._norms[row] = norm
+
+    def remove(self, player_ids: Sequence[int]) -> None:
+        for player_id in player_ids:
+            row = self._row_of.pop(player_id, None)
+            if row is None:
+                continue
+            last = self.size - 1
+            if row != last:
+                moved = int(self._ids[last])
+                self._ids[row] = moved
+                self._vectors[row] = self._vectors[last]
+                self._norms[row] = self._norms[last]
+                self._row_of[moved] = row
+            self.size -= 1
+
+    def vector(self, player_id: int) -> Optional[np.ndarray]:
+        row = self._row_of.get(player_id)
+        return None if row is None else self._vectors[row].copy()
+
+    def search(self, query: np.ndarray, k: int, exclude: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        The k nearest players to `query` as (player_id, distance), nearest
+        first, leaving out `exclude`.
+        """
+        if not self.size or k <= 0:
+            return []
+        query = self._prepare(np.asarray(query).reshape(1, -1))[0]
+        vectors = self._vectors[:self.size]
+        products = vectors @ query
+        if self.normalize:
+            distances = 1.0 - products
+        else:
+            distances = np.maximum(self._norms[:self.size] - 2.0 * products + query @ query, 0.0)
+        if exclude is not None and exclude in self._row_of:
+            distances[self._row_of[exclude]] = np.inf
+        count = min(k, self.size - (exclude in self._row_of))
+        if count <= 0:
+            return []
+        nearest = np.argpartition(distances, count - 1)[:count]
+        nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+        if not self.normalize:
+            distances = np.sqrt(distances)
+        return [(int(self._ids[row]), float(distances[row])) for row in nearest]
+
+
+class SimilarityIndex:
+    """
+    Nearest-neighbour search over player embeddings, in two spaces:
+
+    - "stats": deterministic vectors from stat_features, always available
+    - "text": Ollama embeddings (EMBEDDING_MODEL) of each player's stat line
+      and generated description, when a model is configured
+
+    Embeddings are stored in player_embeddings with the player version they
+    were computed from, so a restart only loads them. Changed players are
+    re-embedded individually: stat vectors on the next search, text vectors
+    by the background loop.
+    """
+
+    def __init__(self):
+        self.stats = VectorIndex()
+        self.text = VectorIndex(normalize=True)
+        self._loaded = False
+        self._dirty: Set[int] = set()
+        self._dirty_lock = threading.Lock()
+        self._refresh_lock = asyncio.Lock()
+        self._embed_lock = asyncio.Lock()
+
+    def mark_changed(self, player_ids: Optional[List[int]]) -> None:
+        with self._dirty_lock:
+            if player_ids is None:
+                # Any player may have changed: reload every index
+                self._loaded = False
+            else:
+                self._dirty.update(player_ids)
+
+    @staticmethod
+    def _decode(rows: List[Tuple[int, bytes]]) -> Tuple[List[int], np.ndarray]:
+        player_ids = [player_id for player_id, _ in rows]
+        vectors = np.vstack([np.frombuffer(embedding, dtype=np.float32) for _, embedding in rows])
+        return player_ids, vectors
+
+    def _load_index(self, index: VectorIndex, rows: List[Tuple[int, bytes]]) -> None:
+        index.clear()
+        if not rows:
+            return
+        # Drop vectors of another width, left behind by a previous model
+        width = len(rows[-1][1])
+        rows = [row for row in rows if len(row[1]) == width]
+        index.upsert(*self._decode(rows))
+
+    async def _embed_stats(self, rows: List[tuple]) -> None:
+        vectors = stat_features(np.array(
+            [[np.nan if value is None else value for value in row[6:]] for row in rows],
+            dtype=np.float64,
+        ))
+        if not await store_embeddings(
+            STATS_SPACE,
+            [(row[0], row[1], vector.tobytes()) for row, vector in zip(rows, vectors)],
+        ):
+            raise RuntimeError("Failed to store stat embeddings")
+        self.stats.upsert([row[0] for row in rows], vectors)
+
+    async def refresh(self) -> None:
+        """
+        Load stored embeddings on first use, computing stat embeddings that
+        are missing or stale, then re-embed only changed players.
+        """
+        async with self._refresh_lock:
+            if not self._loaded:
+                with self._dirty_lock:
+                    self._dirty.clear()
+                rows = await fetch_embeddings(STATS_SPACE)
+                if rows is None:
+                    raise RuntimeError("Failed to load embeddings")
+                self._load_index(self.stats, rows)
+                while True:
+                    stale = await fetch_embedding_inputs(STATS_SPACE, limit=STATS_EMBEDDING_BATCH_SIZE)
+                    if stale is None:
+                        raise RuntimeError("Failed to load players to embed")
+                    if not stale:
+                        break
+                    await self._embed_stats(stale)
+                if EMBEDDING_MODEL:
+                    self._load_index(self.text, await fetch_embeddings(EMBEDDING_MODEL) or [])
+                self._loaded = True
+                logger.info(
+                    "Loaded embeddings for %d players (%d with text embeddings)",
+                    len(self.stats), len(self.text),
+                )
+                return
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, set()
+            if not dirty:
+                return
+            rows = await fetch_embedding_inputs(STATS_SPACE, sorted(dirty))
+            if rows is None:
+                self.mark_changed(list(dirty))
+                raise RuntimeError("Failed to load changed players")
+            deleted = dirty - {row[0] for row in rows}
+            self.stats.remove(list(deleted))
+            self.text.remove(list(deleted))
+            if rows:
+                try:
+                    await self._embed_stats(rows)
+                except RuntimeError:
+                    self.mark_changed(list(dirty))
+                    raise
+
+    async def embed_pending(self) -> int:
+        """
+        Compute text embeddings for players whose embedding is missing or
+        older than the player, a batch at a time.
+
+        Returns:
+            Number of players embedded
+        """
+        if not EMBEDDING_MODEL:
+            return 0
+        embedded = 0
+        async with self._embed_lock:
+            while True:
+                rows = await fetch_embedding_inputs(EMBEDDING_MODEL, limit=EMBEDDING_BATCH_SIZE)
+                if not rows:
+                    break
+                try:
+                    vectors = np.asarray(
+                        await embed_texts([embedding_text(row) for row in rows]), dtype=np.float32
+                    )
+                except Exception as e:
+                    logger.warning("Embedding with %s failed: %s", EMBEDDING_MODEL, e)
+                    break
+                if not await store_embeddings(
+                    EMBEDDING_MODEL,
+                    [(row[0], row[1], vector.tobytes()) for row, vector in zip(rows, vectors)],
+                ):
+                    break
+                player_ids = [row[0] for row in rows]
+                try:
+                    self.text.upsert(player_ids, vectors)
+                except ValueError:
+                    # The model was swapped for one of another width
+                    self.text.clear()
+                    self.text.upsert(player_ids, vectors)
+                embedded += len(rows)
+        if embedded:
+            logger.info("Computed %s embeddings for %d players", EMBEDDING_MODEL, embedded)
+        return embedded
+
+    async def run(self) -> None:
+        """
+        Keep the index loaded and text embeddings current until cancelled.
+        """
+        while True:
+            try:
+                await self.refresh()
+                await self.embed_pending()
+            except RuntimeError as e:
+                logger.error("Similarity index refresh failed: %s", e)
+            await asyncio.sleep(EMBEDDING_POLL_SECONDS)
+
+    def space_for(self, player_id: int, space: str = "auto") -> str:
+        """
+        Resolve "auto" to the text space when the player has a text
+        embedding, the stats space otherwise.
+        """
+        if space == "auto":
+            return "text" if player_id in self.text else "stats"
+        return space
+
+    def similar(self, player_id: int, k: int = 10, space: str = "stats") -> Optional[List[Tuple[int, float]]]:
+        """
+        The k players nearest to `player_id` in the given space, as
+        (player_id, distance), or None if the player has no embedding there.
+        """
+        index = self.text if space == "text" else self.stats
+        query = index.vector(player_id)
+        if query is None:
+            return None
+        return index.search(query, k, exclude=player_id)
+
+
+similarity_index = SimilarityIndex()
+on_players_changed(similarity_index.mark_changed)
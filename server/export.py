@@ -0,0 +1,144 @@
+import csv
+import io
+from typing import Any, Dict, Iterator, List, Optional
+
+import database
+from database_operations import EXPORT_COLUMNS, FLOAT_COLUMNS, iter_player_rows
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is only offered with pyarrow installed
+    pa = None
+    pq = None
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class InvalidExport(ValueError):
+    pass
+
+
+def export_columns(export_format: str, fields: Optional[List[str]]) -> Optional[List[str]]:
+    """
+    Resolve the columns of a tabular export, or None for NDJSON, which
+    exports whole player documents.
+
+    Raises:
+        InvalidExport: If the format is unknown or unavailable, or a field is
+            not an export column
+    """
+    if export_format not in EXPORT_MEDIA_TYPES:
+        raise InvalidExport(f"Unsupported export format '{export_format}'")
+    if export_format == "parquet" and pa is None:
+        raise InvalidExport("Parquet export requires pyarrow")
+    if export_format == "ndjson":
+        return None
+    if not fields:
+        return list(EXPORT_COLUMNS)
+    unknown = [field for field in fields if field not in EXPORT_COLUMNS]
+    if unknown:
+        raise InvalidExport(f"Cannot export {', '.join(unknown)} as a column")
+    return [column for column in EXPORT_COLUMNS if column in fields or column == "id"]
+
+
+def _ndjson(batches: Iterator[List[tuple]]) -> Iterator[bytes]:
+    for rows in batches:
+        yield "".join(row[0] + "\n" for row in rows).encode()
+
+
+def _csv(batches: Iterator[List[tuple]], columns: List[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _ChunkSink:
+    """
+    Write-only file object that collects what the Parquet writer produces
+    until it is drained into the response.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _parquet_type(column: str):
+    if column in ("player_name", "position", "team", "description"):
+        return pa.string()
+    if column in FLOAT_COLUMNS:
+        return pa.float64()
+    return pa.int64()
+
+
+def _parquet(batches: Iterator[List[tuple]], columns: List[str]) -> Iterator[bytes]:
+    schema = pa.schema([(column, _parquet_type(column)) for column in columns])
+    sink = _ChunkSink()
+    # Each batch becomes one row group, flushed to the client as it is written
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for rows in batches:
+            table = pa.Table.from_arrays(
+                [pa.array([row[index] for row in rows], type=schema.field(index).type)
+                 for index in range(len(columns))],
+                schema=schema,
+            )
+            writer.write_table(table)
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def export_players(
+    export_format: str,
+    filters: Optional[Dict[str, Any]] = None,
+    fields: Optional[List[str]] = None,
+) -> Iterator[bytes]:
+    """
+    Encode every player matching `filters` in the given format, one batch
+    at a time. A pooled connection is held until the export finishes.
+
+    Call export_columns first to validate the format and fields.
+    """
+    columns = export_columns(export_format, fields)
+    with database.pool.connection() as conn:
+        batches = iter_player_rows(conn, filters, columns, fields)
+        if export_format == "ndjson":
+            yield from _ndjson(batches)
+        elif export_format == "csv":
+            yield from _csv(batches, columns)
+        else:
+            yield from _parquet(batches, columns)
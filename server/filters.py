@@ -0,0 +1,110 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from psycopg2 import sql
+
+import database
+from pagination import FLOAT_COLUMNS, SORTABLE_COLUMNS, real_value
+
+# e.g. "home_run>=30", "avg > .3"
+STAT_FILTER = re.compile(r"^\s*([a-z0-9_]+)\s*(>=|<=|!=|=|>|<)\s*(-?\d*\.?\d+)\s*$")
+
+
+class InvalidFilter(ValueError):
+    pass
+
+
+def parse_stat_filters(expressions: List[str]) -> List[Tuple[str, str, Union[int, float]]]:
+    """
+    Parse stat range expressions such as "home_run>=30" into
+    (column, operator, value) triples. Count columns take whole numbers, so
+    they are compared as integers and their (stat, id) indexes apply.
+
+    Raises:
+        InvalidFilter: If an expression is malformed, names an unknown column
+            or bounds a count column by a fraction
+    """
+    parsed = []
+    for expression in expressions:
+        match = STAT_FILTER.match(expression)
+        if not match:
+            raise InvalidFilter(f"Malformed filter: '{expression}'")
+        column, op, value = match.groups()
+        if column not in SORTABLE_COLUMNS:
+            raise InvalidFilter(f"Cannot filter on '{column}'")
+        number = float(value)
+        if column in FLOAT_COLUMNS:
+            # So that "avg=.3" matches a stored REAL 0.3
+            parsed.append((column, op, real_value(number)))
+        elif number.is_integer():
+            parsed.append((column, op, int(number)))
+        else:
+            raise InvalidFilter(f"'{column}' is a count and takes whole numbers, not '{value}'")
+    return parsed
+
+
+def player_filters(
+    position: Optional[str] = None,
+    team: Optional[str] = None,
+    stats: Optional[List[str]] = None,
+    name: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Normalize list query parameters into a filters dict, leaving out unset
+    ones. Positions may be comma-separated.
+
+    Raises:
+        InvalidFilter: If a stat filter is invalid
+    """
+    filters: Dict[str, Any] = {}
+    if position:
+        filters["position"] = sorted({p.strip() for p in position.split(",") if p.strip()})
+    if team:
+        filters["team"] = team
+    if stats:
+        filters["stats"] = parse_stat_filters(stats)
+    if name and name.strip():
+        filters["name"] = name.strip()
+    return filters
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def filter_clause(filters: Optional[Dict[str, Any]]) -> Tuple[Optional[sql.Composable], List[Any]]:
+    """
+    Build the WHERE conditions for a filters dict.
+
+    Every condition is served by an index created in create_table: the
+    (position, id), (team, id) and (stat, id) B-trees, and the trigram index
+    on player_name for name search.
+
+    Returns:
+        (condition, params), or (None, []) when nothing is filtered
+    """
+    if not filters:
+        return None, []
+    conditions: List[sql.Composable] = []
+    params: List[Any] = []
+    if "position" in filters:
+        conditions.append(sql.SQL("position = ANY(%s)"))
+        params.append(filters["position"])
+    if "team" in filters:
+        conditions.append(sql.SQL("team = %s"))
+        params.append(filters["team"])
+    for column, op, value in filters.get("stats", ()):
+        conditions.append(
+            sql.SQL("{} {} %s").format(sql.Identifier(column), sql.SQL(op))
+        )
+        params.append(value)
+    if "name" in filters:
+        name = filters["name"]
+        if database.trigram_enabled:
+            # Prefix matches plus trigram similarity for misspellings
+            conditions.append(sql.SQL("(player_name ILIKE %s OR player_name %% %s)"))
+            params.extend([_escape_like(name) + "%", name])
+        else:
+            conditions.append(sql.SQL("player_name ILIKE %s"))
+            params.append("%" + _escape_like(name) + "%")
+    return sql.SQL(" AND ").join(conditions), params
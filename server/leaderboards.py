@@ -0,0 +1,39 @@
+import asyncio
+import os
+
+from logging_config import get_logger
+from database_operations import on_players_changed, refresh_stats_views
+
+logger = get_logger(__name__)
+
+# Minimum seconds between materialized view refreshes
+STATS_REFRESH_INTERVAL = float(os.getenv("STATS_REFRESH_INTERVAL", "10"))
+
+_stale = False
+
+
+def _mark_stale(player_ids):
+    global _stale
+    _stale = True
+
+
+# The views are shared, so the worker that wrote the players refreshes them
+on_players_changed(_mark_stale, local_only=True)
+
+
+async def refresh_stats_views_periodically() -> None:
+    """
+    Refresh the leaderboard and aggregate views whenever players changed
+    since the last refresh, at most once per STATS_REFRESH_INTERVAL, so
+    reads never pay for the aggregation and bursts of writes coalesce.
+    """
+    global _stale
+    while True:
+        await asyncio.sleep(STATS_REFRESH_INTERVAL)
+        if not _stale:
+            continue
+        _stale = False
+        if await refresh_stats_views():
+            logger.info("Refreshed leaderboard and aggregate views")
+        else:
+            _stale = True
@@ -0,0 +1,492 @@
+import asyncio
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import orjson
+
+import database
+from cluster import CLUSTER_RECONNECT_DELAY, listen
+from database_operations import fetch_page_player_ids, fetch_player_documents
+from filters import player_filters
+from logging_config import get_logger
+from metrics import live_connections, live_messages, live_resyncs
+from pagination import SORTABLE_COLUMNS
+
+logger = get_logger(__name__)
+
+# Seconds to collect change notifications before fetching the changed
+# players, so a burst of writes reaches each client as one message
+LIVE_BATCH_DELAY = float(os.getenv("LIVE_BATCH_DELAY", "0.1"))
+# Messages held for a client that is not reading; past this its backlog is
+# replaced by one fresh snapshot
+LIVE_QUEUE_SIZE = max(2, int(os.getenv("LIVE_QUEUE_SIZE", "64")))
+# Players one connection may subscribe to by id
+LIVE_MAX_PLAYERS = int(os.getenv("LIVE_MAX_PLAYERS", "500"))
+# Largest page a connection may watch, as for GET /players
+MAX_PAGE_SIZE = 100
+
+# (page, page_size, sort, order, filters as normalized JSON)
+PageKey = Tuple[int, int, str, str, str]
+
+
+class InvalidSubscription(ValueError):
+    pass
+
+
+def _player_ids(value: Any) -> List[int]:
+    if not isinstance(value, list) or not all(
+        isinstance(item, int) and not isinstance(item, bool) for item in value
+    ):
+        raise InvalidSubscription("Player ids must be a list of integers")
+    return list(dict.fromkeys(value))
+
+
+def parse_page(spec: Any) -> Tuple[PageKey, Dict[str, Any]]:
+    """
+    Validate a page subscription. It takes the GET /players parameters:
+    page, page_size, sort, order, position, team, name and filter (a list of
+    stat expressions such as "home_run>=30").
+
+    Returns:
+        (key, filters)
+
+    Raises:
+        InvalidSubscription: If a parameter is invalid
+    """
+    if not isinstance(spec, dict):
+        raise InvalidSubscription("page must be an object of list parameters")
+    page, page_size = spec.get("page", 1), spec.get("page_size", 10)
+    for name, value, upper in (("page", page, None), ("page_size", page_size, MAX_PAGE_SIZE)):
+        if not isinstance(value, int) or isinstance(value, bool) or value < 1 or (
+            upper and value > upper
+        ):
+            raise InvalidSubscription(f"Invalid {name}")
+    sort, order = spec.get("sort", "id"), spec.get("order", "asc")
+    if sort not in SORTABLE_COLUMNS:
+        raise InvalidSubscription(f"Cannot sort by '{sort}'")
+    if order not in ("asc", "desc"):
+        raise InvalidSubscription("order must be asc or desc")
+    text = {name: spec.get(name) for name in ("position", "team", "name")}
+    stats = spec.get("filter") or []
+    if isinstance(stats, str):
+        stats = [stats]
+    if not all(value is None or isinstance(value, str) for value in text.values()) or not all(
+        isinstance(value, str) for value in stats
+    ):
+        raise InvalidSubscription("Filters must be strings")
+    try:
+        filters = player_filters(text["position"], text["team"], stats, text["name"])
+    except ValueError as e:
+        raise InvalidSubscription(str(e))
+    return (page, page_size, sort, order, json.dumps(filters, sort_keys=True)), filters
+
+
+def document_diff(old: Dict[str, Any], new: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    The change between two versions of a player document, as {"id", "set"}
+    with the keys whose values changed, plus "unset" with any keys that
+    were removed; None if nothing changed.
+    """
+    changed = {key: value for key, value in new.items() if key not in old or old[key] != value}
+    removed = [key for key in old if key not in new]
+    if not changed and not removed:
+        return None
+    diff: Dict[str, Any] = {"id": new["id"], "set": changed}
+    if removed:
+        diff["unset"] = removed
+    return diff
+
+
+def _encode(message: Dict[str, Any]) -> str:
+    return orjson.dumps(message).decode()
+
+
+class LiveClient:
+    """
+    One WebSocket connection: what it subscribed to and its outgoing
+    messages, queued as encoded JSON text.
+    """
+
+    def __init__(self):
+        self.player_ids: Set[int] = set()
+        self.page: Optional[PageKey] = None
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(LIVE_QUEUE_SIZE)
+
+
+class LiveUpdates:
+    """
+    Pushes player changes to WebSocket clients as small diffs.
+
+    The player change triggers (database.create_change_notifications)
+    report the ids every statement wrote; one LISTEN connection per process
+    receives them. Changes are collected for LIVE_BATCH_DELAY, then only
+    players some client follows are fetched and diffed against the last
+    document sent, and each client gets one message covering its players.
+    The documents are shared by every client of a player, so idle
+    connections cost their subscription entries and nothing else.
+
+    Clients subscribe to players by id or to a list page. A page is
+    re-resolved when a batch may have moved players on or off it: after
+    inserts and deletes, or any update if it is filtered or sorted by a
+    stat. Clients that stop reading have their backlog replaced by a fresh
+    snapshot instead of growing without bound.
+
+    Subscription state only changes under one lock, so a snapshot and the
+    diffs that follow it are always taken against the same document.
+    """
+
+    def __init__(self):
+        self.clients: Set[LiveClient] = set()
+        # Clients subscribed to each player by id
+        self._followers: Dict[int, Set[LiveClient]] = {}
+        # Clients watching each page, with its filters and current ids
+        self._watchers: Dict[PageKey, Set[LiveClient]] = {}
+        self._page_filters: Dict[PageKey, Dict[str, Any]] = {}
+        self._page_ids: Dict[PageKey, List[int]] = {}
+        # Watched pages each player is on
+        self._pages_of: Dict[int, Set[PageKey]] = {}
+        # Last document sent for every followed player
+        self._documents: Dict[int, Dict[str, Any]] = {}
+        self._lock = asyncio.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        # Received since the last batch: followed players that changed,
+        # whether rows were inserted or deleted or any were updated, and
+        # whether everything must be refetched
+        self._changed: Set[int] = set()
+        self._moved = False
+        self._updated = False
+        self._everything = False
+
+    def _tracked(self, player_id: int) -> bool:
+        return player_id in self._followers or player_id in self._pages_of
+
+    def _prune(self, player_ids: Iterable[int]) -> None:
+        for player_id in player_ids:
+            if not self._tracked(player_id):
+                self._documents.pop(player_id, None)
+
+    async def _load(self, player_ids: Iterable[int]) -> bool:
+        """
+        Fetch documents for players that do not have one yet.
+        """
+        missing = [player_id for player_id in player_ids if player_id not in self._documents]
+        if not missing:
+            return True
+        documents = await fetch_player_documents(missing)
+        if documents is None:
+            return False
+        for player_id, document in documents.items():
+            self._documents[player_id] = orjson.loads(document)
+        return True
+
+    def _deliver(self, client: LiveClient, message: str, kind: str) -> None:
+        try:
+            client.queue.put_nowait(message)
+            live_messages.inc(type=kind)
+        except asyncio.QueueFull:
+            self._resync(client)
+
+    def _resync(self, client: LiveClient) -> None:
+        while not client.queue.empty():
+            client.queue.get_nowait()
+        live_resyncs.inc()
+        player_ids = set(client.player_ids)
+        if client.page:
+            client.queue.put_nowait(self._page_message(client.page))
+            player_ids.update(self._page_ids[client.page])
+        client.queue.put_nowait(self._snapshot_message(sorted(player_ids)))
+
+    def _page_message(self, key: PageKey) -> str:
+        return _encode({
+            "type": "page", "page": key[0], "page_size": key[1], "player_ids": self._page_ids[key]
+        })
+
+    def _snapshot_message(self, player_ids: Iterable[int]) -> str:
+        return _encode({
+            "type": "snapshot",
+            "players": [self._documents[player_id] for player_id in player_ids
+                        if player_id in self._documents],
+        })
+
+    def reject(self, client: LiveClient, detail: str) -> None:
+        self._deliver(client, _encode({"type": "error", "detail": detail}), "error")
+
+    def connect(self) -> LiveClient:
+        client = LiveClient()
+        self.clients.add(client)
+        live_connections.set(len(self.clients))
+        return client
+
+    async def disconnect(self, client: LiveClient) -> None:
+        async with self._lock:
+            self._unsubscribe(client, list(client.player_ids))
+            self._unwatch(client)
+        self.clients.discard(client)
+        live_connections.set(len(self.clients))
+
+    async def subscribe(self, client: LiveClient, player_ids: List[int]) -> None:
+        """
+        Follow players by id and send their current documents. Ids of
+        players that do not exist are returned under "missing" and not
+        followed.
+
+        Raises:
+            InvalidSubscription: If the client would follow too many players
+        """
+        async with self._lock:
+            new = [player_id for player_id in player_ids if player_id not in client.player_ids]
+            if len(client.player_ids) + len(new) > LIVE_MAX_PLAYERS:
+                raise InvalidSubscription(f"At most {LIVE_MAX_PLAYERS} players can be subscribed to")
+            if not new:
+                return
+            if not await self._load(new):
+                self.reject(client, "Players could not be loaded")
+                return
+            found = [player_id for player_id in new if player_id in self._documents]
+            for player_id in found:
+                client.player_ids.add(player_id)
+                self._followers.setdefault(player_id, set()).add(client)
+            message = {
+                "type": "snapshot",
+                "players": [self._documents[player_id] for player_id in found],
+            }
+            if len(found) < len(new):
+                message["missing"] = [player_id for player_id in new if player_id not in found]
+            self._deliver(client, _encode(message), "snapshot")
+
+    async def unsubscribe(self, client: LiveClient, player_ids: List[int]) -> None:
+        async with self._lock:
+            self._unsubscribe(client, player_ids)
+
+    def _unsubscribe(self, client: LiveClient, player_ids: List[int]) -> None:
+        for player_id in player_ids:
+            client.player_ids.discard(player_id)
+            followers = self._followers.get(player_id)
+            if followers is not None:
+                followers.discard(client)
+                if not followers:
+                    del self._followers[player_id]
+        self._prune(player_ids)
+
+    def _set_page_ids(self, key: PageKey, player_ids: List[int]) -> None:
+        previous = self._page_ids.get(key, [])
+        for player_id in previous:
+            pages = self._pages_of[player_id]
+            pages.discard(key)
+            if not pages:
+                del self._pages_of[player_id]
+        for player_id in player_ids:
+            self._pages_of.setdefault(player_id, set()).add(key)
+        self._page_ids[key] = player_ids
+        self._prune(previous)
+
+    async def _resolve(self, key: PageKey) -> Optional[List[int]]:
+        page, page_size, sort, order, _ = key
+        return await fetch_page_player_ids(page, page_size, sort, order, self._page_filters[key])
+
+    async def watch_page(self, client: LiveClient, spec: Any) -> None:
+        """
+        Watch one list page, replacing the page watched before; None stops
+        watching. Sends the page's ids and current documents, and again
+        whenever players move on or off it.
+
+        Raises:
+            InvalidSubscription: If the page parameters are invalid
+        """
+        key, filters = parse_page(spec) if spec is not None else (None, None)
+        async with self._lock:
+            if key != client.page:
+                self._unwatch(client)
+            if key is None:
+                return
+            if key not in self._watchers:
+                self._page_filters[key] = filters
+                player_ids = await self._resolve(key)
+                if player_ids is None or not await self._load(player_ids):
+                    del self._page_filters[key]
+                    self.reject(client, "Page could not be loaded")
+                    return
+                self._watchers[key] = set()
+                self._set_page_ids(key, player_ids)
+            self._watchers[key].add(client)
+            client.page = key
+            self._deliver(client, self._page_message(key), "page")
+            self._deliver(client, self._snapshot_message(self._page_ids[key]), "snapshot")
+
+    def _unwatch(self, client: LiveClient) -> None:
+        key, client.page = client.page, None
+        if key is None:
+            return
+        watchers = self._watchers[key]
+        watchers.discard(client)
+        if not watchers:
+            del self._watchers[key]
+            del self._page_filters[key]
+            self._set_page_ids(key, [])
+            del self._page_ids[key]
+
+    async def handle(self, client: LiveClient, text: str) -> None:
+        """
+        Apply one client message: a JSON object with any of
+        "unsubscribe" and "subscribe" (lists of player ids) and "page" (list
+        parameters, or null).
+
+        Raises:
+            InvalidSubscription: If the message is malformed
+        """
+        try:
+            message = json.loads(text)
+        except ValueError:
+            raise InvalidSubscription("Messages must be JSON")
+        if not isinstance(message, dict) or not message.keys() & {"subscribe", "unsubscribe", "page"}:
+            raise InvalidSubscription("Expected subscribe, unsubscribe or page")
+        if "unsubscribe" in message:
+            await self.unsubscribe(client, _player_ids(message["unsubscribe"]))
+        if "subscribe" in message:
+            await self.subscribe(client, _player_ids(message["subscribe"]))
+        if "page" in message:
+            await self.watch_page(client, message["page"])
+
+    def _receive(self, payload: str) -> None:
+        if not self.clients:
+            return
+        try:
+            message = json.loads(payload)
+            operation, player_ids = message["op"], message["ids"]
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Ignoring malformed player change notification")
+            return
+        if player_ids is None:
+            self._everything = True
+        else:
+            self._changed.update(
+                player_id for player_id in player_ids if player_id in self._documents
+            )
+            if operation == "UPDATE":
+                self._updated = True
+            else:
+                self._moved = True
+        self._wakeup.set()
+
+    def _reconnected(self) -> None:
+        # Changes made while disconnected were missed
+        logger.warning("Live update listener reconnected; refreshing every followed player")
+        self._everything = True
+        self._wakeup.set()
+
+    async def _apply(self, changed: Set[int], moved: bool, updated: bool, everything: bool) -> bool:
+        """
+        Send one batch of changes.
+
+        Returns:
+            False if the players could not be fetched
+        """
+        if everything:
+            changed = set(self._documents)
+        # Pages whose ids changed, with the players new to them
+        entered: Dict[PageKey, Set[int]] = {}
+        for key in list(self._watchers):
+            if not (everything or moved or (updated and (key[2] != "id" or key[4] != "{}"))):
+                continue
+            player_ids = await self._resolve(key)
+            if player_ids is None or player_ids == self._page_ids[key]:
+                continue
+            entered[key] = set(player_ids) - set(self._page_ids[key])
+            self._set_page_ids(key, player_ids)
+
+        wanted = sorted(
+            {player_id for player_id in changed if self._tracked(player_id)}
+            | {player_id for new in entered.values() for player_id in new}
+        )
+        documents = await fetch_player_documents(wanted) if wanted else {}
+        if documents is None:
+            return False
+        diffs: Dict[int, Dict[str, Any]] = {}
+        deleted: List[int] = []
+        for player_id in wanted:
+            old = self._documents.get(player_id)
+            if player_id not in documents:
+                if old is not None:
+                    deleted.append(player_id)
+                    del self._documents[player_id]
+                continue
+            new = orjson.loads(documents[player_id])
+            self._documents[player_id] = new
+            diff = document_diff(old, new) if old is not None else None
+            if diff:
+                diffs[player_id] = diff
+
+        for key, new in entered.items():
+            page_message = self._page_message(key)
+            snapshot = self._snapshot_message(sorted(new)) if new else None
+            for client in list(self._watchers[key]):
+                self._deliver(client, page_message, "page")
+                if snapshot:
+                    self._deliver(client, snapshot, "snapshot")
+
+        # Each client's share of the batch; clients sharing a page share
+        # one encoded message
+        shares: Dict[LiveClient, List[int]] = {}
+        for player_id in sorted(diffs.keys() | set(deleted)):
+            audience = set(self._followers.get(player_id, ()))
+            for key in self._pages_of.get(player_id, ()):
+                # Those just sent a snapshot of the player already have this
+                if player_id not in entered.get(key, ()):
+                    audience.update(self._watchers[key])
+            for client in audience:
+                shares.setdefault(client, []).append(player_id)
+        encoded: Dict[Tuple[int, ...], str] = {}
+        for client, player_ids in shares.items():
+            share = tuple(player_ids)
+            if share not in encoded:
+                encoded[share] = _encode({
+                    "type": "changes",
+                    "players": [diffs[player_id] for player_id in share if player_id in diffs],
+                    "deleted": [player_id for player_id in share if player_id not in diffs],
+                })
+            self._deliver(client, encoded[share], "changes")
+
+        for player_id in deleted:
+            for client in self._followers.pop(player_id, ()):
+                client.player_ids.discard(player_id)
+        self._prune(wanted)
+        return True
+
+    async def _process_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            await asyncio.sleep(LIVE_BATCH_DELAY)
+            changed, self._changed = self._changed, set()
+            moved, updated, everything = self._moved, self._updated, self._everything
+            self._moved = self._updated = self._everything = False
+            try:
+                async with self._lock:
+                    sent = await self._apply(changed, moved, updated, everything)
+            except Exception as e:
+                logger.error("Live update batch failed: %s", e)
+                sent = False
+            if not sent:
+                # Try the whole batch again once the database is back
+                await asyncio.sleep(CLUSTER_RECONNECT_DELAY)
+                self._everything = True
+                self._wakeup.set()
+
+    def start(self) -> List[asyncio.Task]:
+        """
+        Start listening for player changes on the running event loop.
+
+        Returns:
+            The background tasks, to be cancelled on shutdown
+        """
+        self._wakeup = asyncio.Event()
+        channel = database.PLAYER_CHANGES_CHANNEL
+        logger.info("Live player updates listening on '%s'", channel)
+        return [
+            asyncio.create_task(listen(channel, self._receive, self._reconnected)),
+            asyncio.create_task(self._process_loop()),
+        ]
+
+
+live_updates = LiveUpdates()
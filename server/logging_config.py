@@ -1,17 +1,116 @@
+import atexit
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" for one JSON object per line, "text" for the classic format
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# INFO/DEBUG records allowed per second for each logger and message template;
+# warnings and errors are never dropped
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", "20"))
+LOG_RATE_BURST = float(os.getenv("LOG_RATE_BURST", "50"))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Attributes every LogRecord has; anything else was passed via `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "taskName",
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as single-line JSON. Fields passed with `extra=` are
+    included as top-level keys, so log lines can be queried by field.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per (logger, message template) for INFO and DEBUG records.
+
+    Keying on the unformatted template means a hot-path line such as
+    "Fetched page %s" is limited as one stream whatever its arguments. The
+    number of records dropped is attached to the next one let through as
+    `suppressed`. A record may also pass `extra={"sample_rate": 0.01}` to be
+    kept with that probability.
+    """
+
+    def __init__(self, rate: float = LOG_RATE_LIMIT, burst: float = LOG_RATE_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        sample_rate = getattr(record, "sample_rate", None)
+        if sample_rate is not None and random.random() >= sample_rate:
+            return False
+        if self.rate <= 0:
+            return True
+        template = record.msg if isinstance(record.msg, str) else type(record.msg).__name__
+        key = (record.name, template)
+        now = time.monotonic()
+        with self._lock:
+            if len(self._buckets) > 10000 and key not in self._buckets:
+                # Messages formatted before logging never repeat; start over
+                self._buckets.clear()
+            tokens, updated, suppressed = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, suppressed + 1)
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread.
+
+    The stock handler formats each record before enqueueing it, on the
+    calling thread; here the record is passed through as is, so building
+    the message (and any traceback) happens off the event loop. Arguments
+    must therefore not be mutated after logging them.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
 
 def setup_logging():
     # Create logs directory if it doesn't exist
     log_dir = os.path.join(os.path.dirname(__file__), 'logs')
     os.makedirs(log_dir, exist_ok=True)
 
-    # Configure the root logger
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
 
     # Create a rotating file handler for detailed logs
     file_handler = RotatingFileHandler(
@@ -19,14 +118,31 @@ def setup_logging():
         maxBytes=10*1024*1024,  # 10 MB
         backupCount=5
     )
-    file_handler.setLevel(logging.INFO)
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    ))
+    file_handler.setFormatter(formatter)
+
+    # Callers only enqueue records; a listener thread formats and writes them
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter())
+    listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
 
-    # Add the file handler to the root logger
-    logging.getLogger().addHandler(file_handler)
+def get_logger(name: str) -> logging.Logger:
+    """
+    Return the logger for a module, called with the module's `__name__` so
+    each record's `logger` field says where it came from. Importing this
+    module has already routed every logger through the handlers above.
+    """
+    return logging.getLogger(name)
 
-    return logging.getLogger(__name__)
 
-logger = setup_logging()
+setup_logging()
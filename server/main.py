@@ -1,31 +1,19 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from caching import CacheMiddleware
-import os
-import ollama
-from database import conn, create_table
+from compression import CompressionMiddleware
+from metrics import MetricsMiddleware
+import database
 from routes import app as routes_app
-from logging_config import logger
-from player_utils import fetch_external_players
-from database_operations import store_players
-
-# Configure Ollama
-OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
-ollama.host = OLLAMA_HOST
-
-# Pull the model on startup
-try:
-    logger.info(f"Pulling llama3.2:1b model from host: {OLLAMA_HOST}")
-    ollama.pull("llama3.2:1b")
-    logger.info("Successfully pulled llama3.2:1b model")
-except Exception as e:
-    logger.error(f"Failed to pull llama3.2:1b model: {e}")
-    # Add more detailed error logging
-    logger.exception("Detailed error pulling Ollama model")
+from logging_config import get_logger
+from description_worker import description_worker
+from startup import launch_startup_tasks, stop_startup_tasks
+
+logger = get_logger(__name__)
 
 app = FastAPI()
 
-# app.add_middleware(CacheMiddleware)
+app.add_middleware(CacheMiddleware)
 
 origins = [
     "http://localhost:3000",
@@ -39,23 +27,32 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compresses cached and fresh responses alike
+app.add_middleware(CompressionMiddleware)
+
+# Added last so it is outermost and also times cache hits
+app.add_middleware(MetricsMiddleware)
+
 app.mount("/", routes_app)
 
-if conn:
-    create_table(conn)
 
 @app.on_event("startup")
-async def populate_players():
+async def start_background_tasks():
+    """
+    Connect to the database, pull and preload the model, ingest the player
+    feed and start the description worker in the background, so the server
+    accepts requests immediately. Progress is reported by /health/ready.
+    """
+    logger.info("Launching background startup tasks")
+    launch_startup_tasks()
+
+
+@app.on_event("shutdown")
+async def close_pool():
     """
-    Fetch players from external API and populate the database on startup.
+    Stop background work and close all pooled database connections on shutdown.
     """
-    if conn:
-        try:
-            players = await fetch_external_players()
-            if players:
-                store_players(conn, players)
-                logger.info(f"Successfully populated database with {len(players)} players")
-            else:
-                logger.warning("No players fetched from external API")
-        except Exception as e:
-            logger.error(f"Error populating players: {e}")
+    await stop_startup_tasks()
+    await description_worker.stop()
+    if database.pool:
+        database.pool.closeall()
@@ -0,0 +1,349 @@
+import contextvars
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import Request
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.routing import BaseRoute, Match, Mount
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Requests slower than this log their trace spans
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "2"))
+# Trace every request instead of only those sent with an X-Trace header
+TRACE_ALL_REQUESTS = os.getenv("TRACE_ALL_REQUESTS", "false").lower() == "true"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """
+    Base for metrics with a fixed set of label names. Values are kept per
+    label combination and updated under a lock, since database functions
+    report from worker threads.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. With `function` set the value is read
+    when the metrics are rendered, e.g. for pool sizes owned by other modules.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        function: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self.function = function
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[str]:
+        if self.function is not None:
+            try:
+                return [f"{self.name} {_format_value(self.function())}"]
+            except Exception:
+                return []
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Per label combination: [bucket counts..., sum, count]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for index, bound in enumerate(self.buckets):
+                cumulative += state[index]
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+                )
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+registry: List[Metric] = []
+
+
+def render_metrics() -> str:
+    """
+    Render every registered metric in the Prometheus text exposition format.
+    """
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status")
+)
+http_requests_in_flight = Gauge("http_requests_in_flight", "HTTP requests currently being served.")
+db_query_duration = Histogram(
+    "db_query_duration_seconds", "Time spent in each database_operations function.", ("function",)
+)
+db_query_errors = Counter(
+    "db_query_errors_total", "Database functions that raised.", ("function",)
+)
+db_pool_wait = Histogram(
+    "db_pool_wait_seconds", "Time spent waiting to check out a pooled connection."
+)
+cache_requests = Counter(
+    "cache_requests_total", "Cache lookups by cache and result.", ("cache", "result")
+)
+llm_queue_duration = Histogram(
+    "llm_queue_seconds",
+    "Time an Ollama request spent waiting before the model started on it.",
+    buckets=LLM_BUCKETS,
+)
+llm_generation_duration = Histogram(
+    "llm_generation_seconds",
+    "Wall-clock latency of Ollama description requests.",
+    ("mode",),
+    buckets=LLM_BUCKETS,
+)
+llm_tokens = Counter("llm_generated_tokens_total", "Tokens generated by Ollama.")
+llm_tokens_per_second = Gauge(
+    "llm_tokens_per_second", "Generation speed of the most recent Ollama request."
+)
+llm_descriptions = Counter(
+    "llm_descriptions_total", "Descriptions served, by source.", ("source",)
+)
+llm_deadline_exceeded = Counter(
+    "llm_deadline_exceeded_total", "Description requests that fell back after their deadline."
+)
+ollama_requests = Counter(
+    "ollama_requests_total",
+    "Ollama requests by host and result (ok, error, rejected by an open circuit).",
+    ("host", "result"),
+)
+ollama_backend_in_flight = Gauge(
+    "ollama_backend_in_flight", "Requests running on each Ollama host.", ("host",)
+)
+ollama_circuit_open = Gauge(
+    "ollama_circuit_open", "1 while an Ollama host's circuit breaker is open.", ("host",)
+)
+live_connections = Gauge("live_connections", "Open live player update WebSockets.")
+live_messages = Counter(
+    "live_messages_total", "Live update messages queued for clients, by type.", ("type",)
+)
+live_resyncs = Counter(
+    "live_resyncs_total", "Live clients that fell behind and were sent a fresh snapshot."
+)
+
+
+# Spans of the request being traced, or None when tracing is off
+_current_trace: contextvars.ContextVar[Optional[List[Tuple[str, float, float]]]] = (
+    contextvars.ContextVar("current_trace", default=None)
+)
+
+
+@contextmanager
+def span(name: str):
+    """
+    Record a named stage of the current request's trace. Does nothing when
+    the request is not being traced.
+    """
+    spans = _current_trace.get()
+    if spans is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans.append((name, started, time.perf_counter() - started))
+
+
+def server_timing(spans: List[Tuple[str, float, float]]) -> str:
+    """
+    Format spans as a Server-Timing header, which browser dev tools display
+    as a per-stage breakdown.
+    """
+    return ", ".join(
+        f"{name.replace(' ', '_')};dur={duration * 1000:.1f}"
+        for name, _, duration in spans
+    )
+
+
+def _match_route(routes, scope) -> Optional[BaseRoute]:
+    for route in routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            if isinstance(route, Mount):
+                return _match_route(route.routes, {**scope, **child_scope})
+            return route
+    return None
+
+
+def route_label(request: Request) -> str:
+    # Route templates keep label cardinality bounded; unmatched paths share one.
+    # Responses served by middleware (e.g. cache hits) never reach the router,
+    # so their route is looked up here.
+    route = request.scope.get("route") or _match_route(request.app.routes, request.scope)
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    """
+    Time every request by route template and, for traced requests, collect
+    spans and return them in a Server-Timing header.
+
+    A request is traced when it carries an `X-Trace` header or when
+    TRACE_ALL_REQUESTS is set.
+    """
+
+    async def dispatch(self, request: Request, call_next):
+        traced = TRACE_ALL_REQUESTS or "x-trace" in request.headers
+        spans: Optional[List[Tuple[str, float, float]]] = [] if traced else None
+        token = _current_trace.set(spans)
+        http_requests_in_flight.inc()
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            elapsed = time.perf_counter() - started
+            http_requests_in_flight.dec()
+            _current_trace.reset(token)
+            http_request_duration.observe(
+                elapsed, method=request.method, route=route_label(request), status=str(status)
+            )
+        if spans is not None:
+            spans.append(("total", started, elapsed))
+            response.headers["Server-Timing"] = server_timing(spans)
+            if elapsed >= TRACE_SLOW_SECONDS:
+                logger.warning(
+                    "Slow request %s %s (%.2fs): %s",
+                    request.method, request.url.path, elapsed, server_timing(spans),
+                )
+        return response
@@ -0,0 +1,258 @@
+"""
+Move an existing database from the legacy players schema, where every
+player was also stored whole in a `data` JSONB column, to the compact one:
+typed SMALLINT/REAL columns plus a `team` column, with the description and
+any other feed keys in `player_details`.
+
+The migration runs online, in three steps:
+
+    cd server
+    python -m migrate_compact expand backfill   # while the old version serves
+    # deploy the new version
+    python -m migrate_compact contract
+
+expand    Adds the team column (and source_hash and version, on tables
+          older than them) and player_details, installs a trigger that
+          keeps them in sync with `data` while the old version writes it,
+          and builds the new indexes concurrently.
+backfill  Copies existing rows in small committed batches, then rebuilds
+          the stats views on the team column. Safe to interrupt and rerun.
+contract  Drops the trigger and the data column and shrinks the stat
+          columns. Changing the column types rewrites the table under an
+          exclusive lock; the lock is requested with a timeout and retried
+          so waiting for it never stalls other queries for long.
+
+Every step is idempotent.
+"""
+import argparse
+import sys
+import time
+
+import psycopg2
+import psycopg2.errors
+from psycopg2 import sql
+
+import database
+from database_operations import COLUMN_KEYS, SMALLINT_MAX, SMALLINT_MIN
+from pagination import FLOAT_COLUMNS, STAT_COLUMNS
+
+STEPS = ("expand", "backfill", "contract")
+
+
+def _sync_function_sql() -> sql.Composable:
+    # BEFORE: derive the team column; AFTER: the row exists, so its details
+    # can be written
+    return sql.SQL("""
+        CREATE OR REPLACE FUNCTION players_compact_sync() RETURNS trigger AS $$
+        BEGIN
+            IF TG_WHEN = 'BEFORE' THEN
+                NEW.team := NEW.data->>'team';
+                RETURN NEW;
+            END IF;
+            INSERT INTO player_details (player_id, description, extras)
+            VALUES (NEW.id, NEW.data->>'description', NEW.data - {keys}::text[])
+            ON CONFLICT (player_id) DO UPDATE SET
+                description = EXCLUDED.description, extras = EXCLUDED.extras;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """).format(keys=sql.Literal(sorted(COLUMN_KEYS)))
+
+
+def _create_index_concurrently(conn, name: str, target: str) -> None:
+    with conn.cursor() as cursor:
+        # An interrupted concurrent build leaves an invalid index behind
+        cursor.execute(
+            "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,)
+        )
+        row = cursor.fetchone()
+        if row and row[0]:
+            return
+        if row:
+            cursor.execute(f"DROP INDEX CONCURRENTLY {name}")
+        print(f"Building index {name}")
+        cursor.execute(f"CREATE INDEX CONCURRENTLY {name} ON {target}")
+
+
+def _legacy(conn) -> bool:
+    with conn.cursor() as cursor:
+        legacy = database.has_column(cursor, "players", "data")
+    conn.commit()
+    if not legacy:
+        print("players has no data column; nothing to copy")
+    return legacy
+
+
+def expand(conn) -> None:
+    if not _legacy(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute("ALTER TABLE players ADD COLUMN IF NOT EXISTS team VARCHAR(255)")
+        # Tables from before source hashes and versions lack them, and
+        # LIST_INDEX includes version
+        cursor.execute("ALTER TABLE players ADD COLUMN IF NOT EXISTS source_hash CHAR(64)")
+        cursor.execute(
+            "ALTER TABLE players ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1"
+        )
+        database.create_player_details(cursor)
+        cursor.execute(_sync_function_sql())
+        for when in ("BEFORE", "AFTER"):
+            cursor.execute(f"""
+                CREATE OR REPLACE TRIGGER players_compact_sync_{when.lower()}
+                {when} INSERT OR UPDATE OF data ON players
+                FOR EACH ROW WHEN (NEW.data IS NOT NULL)
+                EXECUTE FUNCTION players_compact_sync()
+            """)
+    conn.commit()
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    conn.autocommit = True
+    try:
+        for name, target in (database.TEAM_INDEX, database.LIST_INDEX):
+            _create_index_concurrently(conn, name, target)
+    finally:
+        conn.autocommit = False
+    print("Expanded: players.team and player_details are kept in sync with data")
+
+
+def backfill(conn, batch_size: int, pause: float) -> None:
+    if not _legacy(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM players")
+        last_id = cursor.fetchone()[0]
+    conn.commit()
+    keys = sorted(COLUMN_KEYS)
+    copied = 0
+    for start in range(0, last_id, batch_size):
+        end = start + batch_size
+        with conn.cursor() as cursor:
+            # Rows written through the trigger since expand are already right
+            cursor.execute(
+                """
+                UPDATE players SET team = data->>'team'
+                WHERE id > %s AND id <= %s AND team IS DISTINCT FROM data->>'team'
+                """,
+                (start, end),
+            )
+            cursor.execute(
+                """
+                INSERT INTO player_details (player_id, description, extras)
+                SELECT id, data->>'description', COALESCE(data, '{}'::jsonb) - %s::text[]
+                FROM players WHERE id > %s AND id <= %s
+                ON CONFLICT (player_id) DO NOTHING
+                """,
+                (keys, start, end),
+            )
+            copied += cursor.rowcount
+        conn.commit()
+        print(f"Backfilled ids up to {min(end, last_id)} of {last_id} ({copied} details rows)")
+        time.sleep(pause)
+
+    # The views read the team column from now on, which both versions keep
+    # current; rebuilt in one transaction so readers never see them missing
+    with conn.cursor() as cursor:
+        cursor.execute("DROP MATERIALIZED VIEW IF EXISTS player_leaderboards, player_aggregates")
+        database.create_stats_views(cursor)
+    conn.commit()
+    print("Backfilled; stats views rebuilt on players.team")
+
+
+def _retype_clause(column: str) -> str:
+    if column in FLOAT_COLUMNS:
+        return f"ALTER COLUMN {column} TYPE REAL"
+    # Counts that do not fit are dropped, as store_players does
+    return (
+        f"ALTER COLUMN {column} TYPE SMALLINT USING CASE WHEN {column} "
+        f"BETWEEN {SMALLINT_MIN} AND {SMALLINT_MAX} THEN {column}::smallint END"
+    )
+
+
+def contract(conn, lock_timeout: float, attempts: int) -> None:
+    with conn.cursor() as cursor:
+        if not database.has_column(cursor, "players", "team"):
+            raise SystemExit("Run expand and backfill first")
+        cursor.execute("""
+            SELECT COUNT(*) FROM players p
+            WHERE NOT EXISTS (SELECT 1 FROM player_details d WHERE d.player_id = p.id)
+        """)
+        missing = cursor.fetchone()[0]
+        has_data = database.has_column(cursor, "players", "data")
+        cursor.execute(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_name = 'players'"
+        )
+        types = dict(cursor.fetchall())
+    conn.commit()
+    if missing:
+        raise SystemExit(f"{missing} players have no details row; run backfill first")
+
+    alterations = [
+        _retype_clause(column) for column in STAT_COLUMNS
+        if types[column] != ("real" if column in FLOAT_COLUMNS else "smallint")
+    ]
+    if has_data:
+        alterations.insert(0, "DROP COLUMN data")
+    if not alterations:
+        print("players already uses the compact schema")
+        return
+    for attempt in range(1, attempts + 1):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SET LOCAL lock_timeout = %s", (f"{int(lock_timeout * 1000)}ms",))
+                cursor.execute("DROP TRIGGER IF EXISTS players_compact_sync_before ON players")
+                cursor.execute("DROP TRIGGER IF EXISTS players_compact_sync_after ON players")
+                cursor.execute("DROP FUNCTION IF EXISTS players_compact_sync()")
+                # The views depend on the columns being retyped
+                cursor.execute(
+                    "DROP MATERIALIZED VIEW IF EXISTS player_leaderboards, player_aggregates"
+                )
+                cursor.execute("ALTER TABLE players " + ", ".join(alterations))
+                database.create_stats_views(cursor)
+            conn.commit()
+            break
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            print(f"players is busy (attempt {attempt} of {attempts}), retrying")
+            time.sleep(lock_timeout)
+    else:
+        raise SystemExit("Could not lock players; try again when it is less busy")
+
+    # Sets the visibility map, so the list index can serve index-only scans
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("VACUUM ANALYZE players")
+    conn.autocommit = False
+    print("Contracted: players uses the compact schema")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("steps", nargs="+", choices=STEPS)
+    parser.add_argument("--batch-size", type=int, default=5000, help="Rows per backfill transaction")
+    parser.add_argument("--pause", type=float, default=0.05, help="Seconds between backfill batches")
+    parser.add_argument(
+        "--lock-timeout", type=float, default=2.0, help="Seconds to wait for the contract lock"
+    )
+    parser.add_argument("--attempts", type=int, default=30, help="Tries at taking the contract lock")
+    args = parser.parse_args(argv)
+
+    if not database.DB_URL:
+        parser.error("DB_URL is not set")
+    conn = database.connect()
+    try:
+        for step in STEPS:
+            if step not in args.steps:
+                continue
+            if step == "expand":
+                expand(conn)
+            elif step == "backfill":
+                backfill(conn, args.batch_size, args.pause)
+            else:
+                contract(conn, args.lock_timeout, args.attempts)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+import asyncio
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import httpx
+import ollama
+
+from logging_config import get_logger
+from metrics import ollama_backend_in_flight, ollama_circuit_open, ollama_requests
+
+logger = get_logger(__name__)
+
+# Comma-separated Ollama servers to spread requests over
+OLLAMA_HOSTS = [
+    host.strip()
+    for host in os.getenv("OLLAMA_HOSTS", os.getenv("OLLAMA_HOST", "http://localhost:11434")).split(",")
+    if host.strip()
+]
+# Requests one host runs at once; further requests queue here instead of
+# piling up inside Ollama
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "4"))
+# Upper bound on any single HTTP request to Ollama; interactive callers
+# give up much sooner through their own deadline
+OLLAMA_REQUEST_TIMEOUT = float(os.getenv("OLLAMA_REQUEST_TIMEOUT", "120"))
+# Consecutive failures that open a host's circuit, and how long it stays open
+OLLAMA_BREAKER_FAILURES = int(os.getenv("OLLAMA_BREAKER_FAILURES", "3"))
+OLLAMA_BREAKER_RESET_SECONDS = float(os.getenv("OLLAMA_BREAKER_RESET_SECONDS", "30"))
+
+# Errors that say something about the host rather than the request
+BACKEND_ERRORS = (httpx.HTTPError, ollama.ResponseError, ConnectionError, TimeoutError)
+
+
+class NoBackendAvailable(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker.
+
+    Closed: requests flow. After `failure_threshold` consecutive failures it
+    opens and rejects requests for `reset_seconds`. It then lets a single
+    trial request through (half-open); success closes it, failure opens it
+    again.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = OLLAMA_BREAKER_FAILURES,
+        reset_seconds: float = OLLAMA_BREAKER_RESET_SECONDS,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return "open"
+        return "half_open"
+
+    def available(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self._trial_running)
+
+    def acquire(self) -> bool:
+        """
+        Claim permission for one request.
+        """
+        if not self.available():
+            return False
+        if self.state == "half_open":
+            self._trial_running = True
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self) -> bool:
+        """
+        Returns:
+            Whether this failure opened the circuit
+        """
+        self.failures += 1
+        trial, self._trial_running = self._trial_running, False
+        # Requests started before the circuit opened may still fail into it
+        if self.state == "open":
+            return False
+        if trial or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def release(self) -> None:
+        """
+        End a request that neither succeeded nor failed (e.g. cancelled).
+        """
+        self._trial_running = False
+
+
+class OllamaBackend:
+    """
+    One Ollama server: its client, concurrency cap and circuit breaker.
+    """
+
+    def __init__(self, host: str, max_concurrency: int, timeout: float):
+        self.host = host
+        self.client = ollama.AsyncClient(host=host, timeout=timeout)
+        self.max_concurrency = max_concurrency
+        self.breaker = CircuitBreaker()
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+
+    @property
+    def load(self) -> float:
+        return (self.in_flight + self.waiting) / self.max_concurrency
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "host": self.host,
+            "circuit": self.breaker.state,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+        }
+
+
+class OllamaPool:
+    """
+    Routes Ollama requests to the least-loaded healthy host.
+
+    Load counts running and queued requests against each host's concurrency
+    cap, so a burst queues evenly across hosts instead of overloading one.
+    Hosts whose circuit is open are skipped; with every circuit open,
+    requests fail at once with NoBackendAvailable so callers can fall back
+    instead of waiting on a broken server.
+    """
+
+    def __init__(
+        self,
+        hosts: List[str] = OLLAMA_HOSTS,
+        max_concurrency: int = OLLAMA_MAX_CONCURRENCY,
+        timeout: float = OLLAMA_REQUEST_TIMEOUT,
+    ):
+        self.backends = [OllamaBackend(host, max_concurrency, timeout) for host in hosts]
+        # Breaks ties between equally loaded hosts
+        self._turn = itertools.count()
+
+    def _pick(self, exclude: List[OllamaBackend]) -> OllamaBackend:
+        candidates = [
+            backend for backend in self.backends
+            if backend not in exclude and backend.breaker.available()
+        ]
+        if not candidates:
+            raise NoBackendAvailable("No healthy Ollama host available")
+        offset = next(self._turn)
+        order = {id(backend): (index - offset) % len(self.backends)
+                 for index, backend in enumerate(self.backends)}
+        return min(candidates, key=lambda backend: (backend.load, order[id(backend)]))
+
+    @asynccontextmanager
+    async def backend(self, exclude: Sequence[OllamaBackend] = ()) -> AsyncIterator[OllamaBackend]:
+        """
+        Check out the least-loaded healthy host for one request, waiting for
+        a free slot under its concurrency cap.
+
+        Errors raised in the block count against the host's circuit
+        breaker if they come from the host (HTTP, timeout, Ollama errors).
+
+        Args:
+            exclude: Hosts not to use, e.g. ones that already failed
+
+        Raises:
+            NoBackendAvailable: If every host's circuit is open
+        """
+        tried: List[OllamaBackend] = list(exclude)
+        while True:
+            backend = self._pick(tried)
+            backend.waiting += 1
+            try:
+                await backend._slots.acquire()
+            finally:
+                backend.waiting -= 1
+            # The circuit may have opened while this request was queued
+            if backend.breaker.acquire():
+                break
+            backend._slots.release()
+            ollama_requests.inc(host=backend.host, result="rejected")
+            tried.append(backend)
+
+        backend.in_flight += 1
+        ollama_backend_in_flight.set(backend.in_flight, host=backend.host)
+        try:
+            yield backend
+        except BACKEND_ERRORS:
+            ollama_requests.inc(host=backend.host, result="error")
+            if backend.breaker.record_failure():
+                logger.warning(
+                    "Circuit opened for Ollama host %s for %gs",
+                    backend.host, backend.breaker.reset_seconds,
+                )
+            raise
+        except BaseException:
+            # Cancelled, or the caller's own error: says nothing about the host
+            backend.breaker.release()
+            raise
+        else:
+            backend.breaker.record_success()
+            ollama_requests.inc(host=backend.host, result="ok")
+        finally:
+            backend.in_flight -= 1
+            ollama_backend_in_flight.set(backend.in_flight, host=backend.host)
+            ollama_circuit_open.set(int(backend.breaker.state == "open"), host=backend.host)
+            backend._slots.release()
+
+    async def request(self, method: str, **kwargs) -> Any:
+        """
+        Make one non-streaming client call (chat, embed, ...), retrying on
+        another host if the connection could not be made or the host
+        answered with a server error.
+
+        Raises:
+            NoBackendAvailable: If no healthy host is left to try
+            Exception: Any other error raised by the Ollama client
+        """
+        tried: List[OllamaBackend] = []
+        while True:
+            try:
+                async with self.backend(exclude=tried) as backend:
+                    return await getattr(backend.client, method)(**kwargs)
+            # The client re-raises connect failures as ConnectionError
+            except (ConnectionError, httpx.ConnectError, ollama.ResponseError) as e:
+                if isinstance(e, ollama.ResponseError) and e.status_code < 500:
+                    raise
+                tried.append(backend)
+                logger.warning("Ollama host %s failed (%s), trying another", backend.host, e)
+
+    async def broadcast(self, method: str, **kwargs) -> None:
+        """
+        Run one client call (e.g. pull) on every host, bypassing the
+        concurrency caps.
+
+        Raises:
+            Exception: The first host's error, if every host failed
+        """
+        results = await asyncio.gather(
+            *(getattr(backend.client, method)(**kwargs) for backend in self.backends),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        for backend, result in zip(self.backends, results):
+            if isinstance(result, BaseException):
+                logger.error("Ollama %s on %s failed: %s", method, backend.host, result)
+        if errors and len(errors) == len(self.backends):
+            raise errors[0]
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [backend.status() for backend in self.backends]
+
+
+ollama_pool = OllamaPool()
@@ -1,62 +1,314 @@
-import ollama
-import random
 import json
+import random
 import os
-from logging_config import logger
-from typing import Dict, Any
+import time
+from logging_config import get_logger
+from ollama_pool import OLLAMA_HOSTS, ollama_pool
+from metrics import (
+    llm_descriptions,
+    llm_generation_duration,
+    llm_queue_duration,
+    llm_tokens,
+    llm_tokens_per_second,
+    span,
+)
+from typing import Any, AsyncIterator, Dict, List
 
-# Configure Ollama client with host from environment
-OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
-ollama.host = OLLAMA_HOST
-logger.info(f"Configured Ollama with host: {OLLAMA_HOST}")
+logger = get_logger(__name__)
 
+logger.info("Configured Ollama hosts: %s", ", ".join(OLLAMA_HOSTS))
 
-def generate_player_description(
-    player_name: str, position: str, team: str, player_data: Dict[str, Any]
-) -> str:
+DESCRIPTION_MODEL = "llama3.2:1b"
+DESCRIPTION_LENGTH = 280
+# Seconds an interactive request waits for a description (or, when
+# streaming, its first token) before answering with the fallback
+DESCRIPTION_DEADLINE_SECONDS = float(os.getenv("DESCRIPTION_DEADLINE_SECONDS", "10"))
+# How long Ollama keeps the model loaded after each request
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Players described per model call by chat_descriptions
+DESCRIPTION_BATCH_SIZE = int(os.getenv("DESCRIPTION_BATCH_SIZE", "8"))
+# Output budget per player in a batch: the description plus its JSON framing
+BATCH_TOKENS_PER_PLAYER = 120
+# Model for similar-player text embeddings; empty leaves only the stat-only ones
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "")
+
+# Cumulative counters for async generations, used for throughput reporting
+generation_stats = {"requests": 0, "eval_tokens": 0, "eval_seconds": 0.0}
+
+
+def record_generation(response: Dict[str, Any], elapsed: float, mode: str) -> None:
+    """
+    Export timings of one Ollama request. Ollama reports how long it spent
+    on the request itself, so the rest of the wall-clock time was spent
+    queued behind other requests (or in transit).
     """
-    Generate a concise player description using Ollama.
+    llm_generation_duration.observe(elapsed, mode=mode)
+    total_duration = (response.get("total_duration") or 0) / 1e9
+    if total_duration:
+        llm_queue_duration.observe(max(elapsed - total_duration, 0.0))
+    eval_count = response.get("eval_count") or 0
+    eval_seconds = (response.get("eval_duration") or 0) / 1e9
+    if eval_count and eval_seconds:
+        llm_tokens_per_second.set(eval_count / eval_seconds)
 
-    Args:
-        player_name: Name of the player
-        position: Player's position
-        team: Player's team
-        player_data: Additional player data
 
-    Returns:
-        Generated player description
+def build_description_prompt(player_name: str, position: str, team: str) -> str:
+    """
+    Build the chat prompt used to describe a player.
     """
-    prompt = (
+    return (
         f"Generate a concise 280-character description for a baseball player with these details:\n"
         f"Name: {player_name}\n"
         f"Position: {position}\n"
         f"Team: {team}\n\n"
         f"Include career highlights, playing style, and personal background."
     )
-    logger.info("Preparing to generate description")
-    logger.info("Ollama Model: llama3.2:1b")
-    logger.info(f"Full Prompt: {prompt}")
 
+
+# Identical at the start of every batch request, so Ollama can reuse the
+# prompt cache for it and only process the player lines
+DESCRIPTION_BATCH_INSTRUCTIONS = (
+    "You write concise descriptions of baseball players. For each numbered "
+    "player in the user's message, write one description of at most "
+    f"{DESCRIPTION_LENGTH} characters that includes career highlights, playing "
+    "style, and personal background. Answer with JSON only, in the form "
+    '{"descriptions": [{"player": <number>, "description": "<text>"}]}, '
+    "with exactly one entry per player."
+)
+DESCRIPTION_BATCH_FORMAT = {
+    "type": "object",
+    "properties": {
+        "descriptions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "player": {"type": "integer"},
+                    "description": {"type": "string"},
+                },
+                "required": ["player", "description"],
+            },
+        },
+    },
+    "required": ["descriptions"],
+}
+
+
+def build_batch_prompt(players: List[Dict[str, Any]]) -> str:
+    """
+    Build the user message of a batch request: one numbered line per player,
+    each a dict with player_name, position and team.
+    """
+    return "\n".join(
+        f"{number}. Name: {player.get('player_name')}; Position: {player.get('position')}; "
+        f"Team: {player.get('team')}"
+        for number, player in enumerate(players, start=1)
+    )
+
+
+def parse_batch_descriptions(content: str, count: int) -> Dict[int, str]:
+    """
+    Read the per-player descriptions out of a batch response.
+
+    Returns:
+        Descriptions by 0-based position in the batch, truncated to
+        DESCRIPTION_LENGTH; players without a usable entry are left out
+    """
     try:
-        chat_params = {
-            "model": "llama3.2:1b",
-            "messages": [{"role": "user", "content": prompt}],
-        }
-        logger.info(f"Chat Call Parameters: {chat_params}")
-        response = ollama.chat(**chat_params)
-        message_content = response.get("message", {}).get("content", "")
-        description = message_content[:280]
-        logger.info(f"Generated Description (Length {len(description)}): {description}")
-
-        if not description:
-            logger.warning("Empty description generated")
-            return generate_fallback_description(position, team, player_data)
-
-        return description
-    except Exception as e:
-        logger.error(f"Ollama generation error: {e}")
-        logger.exception("Detailed Ollama generation error")
-        return generate_fallback_description(position, team, player_data)
+        entries = json.loads(content).get("descriptions")
+    except (ValueError, AttributeError):
+        return {}
+    if not isinstance(entries, list):
+        return {}
+    descriptions: Dict[int, str] = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        number, description = entry.get("player"), entry.get("description")
+        if (
+            isinstance(number, int) and 1 <= number <= count
+            and isinstance(description, str) and description.strip()
+        ):
+            descriptions.setdefault(number - 1, description.strip()[:DESCRIPTION_LENGTH])
+    return descriptions
+
+
+async def pull_model() -> None:
+    """
+    Download the description model to every Ollama host that does not have
+    it yet.
+    """
+    logger.info("Pulling %s model to %d host(s)", DESCRIPTION_MODEL, len(OLLAMA_HOSTS))
+    await ollama_pool.broadcast("pull", model=DESCRIPTION_MODEL)
+    logger.info("Successfully pulled %s model", DESCRIPTION_MODEL)
+
+
+async def preload_model() -> None:
+    """
+    Load the description model into memory so the first request does not
+    pay the load time. An empty prompt loads the model without generating.
+    """
+    await ollama_pool.broadcast(
+        "generate", model=DESCRIPTION_MODEL, prompt="", keep_alive=OLLAMA_KEEP_ALIVE
+    )
+    logger.info("Preloaded %s with keep_alive %s", DESCRIPTION_MODEL, OLLAMA_KEEP_ALIVE)
+
+
+async def chat_description(prompt: str) -> str:
+    """
+    Run a description prompt on the least-loaded healthy Ollama host
+    without blocking the event loop.
+
+    Args:
+        prompt: Prompt built by build_description_prompt
+
+    Returns:
+        Generated description, truncated to DESCRIPTION_LENGTH
+
+    Raises:
+        ValueError: If the model returned an empty description
+        NoBackendAvailable: If every Ollama host's circuit is open
+        Exception: Any error raised by the Ollama client
+    """
+    started = time.monotonic()
+    with span("ollama.chat"):
+        response = await ollama_pool.request(
+            "chat",
+            model=DESCRIPTION_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            keep_alive=OLLAMA_KEEP_ALIVE,
+        )
+    record_generation(response, time.monotonic() - started, "chat")
+    generation_stats["requests"] += 1
+    generation_stats["eval_tokens"] += response.get("eval_count") or 0
+    generation_stats["eval_seconds"] += (response.get("eval_duration") or 0) / 1e9
+    llm_tokens.inc(response.get("eval_count") or 0)
+    description = response.get("message", {}).get("content", "")[:DESCRIPTION_LENGTH]
+    if not description:
+        raise ValueError("Empty description generated")
+    llm_descriptions.inc(source="model")
+    return description
+
+
+async def chat_descriptions(players: List[Dict[str, Any]]) -> Dict[int, str]:
+    """
+    Describe several players in one model call. The fixed instructions come
+    first, so consecutive batches share their processed prefix, and the
+    output is constrained to JSON with one entry per player.
+
+    Args:
+        players: Dicts with player_name, position and team
+
+    Returns:
+        Descriptions by position in `players`; players the model skipped or
+        answered unusably are left out for the caller to retry
+
+    Raises:
+        NoBackendAvailable: If every Ollama host's circuit is open
+        Exception: Any error raised by the Ollama client
+    """
+    started = time.monotonic()
+    with span("ollama.chat_batch"):
+        response = await ollama_pool.request(
+            "chat",
+            model=DESCRIPTION_MODEL,
+            messages=[
+                {"role": "system", "content": DESCRIPTION_BATCH_INSTRUCTIONS},
+                {"role": "user", "content": build_batch_prompt(players)},
+            ],
+            format=DESCRIPTION_BATCH_FORMAT,
+            options={"num_predict": BATCH_TOKENS_PER_PLAYER * len(players)},
+            keep_alive=OLLAMA_KEEP_ALIVE,
+        )
+    record_generation(response, time.monotonic() - started, "batch")
+    generation_stats["requests"] += 1
+    generation_stats["eval_tokens"] += response.get("eval_count") or 0
+    generation_stats["eval_seconds"] += (response.get("eval_duration") or 0) / 1e9
+    llm_tokens.inc(response.get("eval_count") or 0)
+    descriptions = parse_batch_descriptions(
+        response.get("message", {}).get("content", ""), len(players)
+    )
+    if descriptions:
+        llm_descriptions.inc(len(descriptions), source="model")
+    return descriptions
+
+
+async def embed_texts(texts: List[str]) -> List[List[float]]:
+    """
+    Embed a batch of texts with EMBEDDING_MODEL in a single Ollama request.
+
+    Raises:
+        ValueError: If Ollama returned a different number of embeddings
+        Exception: Any error raised by the Ollama client
+    """
+    with span("ollama.embed"):
+        response = await ollama_pool.request(
+            "embed", model=EMBEDDING_MODEL, input=texts, keep_alive=OLLAMA_KEEP_ALIVE
+        )
+    embeddings = response.get("embeddings") or []
+    if len(embeddings) != len(texts):
+        raise ValueError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+    return embeddings
+
+
+async def stream_description(prompt: str) -> AsyncIterator[str]:
+    """
+    Stream a description from Ollama piece by piece.
+
+    Generation is cut off server-side once DESCRIPTION_LENGTH characters have
+    been produced: closing the stream drops the connection, which makes
+    Ollama stop generating. The stream holds a slot on the least-loaded
+    healthy host until it ends.
+
+    Args:
+        prompt: Prompt built by build_description_prompt
+
+    Yields:
+        Pieces of the description, DESCRIPTION_LENGTH characters in total at most
+    """
+    started = time.monotonic()
+    async with ollama_pool.backend() as backend:
+        stream = await backend.client.chat(
+            model=DESCRIPTION_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            keep_alive=OLLAMA_KEEP_ALIVE,
+            stream=True,
+        )
+        generation_stats["requests"] += 1
+        produced = 0
+        tokens = 0
+        # The final chunk carries Ollama's timings; it is missing if we cut off early
+        final_chunk: Dict[str, Any] = {}
+        # Each streamed chunk carries one token; time them from the first one
+        first_token_at = None
+        try:
+            async for chunk in stream:
+                piece = chunk.get("message", {}).get("content", "")
+                if piece:
+                    first_token_at = first_token_at or time.monotonic()
+                    generation_stats["eval_tokens"] += 1
+                    tokens += 1
+                piece = piece[:DESCRIPTION_LENGTH - produced]
+                if piece:
+                    produced += len(piece)
+                    yield piece
+                if chunk.get("done"):
+                    final_chunk = chunk
+                    break
+                if produced >= DESCRIPTION_LENGTH:
+                    logger.info("Description budget reached, stopping generation")
+                    break
+        finally:
+            finished = time.monotonic()
+            if first_token_at:
+                generation_stats["eval_seconds"] += finished - first_token_at
+                if not final_chunk.get("eval_duration") and finished > first_token_at:
+                    llm_tokens_per_second.set(tokens / (finished - first_token_at))
+            llm_tokens.inc(tokens)
+            record_generation(final_chunk, finished - started, "stream")
+            if produced:
+                llm_descriptions.inc(source="model")
+            await stream.aclose()
 
 
 def generate_fallback_description(
@@ -73,6 +325,7 @@ def generate_fallback_description(
     Returns:
         Fallback description
     """
+    llm_descriptions.inc(source="fallback")
     fallback_descriptions = [
         f"A talented {position} with a passion for the game.",
         f"Bringing skill and determination to {team}.",
@@ -0,0 +1,140 @@
+import base64
+import json
+import struct
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+# Typed stat columns of the players table
+STAT_COLUMNS = (
+    "games",
+    "at_bat",
+    "runs",
+    "hits",
+    "double_2b",
+    "third_baseman",
+    "home_run",
+    "run_batted_in",
+    "a_walk",
+    "strikeouts",
+    "stolen_base",
+    "caught_stealing",
+    "avg",
+    "on_base_percentage",
+    "slugging_percentage",
+    "on_base_plus_slugging",
+)
+
+# Stat columns stored as REAL; the counts are SMALLINT
+FLOAT_COLUMNS = frozenset(
+    ("avg", "on_base_percentage", "slugging_percentage", "on_base_plus_slugging")
+)
+
+# Columns GET /players can be ordered by; each has a (column, id) index
+SORTABLE_COLUMNS = ("id",) + STAT_COLUMNS
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def real_value(value: float) -> float:
+    """
+    The double nearest `value`'s REAL representation. Postgres compares REAL
+    columns with other numbers in double precision, where a stored 0.3 is
+    0.30000001192092896, so values compared with them are widened the same way.
+    """
+    try:
+        return struct.unpack("f", struct.pack("f", value))[0]
+    except OverflowError:
+        return value
+
+
+def encode_cursor(sort: str, order: str, value: Any, last_id: int) -> str:
+    """
+    Encode the position after the last row of a page as an opaque token.
+
+    Args:
+        sort: Column the page is ordered by
+        order: "asc" or "desc"
+        value: Value of the sort column on the last row
+        last_id: Id of the last row, used as a tie breaker
+
+    Returns:
+        URL-safe cursor token
+    """
+    if isinstance(value, Decimal):
+        # Stats are NUMERIC until migrate_compact has shrunk them; keep their
+        # precision exact across the round trip
+        value = str(value)
+    elif sort in FLOAT_COLUMNS and isinstance(value, float):
+        value = real_value(value)
+    payload = json.dumps({"s": sort, "o": order, "v": value, "id": last_id})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Dict[str, Any]:
+    """
+    Decode a token produced by encode_cursor.
+
+    Raises:
+        InvalidCursor: If the token is malformed or its value does not fit
+            the sort column
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        cursor = {
+            "sort": payload["s"],
+            "order": payload["o"],
+            "value": payload["v"],
+            "id": int(payload["id"]),
+        }
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(f"Malformed cursor: {e}") from e
+    if cursor["sort"] not in SORTABLE_COLUMNS or cursor["order"] not in ("asc", "desc"):
+        raise InvalidCursor("Cursor refers to an unsupported ordering")
+    cursor["value"] = _cursor_value(cursor["sort"], cursor["value"])
+    return cursor
+
+
+def _cursor_value(sort: str, value: Any) -> Any:
+    """
+    Check a decoded sort value against its column's type, so a tampered
+    cursor is rejected here rather than failing in SQL.
+    """
+    if value is None and sort != "id":
+        return value
+    if isinstance(value, bool):
+        raise InvalidCursor("Invalid cursor")
+    if isinstance(value, int):
+        return value
+    if sort in FLOAT_COLUMNS:
+        if isinstance(value, float):
+            return value
+        if isinstance(value, str):
+            # Written by encode_cursor for NUMERIC stats
+            try:
+                number = Decimal(value)
+            except ArithmeticError:
+                number = None
+            if number is not None and number.is_finite():
+                return number
+    raise InvalidCursor("Invalid cursor")
+
+
+def next_cursor(records, sort: str, order: str, page_size: int) -> Optional[str]:
+    """
+    Build the cursor for the page following `records`.
+
+    `records` is fetched with one row more than `page_size` so the last page
+    can be detected without an extra query; each record starts with
+    (id, <sort value>, ...).
+
+    Returns:
+        Cursor token, or None if there are no more rows
+    """
+    if len(records) <= page_size:
+        return None
+    last = records[page_size - 1]
+    return encode_cursor(sort, order, last[1], last[0])
+
@@ -1,6 +1,30 @@
+import json
+import os
+import time
 import httpx
-from typing import List, Dict, Any
-from logging_config import logger
+from typing import List, Dict, Any, Iterator, Optional
+from logging_config import get_logger
+from database_operations import (
+    count_players,
+    store_players,
+    fetch_player_hashes,
+    player_hash,
+    get_feed_sync_state,
+    save_feed_sync_state,
+)
+
+logger = get_logger(__name__)
+
+PLAYER_FEED_URL = os.getenv("PLAYER_FEED_URL", "https://api.hirefraction.com/api/test/baseball")
+# Changed players are written in batches of this size while the feed streams in
+FEED_SYNC_BATCH_SIZE = int(os.getenv("FEED_SYNC_BATCH_SIZE", "1000"))
+
+
+def standardize_player(player: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Standardize one player dictionary's keys to snake_case.
+    """
+    return {k.lower().replace(" ", "_"): v for k, v in player.items()}
 
 
 def standardize_player_keys(players: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -13,32 +37,151 @@ def standardize_player_keys(players: List[Dict[str, Any]]) -> List[Dict[str, Any
     Returns:
         List of players with standardized keys
     """
-    return [
-        {k.lower().replace(" ", "_"): v for k, v in player.items()}
-        for player in players
-    ]
+    return [standardize_player(player) for player in players]
+
+
+class JsonArrayParser:
+    """
+    Incremental parser for a top-level JSON array.
+
+    Text is fed in as it arrives and complete elements are returned as soon
+    as they have been read, so the whole document is never held at once.
+    """
 
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._started = False
+        self._finished = False
 
-async def fetch_external_players() -> List[Dict[str, Any]]:
+    def feed(self, text: str, final: bool = False) -> Iterator[Any]:
+        self._buffer += text
+        pos = 0
+        buffer = self._buffer
+        while not self._finished:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not self._started:
+                if buffer[pos] != "[":
+                    raise ValueError("Player feed is not a JSON array")
+                self._started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                self._finished = True
+                pos += 1
+                break
+            try:
+                item, end = self._decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                break
+            # A value running to the end of the buffer (e.g. a number) may
+            # continue in the next chunk
+            if end >= len(buffer) and not final:
+                break
+            pos = end
+            yield item
+        self._buffer = buffer[pos:]
+        if final and not self._finished:
+            raise ValueError("Player feed ended before the array was closed")
+
+
+async def sync_external_players(
+    url: str = PLAYER_FEED_URL,
+    batch_size: int = FEED_SYNC_BATCH_SIZE,
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+) -> Dict[str, Any]:
     """
-    Fetch players from external API.
+    Incrementally sync the player feed into the database.
+
+    Sends the validators from the previous sync, unless the players table is
+    empty, and skips all work on a 304. Otherwise the body is parsed as it
+    streams in, each player is hashed and only new or changed players are
+    upserted, in batches.
+
+    Args:
+        url: Feed URL
+        batch_size: Number of changed players written per upsert
+        transport: Optional httpx transport, e.g. for a local stub server
 
     Returns:
-        List of players or empty list if fetch fails
+        Sync report with status, bytes fetched, rows seen/changed and duration
+
+    Raises:
+        httpx.HTTPError: If the feed could not be fetched
+        RuntimeError: If changed players could not be stored
     """
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                "https://api.hirefraction.com/api/test/baseball"
-            )
+    started = time.monotonic()
+    report: Dict[str, Any] = {
+        "status": "synced",
+        "bytes_fetched": 0,
+        "rows_seen": 0,
+        "rows_changed": 0,
+        "inserted": 0,
+        "updated": 0,
+        "duration_ms": 0.0,
+    }
+
+    state = await get_feed_sync_state(url)
+    headers = {}
+    # An empty table (truncated, or restored without its players) must be
+    # refilled even if the feed has not changed since the stored validators
+    if await count_players() == 0:
+        state = {"etag": None, "last_modified": None}
+    if state["etag"]:
+        headers["If-None-Match"] = state["etag"]
+    if state["last_modified"]:
+        headers["If-Modified-Since"] = state["last_modified"]
+
+    async with httpx.AsyncClient(transport=transport) as client:
+        async with client.stream("GET", url, headers=headers) as response:
+            if response.status_code == 304:
+                report["status"] = "not_modified"
+                report["duration_ms"] = round((time.monotonic() - started) * 1000, 2)
+                logger.info("Player feed not modified", extra=report)
+                return report
             response.raise_for_status()
-            players = response.json()
-            return standardize_player_keys(players)
-        except httpx.HTTPStatusError as e:
-            logger.error(f"HTTP Status Error: {e}")
-        except httpx.RequestError as e:
-            logger.error(f"Request Error: {e}")
-        except Exception as e:
-            logger.error(f"Unexpected error fetching players: {e}")
-
-        return []
+
+            known_hashes = await fetch_player_hashes() or {}
+            parser = JsonArrayParser()
+            batch: List[Dict[str, Any]] = []
+
+            async def flush():
+                counts = await store_players(batch)
+                if counts is None:
+                    raise RuntimeError("Failed to store players")
+                report["inserted"] += counts["inserted"]
+                report["updated"] += counts["updated"]
+                batch.clear()
+
+            async def consider(raw_player: Dict[str, Any]):
+                player = standardize_player(raw_player)
+                report["rows_seen"] += 1
+                key = (player.get("player_name"), player.get("position"))
+                if known_hashes.get(key) == player_hash(player):
+                    return
+                batch.append(player)
+                if len(batch) >= batch_size:
+                    await flush()
+
+            async for text in response.aiter_text():
+                for raw_player in parser.feed(text):
+                    await consider(raw_player)
+            for raw_player in parser.feed("", final=True):
+                await consider(raw_player)
+            if batch:
+                await flush()
+
+            report["bytes_fetched"] = response.num_bytes_downloaded
+            report["rows_changed"] = report["inserted"] + report["updated"]
+            await save_feed_sync_state(
+                url, response.headers.get("etag"), response.headers.get("last-modified")
+            )
+
+    report["duration_ms"] = round((time.monotonic() - started) * 1000, 2)
+    logger.info("Player feed synced", extra=report)
+    return report
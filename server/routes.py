@@ -1,17 +1,61 @@
-from fastapi import FastAPI, HTTPException, Query, Body
-from typing import Dict, Any
+from fastapi import (
+    FastAPI, HTTPException, Query, Body, Header, Request, Response, WebSocket, WebSocketDisconnect
+)
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import Dict, Any, List, Optional
+import asyncio
 import json
+import re
+import time
+
+import orjson
 
-from logging_config import logger
-from database import conn
+import database
+from logging_config import get_logger
 from database_operations import (
     get_player_by_id,
-    store_players,
+    count_players,
     fetch_paginated_players,
     update_player,
+    patch_player,
+    patch_players,
+    InvalidPatch,
+    PatchConflict,
+    fetch_leaderboard,
+    fetch_aggregates,
+    fetch_player_summaries,
+    fetch_player_documents,
+)
+from pagination import SORTABLE_COLUMNS, STAT_COLUMNS, InvalidCursor, decode_cursor
+from filters import InvalidFilter, player_filters
+from caching import response_cache
+from export import EXPORT_MEDIA_TYPES, InvalidExport, export_columns, export_players
+from metrics import llm_deadline_exceeded, render_metrics, span
+from description_cache import (
+    describe_player,
+    describe_players,
+    cached_description,
+    remember_description,
+)
+from ollama_service import (
+    DESCRIPTION_DEADLINE_SECONDS,
+    build_description_prompt,
+    stream_description,
+    generate_fallback_description,
+)
+from description_worker import description_worker
+from stats_engine import stats_engine
+from embeddings import similarity_index
+from live_updates import InvalidSubscription, live_updates
+from startup import (
+    readiness,
+    start_feed_ingest,
+    feed_ingest_task,
+    ingest_feed,
+    last_feed_sync,
 )
-from player_utils import fetch_external_players
-from ollama_service import generate_player_description
+
+logger = get_logger(__name__)
 
 app = FastAPI()
 
@@ -21,106 +65,651 @@ async def read_root():
     return {"message": "Hello World from Backend"}
 
 
+@app.get("/health/live")
+async def liveness():
+    """
+    Liveness probe: the process is up and serving requests.
+    """
+    return {"status": "ok"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_route():
+    """
+    Prometheus scrape endpoint.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/health/ready")
+async def readiness_route():
+    """
+    Readiness probe with the state of each background startup task.
+    """
+    status = readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
 ...
 
 
+# Top-level keys of a player document, e.g. "home_run" or "on-base_percentage"
+FIELD_NAME = re.compile(r"^[\w\-()]+$")
+MAX_FIELDS = 50
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """
+    Parse a `fields=player_name,hits` projection into a list of keys.
+    """
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    if len(names) > MAX_FIELDS or not all(FIELD_NAME.match(name) for name in names):
+        raise HTTPException(status_code=400, detail="Invalid fields parameter")
+    return names or None
+
+
+def player_page_response(request: Request, result: Dict[str, Any]) -> Response:
+    """
+    Serialize a page from fetch_paginated_players.
+
+    The player documents arrive as JSON text built by Postgres and are
+    spliced into the body unchanged; only the small envelope is encoded.
+    The page's ids are handed to the response cache so it does not have to
+    parse the body again.
+    """
+    envelope = {
+        key: value for key, value in result.items()
+        if key not in ("players", "player_ids", "undescribed")
+    }
+    body = b"".join((
+        b'{"players":[',
+        ",".join(result["players"]).encode(),
+        b"],",
+        # The envelope's own opening brace is replaced by the players array
+        orjson.dumps(envelope)[1:],
+    ))
+    request.state.player_ids = result["player_ids"]
+    return Response(body, media_type="application/json")
+
+
 @app.get("/players")
 async def get_players(
-    page: int = Query(1, ge=1), page_size: int = Query(10, ge=1, le=100)
-) -> Dict[str, Any]:
-    logger.info(f"Received request for players - Page: {page}, Page Size: {page_size}")
+    request: Request,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    sort: str = Query("id"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    position: Optional[str] = Query(None),
+    team: Optional[str] = Query(None),
+    name: Optional[str] = Query(None, max_length=255),
+    stat_filter: List[str] = Query([], alias="filter"),
+    fields: Optional[str] = Query(None),
+) -> Response:
+    logger.debug("Received request for players - Page: %s, Page Size: %s", page, page_size)
 
+    if sort not in SORTABLE_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Cannot sort by '{sort}'")
     try:
-        # Check if database is empty
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM players")
-        player_count = cursor.fetchone()[0]
-        cursor.close()
-
-        # If no players exist, fetch and populate
-        if player_count == 0:
-            logger.info("No players in database. Fetching and populating...")
+        filters = player_filters(position, team, stat_filter, name)
+    except InvalidFilter as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    projection = parse_fields(fields)
 
-            # Fetch players from external API
-            external_players = await fetch_external_players()
+    if not database.pool:
+        raise HTTPException(status_code=503, detail="Database not ready")
 
-            # Standardize keys to snake_case
-            standardized_players = [
-                {k.lower().replace(" ", "_"): v for k, v in player.items()}
-                for player in external_players
-            ]
-
-            # Store players in the database using standardized data
-            if not store_players(conn, standardized_players):
-                raise HTTPException(status_code=500, detail="Failed to store players")
+    try:
+        # An empty table means the startup ingest has not finished or failed;
+        # (re)start it in the background instead of blocking this request
+        if await count_players() == 0:
+            logger.info("No players in database yet. Starting background ingest...")
+            start_feed_ingest()
 
         # Fetch paginated players from the database
-        result = fetch_paginated_players(conn, page, page_size)
+        try:
+            result = await fetch_paginated_players(
+                page, page_size, sort, order, cursor, filters, projection
+            )
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
         if not result:
             raise HTTPException(status_code=500, detail="Failed to fetch players")
 
-        return result
+        # A write to any player can move it onto, off or within a filtered
+        # or stat-sorted page
+        sorted_by = decode_cursor(cursor)["sort"] if cursor else sort
+        request.state.depends_on_all_players = bool(filters) or sorted_by != "id"
+        description_worker.prioritize(result["undescribed"])
+        return player_page_response(request, result)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error in get_players: {e}")
+        logger.error("Error in get_players: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 ...
 
 
+@app.get("/players/export")
+async def export_players_route(
+    format: str = Query("ndjson"),
+    position: Optional[str] = Query(None),
+    team: Optional[str] = Query(None),
+    name: Optional[str] = Query(None, max_length=255),
+    stat_filter: List[str] = Query([], alias="filter"),
+    fields: Optional[str] = Query(None),
+):
+    """
+    Stream every player matching the list filters as NDJSON, CSV or Parquet.
+
+    Rows are read from a server-side cursor in fixed-size batches and
+    written out as they arrive, so server memory stays flat regardless of
+    table size. NDJSON lines are the same documents the list API returns.
+    """
+    try:
+        filters = player_filters(position, team, stat_filter, name)
+        projection = parse_fields(fields)
+        export_columns(format, projection)
+    except (InvalidFilter, InvalidExport) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not database.pool:
+        raise HTTPException(status_code=503, detail="Database not ready")
+
+    # A plain iterator is run in the threadpool, keeping psycopg2 off the loop
+    return StreamingResponse(
+        export_players(format, filters, projection),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="players.{format}"'},
+    )
+
+
+@app.websocket("/players/live")
+async def live_players_route(websocket: WebSocket):
+    """
+    Push player changes as they are written, so clients need not poll
+    /players.
+
+    Clients send JSON messages with any of `subscribe` / `unsubscribe` (lists
+    of player ids) and `page` (the /players list parameters, or null to stop
+    watching). The server answers with `snapshot` messages carrying whole
+    documents, `page` messages with a watched page's ids whenever they
+    change, `changes` messages with per-player diffs ({"id", "set",
+    "unset"?}) and deleted ids, and `error` messages.
+    """
+    await websocket.accept()
+    if not database.pool:
+        await websocket.close(code=1013, reason="Database not ready")
+        return
+    client = live_updates.connect()
+
+    async def send():
+        while True:
+            await websocket.send_text(await client.queue.get())
+
+    sender = asyncio.create_task(send())
+    try:
+        while True:
+            text = await websocket.receive_text()
+            try:
+                await live_updates.handle(client, text)
+            except InvalidSubscription as e:
+                live_updates.reject(client, str(e))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        await live_updates.disconnect(client)
+
+
 @app.put("/players/{player_id}")
 async def update_player_route(player_id: int, player: Dict[str, Any] = Body(...)):
-    logger.info(
-        f"Received update request for player ID: {player_id} with data: {player}"
-    )
+    logger.info("Received update request for player ID: %s", player_id)
 
     try:
-        if update_player(conn, player_id, player):
-            logger.info(f"Player ID {player_id} updated successfully")
+        if await update_player(player_id, player):
+            logger.info("Player ID %s updated successfully", player_id)
             return {"message": f"Player ID {player_id} updated successfully"}
         else:
             raise HTTPException(status_code=404, detail="Player not found")
     except Exception as e:
-        logger.error(f"Database error: {e}")
+        logger.error("Database error: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """
+    Read the expected player version from an If-Match header such as "3".
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    try:
+        return int(if_match.strip().removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be a player version")
+
+
+async def apply_patches(patches: List[Dict[str, Any]]) -> Dict[str, List]:
+    try:
+        result = await patch_players(patches)
+    except PatchConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except InvalidPatch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=500, detail="Failed to update players")
+    return result
+
+
+@app.patch("/players/{player_id}")
+async def patch_player_route(
+    player_id: int,
+    changes: Dict[str, Any] = Body(...),
+    if_match: Optional[str] = Header(None),
+):
+    """
+    Merge the given keys into a player: typed keys update their columns and
+    any others are merged into the player's extras. With If-Match set to the
+    player's version, the patch is refused with 412 if the player has
+    changed since.
+    """
+    result = await apply_patches(
+        [{"id": player_id, "changes": changes, "version": parse_if_match(if_match)}]
+    )
+    if result["not_found"]:
+        raise HTTPException(status_code=404, detail="Player not found")
+    if result["conflicts"]:
+        raise HTTPException(
+            status_code=412,
+            detail=f"Player version is {result['conflicts'][0]['version']}",
+        )
+    return result["updated"][0]
+
+
+@app.patch("/players")
+async def patch_players_route(patches: List[Dict[str, Any]] = Body(...)):
+    """
+    Apply many partial updates in one round trip. Each item is
+    {"id", "changes", "version"?}; players whose version no longer matches are
+    reported under `conflicts` and left unchanged.
+    """
+    return await apply_patches(patches)
+
+
 @app.get("/player/{player_id}/description")
-async def generate_player_description_route(player_id: int):
+async def generate_player_description_route(
+    player_id: int, regenerate: bool = Query(False)
+):
     """
-    Generate a concise player description using Ollama.
+    Return the player's stored description, generating one with Ollama if
+    missing or if `regenerate` is set. A fallback is returned but not stored
+    when the model fails or misses the deadline.
     """
-    logger.info(f"Generating description for player ID: {player_id}")
+    logger.debug("Generating description for player ID: %s", player_id)
 
     # Fetch player record
-    player_record = get_player_by_id(conn, player_id)
+    player_record = await get_player_by_id(player_id)
     if not player_record:
-        logger.warning(f"Player not found with ID: {player_id}")
+        logger.warning("Player not found with ID: %s", player_id)
         raise HTTPException(status_code=404, detail="Player not found")
 
-    player_name = player_record[2]["player_name"]
-    position = player_record[2]["position"]
-    data = player_record[2]
-    logger.info(f"Fetched player: {player_name}, position: {position}, {player_record}")
+    player_name, position, data = player_record
+    logger.debug("Fetched player: %s, position: %s", player_name, position)
     # Parse player data
     if isinstance(data, str):
         player_data = json.loads(data)
     else:
         player_data = data
 
-    # Generate description
-    description = generate_player_description(
-        player_name, position, player_data.get("team"), player_data
-    )
+    if player_data.get("description") and not regenerate:
+        return {"description": player_data["description"]}
 
-    # Update player data with description
-    player_data["description"] = description
+    # Generate description
+    team = player_data.get("team")
+    try:
+        with span("description.generate"):
+            description = await describe_player(
+                player_name, position, team, player_data, refresh=regenerate,
+                fallback=False, deadline=DESCRIPTION_DEADLINE_SECONDS,
+            )
+    except TimeoutError:
+        logger.warning("No description within %gs, using fallback", DESCRIPTION_DEADLINE_SECONDS)
+        description = None
+    except Exception as e:
+        logger.error("Ollama generation error: %s", e)
+        description = None
+    if description is None:
+        # Fallbacks are not stored, so the next request retries the model
+        return {"description": generate_fallback_description(position, team, player_data)}
 
-    # Update player in database
-    if update_player(conn, player_id, player_data):
+    # Store the description alongside the player data
+    if await patch_player(player_id, {"description": description}):
         return {"description": description}
     else:
-        logger.error(f"Failed to update player {player_id} with description")
+        logger.error("Failed to update player %s with description", player_id)
         raise HTTPException(
             status_code=500, detail="Failed to update player description"
         )
+
+
+
+def sse_event(event: str, payload: Dict[str, Any]) -> str:
+    """
+    Format one Server-Sent Events message.
+    """
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+@app.get("/player/{player_id}/description/stream")
+async def stream_player_description_route(
+    player_id: int, regenerate: bool = Query(False)
+):
+    """
+    Stream a player description as Server-Sent Events.
+
+    Emits `token` events as text arrives and a final `done` event carrying the
+    complete description, which is authoritative if generation fell back.
+    Fallbacks are not stored.
+    """
+    logger.debug("Streaming description for player ID: %s", player_id)
+
+    player_record = await get_player_by_id(player_id)
+    if not player_record:
+        logger.warning("Player not found with ID: %s", player_id)
+        raise HTTPException(status_code=404, detail="Player not found")
+
+    player_name, position, data = player_record
+    player_data = json.loads(data) if isinstance(data, str) else data
+    team = player_data.get("team")
+
+    async def events():
+        stored = None if regenerate else player_data.get("description")
+        if stored:
+            yield sse_event("token", {"text": stored})
+            yield sse_event("done", {"description": stored})
+            return
+
+        prompt = build_description_prompt(player_name, position, team)
+        description = None if regenerate else await cached_description(prompt)
+        generated = bool(description)
+        if description:
+            yield sse_event("token", {"text": description})
+        else:
+            pieces = []
+            try:
+                async with asyncio.timeout(DESCRIPTION_DEADLINE_SECONDS) as deadline:
+                    async for piece in stream_description(prompt):
+                        # The deadline covers the first token; after that the
+                        # client is watching text arrive
+                        deadline.reschedule(None)
+                        pieces.append(piece)
+                        yield sse_event("token", {"text": piece})
+                description = "".join(pieces)
+                if not description:
+                    raise ValueError("Empty description generated")
+                await remember_description(prompt, description)
+            except TimeoutError:
+                llm_deadline_exceeded.inc()
+                logger.warning("No description within %gs, using fallback", DESCRIPTION_DEADLINE_SECONDS)
+            except Exception as e:
+                logger.error("Ollama streaming error: %s", e)
+            else:
+                generated = True
+
+        if not generated:
+            # Fallbacks are not stored, so the next request retries the model
+            description = generate_fallback_description(position, team, player_data)
+        elif await patch_player(player_id, {"description": description}):
+            response_cache.invalidate_player(player_id)
+        else:
+            logger.error("Failed to update player %s with description", player_id)
+        yield sse_event("done", {"description": description})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Players one POST /players/descriptions request may describe
+MAX_BATCH_DESCRIPTIONS = 500
+
+
+@app.post("/players/descriptions")
+async def batch_descriptions_route(
+    player_ids: List[int] = Body(..., embed=True),
+    regenerate: bool = Body(False, embed=True),
+):
+    """
+    Describe many players at once, several per model call (see
+    describe_players). Players that already have a description keep it
+    unless `regenerate` is set. Generated descriptions are stored; fallbacks
+    are returned but not stored, so the description worker retries them.
+
+    Reports how each description was obtained and the throughput in
+    players per second.
+    """
+    player_ids = list(dict.fromkeys(player_ids))
+    if len(player_ids) > MAX_BATCH_DESCRIPTIONS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {MAX_BATCH_DESCRIPTIONS} players per request"
+        )
+    started = time.monotonic()
+    documents = await fetch_player_documents(player_ids)
+    if documents is None:
+        raise HTTPException(status_code=500, detail="Failed to fetch players")
+    players = [json.loads(documents[player_id]) for player_id in player_ids if player_id in documents]
+
+    results = {
+        player["id"]: (player["description"], "stored")
+        for player in players if player.get("description") and not regenerate
+    }
+    with span("description.batch"):
+        results.update(await describe_players(
+            [player for player in players if player["id"] not in results], refresh=regenerate
+        ))
+    generated = [
+        {"id": player_id, "changes": {"description": description}}
+        for player_id, (description, source) in results.items()
+        if source not in ("stored", "fallback")
+    ]
+    if generated:
+        stored = await patch_players(generated)
+        if stored is None:
+            raise HTTPException(status_code=500, detail="Failed to store descriptions")
+        for player in stored["updated"]:
+            response_cache.invalidate_player(player["id"])
+    elapsed = time.monotonic() - started
+
+    sources: Dict[str, int] = {}
+    for _, source in results.values():
+        sources[source] = sources.get(source, 0) + 1
+    return {
+        "descriptions": {str(player_id): description for player_id, (description, _) in results.items()},
+        "missing": [player_id for player_id in player_ids if player_id not in documents],
+        "sources": sources,
+        "duration_ms": round(elapsed * 1000, 1),
+        "players_per_second": round(len(results) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+@app.post("/descriptions/jobs")
+async def enqueue_description_jobs_route(
+    player_ids: Optional[List[int]] = Body(None, embed=True)
+):
+    """
+    Queue background description generation for players without one.
+    """
+    queued = await description_worker.enqueue(player_ids)
+    if queued is None:
+        raise HTTPException(status_code=500, detail="Failed to queue description jobs")
+    return {"queued": queued}
+
+
+@app.get("/descriptions/jobs")
+async def description_jobs_progress_route():
+    """
+    Report background description generation progress.
+    """
+    return await description_worker.progress()
+
+
+@app.post("/descriptions/jobs/pause")
+async def pause_description_jobs_route():
+    description_worker.pause()
+    return await description_worker.progress()
+
+
+@app.post("/descriptions/jobs/resume")
+async def resume_description_jobs_route():
+    description_worker.resume()
+    return await description_worker.progress()
+
+
+@app.post("/feed/sync")
+async def sync_feed_route():
+    """
+    Sync the external player feed now and return the sync report.
+    """
+    if feed_ingest_task.running:
+        raise HTTPException(status_code=409, detail="A feed sync is already running")
+    await feed_ingest_task.launch(ingest_feed)
+    if feed_ingest_task.state == "failed":
+        raise HTTPException(status_code=502, detail=feed_ingest_task.error)
+    return last_feed_sync
+
+
+@app.get("/feed/sync")
+async def feed_sync_status_route():
+    """
+    Report the state of the feed sync and the result of the last run.
+    """
+    return {**feed_ingest_task.status(), "last_report": last_feed_sync}
+
+
+@app.get("/leaderboards/{stat}")
+async def leaderboard_route(
+    stat: str,
+    limit: int = Query(10, ge=1, le=database.LEADERBOARD_DEPTH),
+    position: Optional[str] = Query(None),
+):
+    """
+    Top players for a stat, league-wide or within one position.
+    """
+    if stat not in STAT_COLUMNS:
+        raise HTTPException(status_code=404, detail=f"No leaderboard for '{stat}'")
+    leaders = await fetch_leaderboard(stat, limit, position)
+    if leaders is None:
+        raise HTTPException(status_code=500, detail="Failed to fetch leaderboard")
+    return {"stat": stat, "position": position, "leaders": leaders}
+
+
+@app.get("/aggregates")
+async def aggregates_route(
+    group_by: str = Query("league", pattern="^(league|position|team)$")
+):
+    """
+    Player counts, stat means and percentile distributions per group.
+    """
+    groups = await fetch_aggregates(group_by)
+    if groups is None:
+        raise HTTPException(status_code=500, detail="Failed to fetch aggregates")
+    return {"group_by": group_by, "groups": groups}
+
+
+def parse_weights(weights: Optional[str]) -> Optional[Dict[str, float]]:
+    """
+    Parse composite weights given as "stat:weight,stat:weight".
+    """
+    if not weights:
+        return None
+    parsed = {}
+    for item in weights.split(","):
+        stat, _, weight = item.partition(":")
+        stat = stat.strip()
+        if stat not in STAT_COLUMNS:
+            raise HTTPException(status_code=400, detail=f"Unknown stat '{stat}'")
+        try:
+            parsed[stat] = float(weight)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid weight for '{stat}'")
+    return parsed
+
+
+@app.get("/stats/players")
+async def player_stats_route(
+    ids: Optional[str] = Query(None, description="Comma-separated player ids"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(10, ge=1, le=100),
+    weights: Optional[str] = Query(None, description="e.g. home_run:1,avg:2"),
+):
+    """
+    League percentiles, ranks and z-scores for a set of players, or a page
+    of players by id, with an optional weighted composite score.
+    """
+    composite_weights = parse_weights(weights)
+    try:
+        await stats_engine.refresh()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if ids:
+        try:
+            player_ids = [int(player_id) for player_id in ids.split(",") if player_id.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="ids must be integers")
+    else:
+        player_ids = stats_engine.page_ids(page, page_size)
+    return {"players": stats_engine.describe(player_ids, composite_weights)}
+
+
+@app.get("/stats/players/{player_id}")
+async def single_player_stats_route(player_id: int, weights: Optional[str] = Query(None)):
+    """
+    League percentiles, ranks and z-scores for one player.
+    """
+    composite_weights = parse_weights(weights)
+    try:
+        await stats_engine.refresh()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    results = stats_engine.describe([player_id], composite_weights)
+    if not results:
+        raise HTTPException(status_code=404, detail="Player not found")
+    return results[0]
+
+
+@app.get("/players/{player_id}/similar")
+async def similar_players_route(
+    player_id: int,
+    k: int = Query(10, ge=1, le=100),
+    space: str = Query("auto", pattern="^(auto|stats|text)$"),
+):
+    """
+    The k players most similar to a player, nearest first. The "text" space
+    compares Ollama embeddings of stat lines and descriptions, "stats" the
+    stat-only embeddings; "auto" uses text embeddings when the player has one.
+    """
+    try:
+        await similarity_index.refresh()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    resolved_space = similarity_index.space_for(player_id, space)
+    neighbours = similarity_index.similar(player_id, k, resolved_space)
+    if neighbours is None:
+        if player_id not in similarity_index.stats:
+            raise HTTPException(status_code=404, detail="Player not found")
+        raise HTTPException(status_code=503, detail="Text embedding not computed yet")
+    summaries = await fetch_player_summaries([neighbour for neighbour, _ in neighbours])
+    return {
+        "player_id": player_id,
+        "space": resolved_space,
+        "players": [
+            {**summaries[neighbour], "distance": round(distance, 6)}
+            for neighbour, distance in neighbours
+            if neighbour in summaries
+        ],
+    }
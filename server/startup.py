@@ -0,0 +1,203 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import psycopg2
+
+import database
+from logging_config import get_logger
+from cluster import advisory_lock, cluster
+from caching import response_cache
+from description_worker import description_worker, DESCRIPTION_WORKER_ENABLED
+from embeddings import similarity_index
+from leaderboards import refresh_stats_views_periodically
+from live_updates import live_updates
+from ollama_pool import ollama_pool
+from ollama_service import pull_model, preload_model
+from player_utils import sync_external_players
+
+logger = get_logger(__name__)
+
+# Seconds between scheduled feed syncs; 0 disables the schedule
+FEED_SYNC_INTERVAL = float(os.getenv("FEED_SYNC_INTERVAL", "3600"))
+
+
+class StartupTask:
+    """
+    A named piece of background startup work and its current state:
+    pending, running, ready or failed.
+    """
+
+    def __init__(self, name: str, required: bool = False):
+        self.name = name
+        # Readiness waits only on required tasks
+        self.required = required
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def launch(self, work: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        async def run():
+            self.state = "running"
+            self.error = None
+            self.started_at = time.time()
+            self.finished_at = None
+            try:
+                await work()
+                self.state = "ready"
+            except Exception as e:
+                logger.error("Startup task '%s' failed: %s", self.name, e)
+                self.state = "failed"
+                self.error = str(e)
+            finally:
+                self.finished_at = time.time()
+
+        self.task = asyncio.create_task(run())
+        return self.task
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "required": self.required,
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+database_task = StartupTask("database", required=True)
+model_pull_task = StartupTask("model_pull")
+model_preload_task = StartupTask("model_preload")
+feed_ingest_task = StartupTask("feed_ingest")
+description_worker_task = StartupTask("description_worker")
+startup_tasks: List[StartupTask] = [
+    database_task,
+    model_pull_task,
+    model_preload_task,
+    feed_ingest_task,
+    description_worker_task,
+]
+
+
+async def _connect_database() -> None:
+    if not await database.init_pool():
+        raise RuntimeError("Database connection failed")
+
+
+async def _pull_model_once() -> None:
+    # The lock needs a connection; let the database task finish its retries
+    # first rather than fail on a server that is still starting
+    if database_task.task is not None:
+        await asyncio.wait([database_task.task])
+    if database_task.state == "ready":
+        try:
+            # Workers queue behind the first pull; theirs then find the model present
+            async with advisory_lock("ollama_pull"):
+                await pull_model()
+            return
+        except psycopg2.Error as e:
+            logger.warning("Could not take the model pull lock, pulling without it: %s", e)
+    await pull_model()
+
+
+async def _prepare_model() -> None:
+    await model_pull_task.launch(_pull_model_once)
+    if model_pull_task.state == "ready":
+        await model_preload_task.launch(preload_model)
+
+
+last_feed_sync: Dict[str, Any] = {}
+# Long-running startup coroutines, kept so shutdown can cancel them
+_background_tasks: List[asyncio.Task] = []
+
+
+async def ingest_feed() -> Dict[str, Any]:
+    """
+    Incrementally sync the external player feed into the database.
+
+    Runs in one worker at a time. Workers that waited for another's sync
+    send the feed validators it stored, so theirs is usually a 304.
+    """
+    async with advisory_lock("feed_ingest"):
+        report = await sync_external_players()
+    if report["rows_changed"]:
+        response_cache.invalidate_all()
+    if report["inserted"] and description_worker_task.state == "ready":
+        # The worker queued the players it found when it started; queue the
+        # ones this sync added
+        await description_worker.enqueue(retry=False)
+    last_feed_sync.clear()
+    last_feed_sync.update(report)
+    return report
+
+
+async def _sync_feed_periodically() -> None:
+    while True:
+        await asyncio.sleep(FEED_SYNC_INTERVAL)
+        if feed_ingest_task.running:
+            continue
+        await feed_ingest_task.launch(ingest_feed)
+
+
+def start_feed_ingest() -> None:
+    """
+    Start a background feed ingest unless one is already running.
+    """
+    if not feed_ingest_task.running and database_task.state == "ready":
+        feed_ingest_task.launch(ingest_feed)
+
+
+async def _start_data_tasks() -> None:
+    await database_task.launch(_connect_database)
+    if database_task.state != "ready":
+        return
+    _background_tasks.extend(cluster.start())
+    _background_tasks.extend(live_updates.start())
+    start_feed_ingest()
+    _background_tasks.append(asyncio.create_task(refresh_stats_views_periodically()))
+    _background_tasks.append(asyncio.create_task(similarity_index.run()))
+    if FEED_SYNC_INTERVAL > 0:
+        _background_tasks.append(asyncio.create_task(_sync_feed_periodically()))
+    if DESCRIPTION_WORKER_ENABLED:
+        # Let the ingest settle first so the worker sees the full table
+        await feed_ingest_task.task
+        await description_worker_task.launch(description_worker.start)
+
+
+def launch_startup_tasks() -> None:
+    """
+    Kick off all startup work in the background and return immediately,
+    so the API can serve requests while the model and data are prepared.
+    """
+    _background_tasks.append(asyncio.create_task(_start_data_tasks()))
+    _background_tasks.append(asyncio.create_task(_prepare_model()))
+
+
+async def stop_startup_tasks() -> None:
+    """
+    Cancel startup work that is still running.
+    """
+    tasks = _background_tasks + [task.task for task in startup_tasks if task.running]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _background_tasks.clear()
+
+
+def readiness() -> Dict[str, Any]:
+    """
+    Report whether every required startup task is ready, with each task's
+    state and the health of each Ollama host.
+    """
+    return {
+        "ready": all(task.state == "ready" for task in startup_tasks if task.required),
+        "tasks": {task.name: task.status() for task in startup_tasks},
+        "ollama_hosts": ollama_pool.status(),
+    }
@@ -0,0 +1,199 @@
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+
+from logging_config import get_logger
+from database_operations import fetch_stat_rows, on_players_changed
+from pagination import STAT_COLUMNS
+
+logger = get_logger(__name__)
+
+
+class StatsEngine:
+    """
+    Columnar in-memory snapshot of the players' typed stat columns.
+
+    Stats live in one float64 matrix (players x STAT_COLUMNS, NaN for missing
+    values) so percentiles, ranks and z-scores for the whole league come from
+    a handful of vectorized operations. Changed players are re-read
+    individually instead of reloading the table.
+    """
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.values = np.empty((0, len(STAT_COLUMNS)), dtype=np.float64)
+        self._row_of: Dict[int, int] = {}
+        self._loaded = False
+        self._dirty: Set[int] = set()
+        self._dirty_lock = threading.Lock()
+        self._refresh_lock = asyncio.Lock()
+        # League-wide derived arrays, recomputed lazily after changes
+        self._derived: Optional[Dict[str, np.ndarray]] = None
+
+    def mark_changed(self, player_ids: Optional[List[int]]) -> None:
+        with self._dirty_lock:
+            if player_ids is None:
+                # Any player may have changed: reload the whole snapshot
+                self._loaded = False
+            else:
+                self._dirty.update(player_ids)
+
+    def _load(self, rows: List[tuple]) -> None:
+        data = np.array([row[1:] for row in rows], dtype=np.float64).reshape(-1, len(STAT_COLUMNS))
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.values = data
+        self._row_of = {player_id: index for index, player_id in enumerate(self.ids.tolist())}
+
+    def _apply(self, player_ids: Set[int], rows: List[tuple]) -> None:
+        fetched = {row[0]: row[1:] for row in rows}
+        new_rows = []
+        removed = []
+        for player_id in player_ids:
+            index = self._row_of.get(player_id)
+            if player_id not in fetched:
+                if index is not None:
+                    removed.append(index)
+            elif index is None:
+                new_rows.append((player_id, *fetched[player_id]))
+            else:
+                self.values[index] = np.array(fetched[player_id], dtype=np.float64)
+        if removed:
+            keep = np.ones(len(self.ids), dtype=bool)
+            keep[removed] = False
+            self._load([(player_id, *values) for player_id, values in
+                        zip(self.ids[keep].tolist(), self.values[keep].tolist())])
+        if new_rows:
+            self.ids = np.concatenate([self.ids, np.array([row[0] for row in new_rows], dtype=np.int64)])
+            self.values = np.vstack([
+                self.values,
+                np.array([row[1:] for row in new_rows], dtype=np.float64),
+            ])
+            for offset, row in enumerate(new_rows):
+                self._row_of[row[0]] = len(self.ids) - len(new_rows) + offset
+
+    async def refresh(self) -> None:
+        """
+        Load the snapshot on first use, then re-read only changed players.
+        """
+        async with self._refresh_lock:
+            if not self._loaded:
+                with self._dirty_lock:
+                    self._dirty.clear()
+                rows = await fetch_stat_rows()
+                if rows is None:
+                    raise RuntimeError("Failed to load player stats")
+                self._load(rows)
+                self._loaded = True
+                self._derived = None
+                logger.info("Loaded stats snapshot for %d players", len(self.ids))
+                return
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, set()
+            if not dirty:
+                return
+            rows = await fetch_stat_rows(sorted(dirty))
+            if rows is None:
+                self.mark_changed(list(dirty))
+                raise RuntimeError("Failed to refresh player stats")
+            self._apply(dirty, rows)
+            self._derived = None
+
+    def _derive(self) -> Dict[str, np.ndarray]:
+        if self._derived is not None:
+            return self._derived
+        values = self.values
+        valid = ~np.isnan(values)
+        counts = valid.sum(axis=0)
+        # Sorting with NaNs last lets searchsorted work on each column's
+        # valid prefix
+        sorted_values = np.sort(values, axis=0)
+        percentiles = np.full(values.shape, np.nan)
+        ranks = np.full(values.shape, np.nan)
+        for column in range(values.shape[1]):
+            n = counts[column]
+            if not n:
+                continue
+            column_sorted = sorted_values[:n, column]
+            x = values[:, column]
+            below = np.searchsorted(column_sorted, x, side="left")
+            at_or_below = np.searchsorted(column_sorted, x, side="right")
+            mask = valid[:, column]
+            # Mid-rank percentile: ties share the midpoint of their span
+            percentiles[mask, column] = ((below + at_or_below) / 2.0 / n * 100.0)[mask]
+            # Rank 1 is the highest value; ties share the best rank
+            ranks[mask, column] = (n - at_or_below + 1)[mask]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.nanmean(values, axis=0) if len(values) else np.full(values.shape[1], np.nan)
+            stds = np.nanstd(values, axis=0) if len(values) else np.full(values.shape[1], np.nan)
+            z_scores = (values - means) / np.where(stds > 0, stds, np.nan)
+        self._derived = {
+            "percentiles": percentiles,
+            "ranks": ranks,
+            "z_scores": z_scores,
+            "counts": counts,
+        }
+        return self._derived
+
+    def composite(self, weights: Dict[str, float]) -> Dict[str, np.ndarray]:
+        """
+        Weighted sum of z-scores per player (missing stats count as 0), with
+        its league percentile and rank.
+        """
+        derived = self._derive()
+        weight_vector = np.array([weights.get(column, 0.0) for column in STAT_COLUMNS])
+        scores = np.nan_to_num(derived["z_scores"]) @ weight_vector
+        order = np.sort(scores)
+        n = len(scores)
+        below = np.searchsorted(order, scores, side="left")
+        at_or_below = np.searchsorted(order, scores, side="right")
+        return {
+            "scores": scores,
+            "percentiles": (below + at_or_below) / 2.0 / max(n, 1) * 100.0,
+            "ranks": n - at_or_below + 1,
+        }
+
+    def describe(self, player_ids: List[int], weights: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+        """
+        Raw stats, percentiles, ranks and z-scores for the given players, in
+        the order requested. Unknown ids are skipped.
+        """
+        derived = self._derive()
+        composite = self.composite(weights) if weights else None
+        results = []
+        for player_id in player_ids:
+            index = self._row_of.get(player_id)
+            if index is None:
+                continue
+            stats = {}
+            for column_index, column in enumerate(STAT_COLUMNS):
+                value = self.values[index, column_index]
+                if np.isnan(value):
+                    stats[column] = None
+                    continue
+                z_score = derived["z_scores"][index, column_index]
+                stats[column] = {
+                    "value": float(value),
+                    "percentile": round(float(derived["percentiles"][index, column_index]), 2),
+                    "rank": int(derived["ranks"][index, column_index]),
+                    "z_score": None if np.isnan(z_score) else round(float(z_score), 4),
+                }
+            result: Dict[str, Any] = {"id": player_id, "stats": stats}
+            if composite is not None:
+                result["composite"] = {
+                    "score": round(float(composite["scores"][index]), 4),
+                    "percentile": round(float(composite["percentiles"][index]), 2),
+                    "rank": int(composite["ranks"][index]),
+                }
+            results.append(result)
+        return results
+
+    def page_ids(self, page: int, page_size: int) -> List[int]:
+        ordered = np.sort(self.ids)
+        start = (page - 1) * page_size
+        return ordered[start:start + page_size].tolist()
+
+
+stats_engine = StatsEngine()
+on_players_changed(stats_engine.mark_changed)
@@ -0,0 +1,68 @@
+import logging
+import os
+import sys
+
+import psycopg2
+import pytest
+
+# The server modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+import logging_config  # noqa: E402,F401
+from benchmarks.postgres import postgres_fixture  # noqa: E402
+
+# Importing the server sets up logging to logs/; keep test runs out of it
+logging.getLogger().handlers.clear()
+
+
+@pytest.fixture(scope="session")
+def db_url():
+    """
+    A fresh database on TEST_DB_URL's server, or on a temporary local
+    cluster when it is unset. Tests that need one are skipped when no
+    Postgres is available.
+    """
+    try:
+        fixture = postgres_fixture(os.environ.get("TEST_DB_URL"))
+        url = fixture.__enter__()
+    except (RuntimeError, psycopg2.OperationalError) as e:
+        pytest.skip(f"No Postgres available: {e}")
+    try:
+        yield url
+    finally:
+        fixture.__exit__(None, None, None)
+
+
+@pytest.fixture
+def conn(db_url):
+    """
+    A connection to the test database with the schema created and no players.
+    """
+    connection = psycopg2.connect(db_url)
+    database.create_table(connection)
+    try:
+        yield connection
+    finally:
+        connection.rollback()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "TRUNCATE players, player_details, feed_sync_state, description_cache "
+                "RESTART IDENTITY CASCADE"
+            )
+        connection.commit()
+        connection.close()
+
+
+@pytest.fixture
+def pool(conn, db_url, monkeypatch):
+    """
+    The connection pool the @pooled database functions use, on the test database.
+    """
+    monkeypatch.setattr(database, "DB_URL", db_url)
+    db_pool = database.create_pool()
+    monkeypatch.setattr(database, "pool", db_pool)
+    try:
+        yield db_pool
+    finally:
+        db_pool.closeall()
@@ -0,0 +1,43 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from caching import CacheMiddleware, ResponseCache
+
+
+def _client(cache: ResponseCache) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(CacheMiddleware, cache=cache)
+    home_runs = {1: 10, 2: 20}
+
+    @app.get("/players")
+    async def players(request: Request, sort: str = "id"):
+        ids = sorted(home_runs, key=(lambda player_id: -home_runs[player_id]) if sort != "id" else None)
+        request.state.player_ids = ids[:1]
+        request.state.depends_on_all_players = sort != "id"
+        return {"players": [{"id": player_id} for player_id in ids[:1]]}
+
+    @app.put("/players/{player_id}")
+    async def update(player_id: int, home_run: int):
+        home_runs[player_id] = home_run
+        return {}
+
+    return TestClient(app)
+
+
+def test_write_to_any_player_drops_stat_sorted_pages():
+    client = _client(ResponseCache())
+    assert client.get("/players?sort=home_run").json()["players"] == [{"id": 2}]
+    assert client.get("/players?sort=home_run").headers["X-Cache"] == "HIT"
+
+    # Player 1 is not on the page, but now belongs at its top
+    client.put("/players/1?home_run=30")
+    response = client.get("/players?sort=home_run")
+    assert response.headers["X-Cache"] == "MISS"
+    assert response.json()["players"] == [{"id": 1}]
+
+
+def test_write_keeps_id_ordered_pages_of_other_players():
+    client = _client(ResponseCache())
+    client.get("/players")
+    client.put("/players/2?home_run=30")
+    assert client.get("/players").headers["X-Cache"] == "HIT"
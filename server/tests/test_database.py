@@ -0,0 +1,33 @@
+import asyncio
+
+import database
+
+
+def test_connection_params_honor_query(monkeypatch):
+    monkeypatch.setattr(
+        database, "DB_URL", "postgresql://postgres:@/postgres?host=/tmp/pg&sslmode=disable"
+    )
+    params = database._connection_params()
+    assert params["host"] == "/tmp/pg"
+    assert params["sslmode"] == "disable"
+    assert params["database"] == "postgres"
+
+
+def test_init_pool_over_unix_socket(db_url, monkeypatch):
+    monkeypatch.setattr(database, "DB_URL", db_url)
+    monkeypatch.setattr(database, "pool", None)
+    db_pool = asyncio.run(database.init_pool(retries=0, delay=0))
+    try:
+        assert db_pool is not None
+        with db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            assert cursor.fetchone() == (1,)
+    finally:
+        if db_pool:
+            db_pool.closeall()
+
+
+def test_init_pool_gives_up_without_retries(monkeypatch):
+    monkeypatch.setattr(database, "DB_URL", "postgresql://postgres@/postgres?host=/nonexistent")
+    monkeypatch.setattr(database, "pool", None)
+    assert asyncio.run(database.init_pool(retries=0, delay=0)) is None
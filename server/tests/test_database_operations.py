@@ -0,0 +1,76 @@
+import json
+
+import psycopg2
+import pytest
+
+import database
+from database_operations import (
+    enqueue_description_jobs,
+    finish_description_job,
+    get_player_by_id,
+    store_players,
+    update_player,
+)
+
+
+def _player_id(conn) -> int:
+    store_players.sync(conn, [
+        {"player_name": "Old Name", "position": "1B", "team": "NYY", "home_run": 12, "bats": "L"},
+    ])
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT id FROM players")
+        return cursor.fetchone()[0]
+
+
+def test_put_replaces_name_and_position(conn):
+    player_id = _player_id(conn)
+    assert update_player.sync(conn, player_id, {
+        "player_name": "New Name", "position": "LF", "team": "BOS", "home_run": 30,
+    })
+
+    player_name, position, document = get_player_by_id.sync(conn, player_id)
+    document = json.loads(document)
+    assert (player_name, position) == ("New Name", "LF")
+    assert document["player_name"] == "New Name"
+    assert document["position"] == "LF"
+    assert document["team"] == "BOS"
+    assert document["home_run"] == 30
+    assert "bats" not in document
+
+
+def test_put_without_name_keeps_it(conn):
+    player_id = _player_id(conn)
+    assert update_player.sync(conn, player_id, {"team": "BOS"})
+    player_name, position, _ = get_player_by_id.sync(conn, player_id)
+    assert (player_name, position) == ("Old Name", "1B")
+
+
+def test_legacy_schema_is_raised(db_url):
+    connection = psycopg2.connect(db_url)
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS players CASCADE")
+        cursor.execute("CREATE TABLE players (id SERIAL PRIMARY KEY, data JSONB)")
+    connection.commit()
+    try:
+        with pytest.raises(database.LegacySchema):
+            database.create_table(connection)
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE players CASCADE")
+        connection.commit()
+        connection.close()
+
+
+def test_enqueue_without_retry_only_adds_new_jobs(conn):
+    store_players.sync(conn, [
+        {"player_name": "First", "position": "1B"},
+        {"player_name": "Second", "position": "1B"},
+    ])
+    first, second = 1, 2
+    assert enqueue_description_jobs.sync(conn, [first]) == 1
+    assert finish_description_job.sync(conn, first, "failed", "model down")
+
+    assert enqueue_description_jobs.sync(conn, retry=False) == 1
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT player_id, status FROM description_jobs ORDER BY player_id")
+        assert cursor.fetchall() == [(first, "failed"), (second, "pending")]
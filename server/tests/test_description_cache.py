@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+import description_cache
+
+
+@pytest.fixture
+def model(monkeypatch):
+    """
+    Stand-ins for the model and the description_cache table, counting calls.
+    """
+    calls = {"batch": 0, "single": 0, "lookups": 0}
+    stored = {}
+    release = asyncio.Event()
+
+    async def chat_descriptions(players):
+        calls["batch"] += 1
+        await release.wait()
+        return {index: f"Batch {player['player_name']}" for index, player in enumerate(players)}
+
+    async def chat_description(prompt):
+        calls["single"] += 1
+        return "Single"
+
+    async def get_cached_descriptions(keys):
+        calls["lookups"] += 1
+        return {key: stored[key] for key in keys if key in stored}
+
+    async def get_cached_description(key):
+        calls["lookups"] += 1
+        return stored.get(key)
+
+    async def store_cached_description(key, model_name, description):
+        stored[key] = description
+        return True
+
+    for name, function in (
+        ("chat_descriptions", chat_descriptions),
+        ("chat_description", chat_description),
+        ("get_cached_descriptions", get_cached_descriptions),
+        ("get_cached_description", get_cached_description),
+        ("store_cached_description", store_cached_description),
+    ):
+        monkeypatch.setattr(description_cache, name, function)
+    description_cache._memory_cache.clear()
+    calls["release"] = release
+    return calls
+
+
+def _players(count):
+    return [
+        {"id": index, "player_name": f"Player {index}", "position": "1B", "team": "NYY"}
+        for index in range(count)
+    ]
+
+
+def test_cache_lookups_are_one_query(model):
+    async def run():
+        model["release"].set()
+        return await description_cache.describe_players(_players(50))
+
+    results = asyncio.run(run())
+    assert model["lookups"] == 1
+    assert {source for _, source in results.values()} == {"batch"}
+
+
+def test_single_request_joins_batch_generation(model):
+    async def run():
+        batch = asyncio.create_task(description_cache.describe_players(_players(3)))
+        await asyncio.sleep(0)
+        single = asyncio.create_task(
+            description_cache.describe_player("Player 1", "1B", "NYY", {}, deadline=None)
+        )
+        await asyncio.sleep(0)
+        model["release"].set()
+        return await batch, await single
+
+    batch, single = asyncio.run(run())
+    assert single == "Batch Player 1"
+    assert model["single"] == 0
+
+
+def test_batch_joins_running_generation(model):
+    async def run():
+        first = asyncio.create_task(description_cache.describe_players(_players(2)))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(description_cache.describe_players(_players(2)))
+        await asyncio.sleep(0)
+        model["release"].set()
+        return await first, await second
+
+    first, second = asyncio.run(run())
+    assert model["batch"] == 1
+    assert {source for _, source in second.values()} == {"joined"}
+    assert second[0][0] == first[0][0]
@@ -0,0 +1,62 @@
+import pytest
+
+from database_operations import _page_sql, store_players
+from filters import InvalidFilter, filter_clause, parse_stat_filters, player_filters
+
+
+def _store_season(conn, count: int = 3000) -> None:
+    players = [
+        {
+            "player_name": f"Player {index}",
+            "position": "1B",
+            "team": f"T{index % 30}",
+            "games": 100 + index % 60,
+            "home_run": index % 40,
+            "avg": round(0.2 + (index % 100) / 1000, 3),
+        }
+        for index in range(count)
+    ]
+    assert store_players.sync(conn, players)
+    with conn.cursor() as cursor:
+        cursor.execute("ANALYZE players")
+    conn.commit()
+
+
+def _plan(conn, query: str, params) -> str:
+    with conn.cursor() as cursor:
+        cursor.execute("EXPLAIN " + query, params)
+        plan = "\n".join(row[0] for row in cursor.fetchall())
+    conn.rollback()
+    return plan
+
+
+def test_count_bounds_are_integers():
+    assert parse_stat_filters(["home_run>=30", "games<100.0"]) == [
+        ("home_run", ">=", 30),
+        ("games", "<", 100),
+    ]
+    assert all(isinstance(value, int) for _, _, value in parse_stat_filters(["runs=7.0"]))
+
+
+def test_fractional_count_bound_is_rejected():
+    with pytest.raises(InvalidFilter):
+        parse_stat_filters(["home_run>=30.5"])
+
+
+@pytest.mark.parametrize(
+    "expression, index",
+    [("home_run>=38", "players_home_run_id_idx"), ("avg>=.298", "players_avg_id_idx")],
+)
+def test_stat_filter_uses_stat_index(conn, expression, index):
+    _store_season(conn)
+    filters = player_filters(stats=[expression])
+    column = filters["stats"][0][0]
+
+    condition, params = filter_clause(filters)
+    plan = _plan(conn, "SELECT COUNT(*) FROM players WHERE " + condition.as_string(conn), params)
+    assert index in plan, plan
+    assert f"Index Cond: ({column} >=" in plan, plan
+
+    query, params = _page_sql(["id"], column, "desc", filters, 11)
+    plan = _plan(conn, query.as_string(conn), params)
+    assert f"Index Cond: ({column} >=" in plan, plan
@@ -0,0 +1,12 @@
+import json
+import logging
+
+from logging_config import JsonFormatter, get_logger
+
+
+def test_records_carry_the_module_logger_name():
+    logger = get_logger("player_utils")
+    record = logger.makeRecord(logger.name, logging.INFO, __file__, 1, "Synced %d", (3,), None)
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["logger"] == "player_utils"
+    assert entry["message"] == "Synced 3"
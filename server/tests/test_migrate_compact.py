@@ -0,0 +1,72 @@
+import json
+
+import psycopg2
+
+import database
+import migrate_compact
+from benchmarks.postgres import postgres_fixture
+from database_operations import store_players
+
+# The players table as the first release created it
+BASELINE_PLAYERS = """
+    CREATE TABLE players (
+        id SERIAL PRIMARY KEY,
+        player_name VARCHAR(255),
+        position VARCHAR(255),
+        games INTEGER,
+        at_bat INTEGER,
+        runs INTEGER,
+        hits INTEGER,
+        double_2b INTEGER,
+        third_baseman INTEGER,
+        home_run INTEGER,
+        run_batted_in INTEGER,
+        a_walk INTEGER,
+        strikeouts INTEGER,
+        stolen_base INTEGER,
+        caught_stealing INTEGER,
+        avg NUMERIC,
+        on_base_percentage NUMERIC,
+        slugging_percentage NUMERIC,
+        on_base_plus_slugging NUMERIC,
+        data JSONB,
+        UNIQUE (player_name, position)
+    )
+"""
+
+
+def test_baseline_schema_migrates_and_serves(db_url):
+    with postgres_fixture(db_url) as url:
+        conn = psycopg2.connect(url)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(BASELINE_PLAYERS)
+                cursor.execute(
+                    "INSERT INTO players (player_name, position, hits, avg, data) "
+                    "VALUES ('Old Timer', '1B', 120, 0.301, %s)",
+                    (json.dumps({"player_name": "Old Timer", "position": "1B",
+                                 "team": "NYY", "hits": 120, "avg": 0.301, "bats": "L"}),),
+                )
+            conn.commit()
+
+            migrate_compact.expand(conn)
+            migrate_compact.backfill(conn, batch_size=100, pause=0)
+            migrate_compact.contract(conn, lock_timeout=1, attempts=1)
+            database.create_table(conn)
+
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT team, version FROM players")
+                assert cursor.fetchone() == ("NYY", 1)
+                cursor.execute("SELECT total FROM players_count")
+                assert cursor.fetchone() == (1,)
+                cursor.execute("SELECT to_regclass('description_jobs') IS NOT NULL")
+                assert cursor.fetchone() == (True,)
+            conn.commit()
+
+            counts = store_players.sync(conn, [
+                {"player_name": "Old Timer", "position": "1B", "team": "NYY", "hits": 121},
+                {"player_name": "Rookie", "position": "LF", "team": "BOS", "hits": 5},
+            ])
+            assert counts == {"inserted": 1, "updated": 1, "unchanged": 0}
+        finally:
+            conn.close()
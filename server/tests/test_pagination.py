@@ -0,0 +1,40 @@
+import base64
+import json
+from decimal import Decimal
+
+import pytest
+from fastapi.testclient import TestClient
+
+from pagination import InvalidCursor, decode_cursor, encode_cursor
+from routes import app
+
+
+def _token(sort, value):
+    payload = json.dumps({"s": sort, "o": "asc", "v": value, "id": 1})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+@pytest.mark.parametrize("sort, value", [
+    ("home_run", "ten"),
+    ("home_run", 1.5),
+    ("home_run", True),
+    ("avg", "abc"),
+    ("avg", "NaN"),
+    ("avg", [0.3]),
+    ("id", None),
+])
+def test_cursor_value_must_fit_sort_column(sort, value):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(_token(sort, value))
+
+
+def test_encoded_cursors_decode():
+    assert decode_cursor(encode_cursor("home_run", "asc", None, 3))["value"] is None
+    assert decode_cursor(encode_cursor("avg", "asc", Decimal("0.301"), 3))["value"] == Decimal("0.301")
+    assert decode_cursor(encode_cursor("avg", "desc", 0.3, 3))["value"] == pytest.approx(0.3)
+
+
+def test_mismatched_cursor_is_a_bad_request(pool):
+    response = TestClient(app).get("/players", params={"cursor": _token("home_run", "ten")})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
@@ -0,0 +1,38 @@
+import asyncio
+import json
+
+import httpx
+
+from player_utils import sync_external_players
+
+FEED = [
+    {"Player name": "First", "position": "1B", "Hits": 10},
+    {"Player name": "Second", "position": "LF", "Hits": 20},
+]
+
+
+def _feed_transport() -> httpx.MockTransport:
+    def respond(request: httpx.Request) -> httpx.Response:
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304, headers={"ETag": '"v1"'})
+        return httpx.Response(200, headers={"ETag": '"v1"'}, content=json.dumps(FEED))
+
+    return httpx.MockTransport(respond)
+
+
+def test_empty_table_is_refilled_despite_stored_etag(pool, conn):
+    url = "http://feed.test/players"
+
+    async def sync():
+        return await sync_external_players(url, transport=_feed_transport())
+
+    assert asyncio.run(sync())["inserted"] == 2
+    assert asyncio.run(sync())["status"] == "not_modified"
+
+    with conn.cursor() as cursor:
+        cursor.execute("TRUNCATE players CASCADE")
+    conn.commit()
+
+    report = asyncio.run(sync())
+    assert report["status"] == "synced"
+    assert report["inserted"] == 2
@@ -0,0 +1,39 @@
+import asyncio
+
+import description_cache
+import routes
+from database_operations import store_players
+
+
+def test_description_fallback_is_not_stored(pool, conn, monkeypatch):
+    store_players.sync(conn, [{"player_name": "Slow Start", "position": "1B", "team": "NYY"}])
+    release = asyncio.Event()
+
+    async def chat_description(prompt):
+        await release.wait()
+        return "Generated"
+
+    monkeypatch.setattr(description_cache, "chat_description", chat_description)
+    monkeypatch.setattr(routes, "DESCRIPTION_DEADLINE_SECONDS", 0.05)
+    description_cache._memory_cache.clear()
+
+    def stored_description():
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT description FROM player_details WHERE player_id = 1")
+            row = cursor.fetchone()
+        conn.commit()
+        return row[0] if row else None
+
+    async def run():
+        first = await routes.generate_player_description_route(1, regenerate=False)
+        description_after_timeout = stored_description()
+        release.set()
+        await asyncio.sleep(0.1)
+        second = await routes.generate_player_description_route(1, regenerate=False)
+        return first, description_after_timeout, second
+
+    first, description_after_timeout, second = asyncio.run(run())
+    assert first["description"] != "Generated"
+    assert description_after_timeout is None
+    assert second == {"description": "Generated"}
+    assert stored_description() == "Generated"
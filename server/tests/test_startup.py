@@ -0,0 +1,33 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import psycopg2
+
+import startup
+
+
+def test_model_pull_waits_for_database_and_survives_lock_failure(monkeypatch):
+    events = []
+
+    async def connect_database():
+        await asyncio.sleep(0.01)
+        events.append("database")
+
+    @asynccontextmanager
+    async def advisory_lock(name, wait=True):
+        raise psycopg2.OperationalError("too many connections")
+        yield
+
+    async def pull_model():
+        events.append("pull")
+
+    monkeypatch.setattr(startup, "advisory_lock", advisory_lock)
+    monkeypatch.setattr(startup, "pull_model", pull_model)
+    monkeypatch.setattr(startup, "database_task", startup.StartupTask("database", required=True))
+
+    async def run():
+        startup.database_task.launch(connect_database)
+        await startup._pull_model_once()
+
+    asyncio.run(run())
+    assert events == ["database", "pull"]